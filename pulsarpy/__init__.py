@@ -35,6 +35,9 @@ DEFAULT_TO = [os.environ.get("SUPPORT_EMAIL_ADDR", "")]
 
 #: The directory that contains the log files created by the `Model` class.
 LOG_DIR = "Pulsarpy_Logs"
+#: The directory that holds the persistent caches (i.e. model attribute schemas) that are shared
+#: between runs. Can be overridden with the environment variable PULSARPY_CACHE_DIR.
+CACHE_DIR = os.environ.get("PULSARPY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".pulsarpy"))
 URL = os.environ.get("PULSAR_API_URL", "")
 HOST = ""
 if URL:
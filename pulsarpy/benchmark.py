@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+A benchmark suite that measures pulsarpy's throughput against a
+``pulsarpy.fake_server.FakeServer``, such that the cost of a change can be measured without
+touching production. The benchmarks are:
+
+    * get: Fetching a single record by ID.
+    * find_by: Looking up a record by an attribute value.
+    * post_fkeys: POSTing Biosamples whose foreign keys are given as names, which have to be
+      resolved to IDs first.
+    * tab_import: Importing a sheet of Biosamples with the tab_import script, one row at a time.
+    * tab_import_concurrent: The same with the script's --concurrent option.
+    * biosample_family_deep, biosample_family_wide: Walking a synthetic family of Biosamples with
+      the get_biosample_family script, where the family is either a long chain of parts or a root
+      with many parts.
+    * memory_per_record: The memory held per model instance created with ``Model.from_json()``.
+
+Since the server runs in-process with no latency by default, the numbers mostly reflect the
+client-side cost (serialization, name resolution, and the number of round trips); a latency can be
+injected to see the effect of round trips on a real network. Each result records the number of
+operations, the elapsed time, the throughput, and the median and 95th percentile latency of single
+operations where they are timed separately. Results are plain JSON, such that runs from different
+commits can be compared with ``compare()``.
+"""
+
+import contextlib
+import io
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pulsarpy as p
+import pulsarpy.models as models
+from pulsarpy.fake_server import FakeServer
+from pulsarpy.scripts import get_biosample_family
+from pulsarpy.scripts import tab_import
+
+#: The number of reference records (vendors, donors, biosample types and term names) of each model
+#: that Biosamples refer to.
+NUM_REFERENCE_RECORDS = 50
+
+#: The benchmarks run by ``run_all()``, in order, along with their default size.
+BENCHMARKS = [
+    ("get", 500),
+    ("find_by", 500),
+    ("post_fkeys", 300),
+    ("tab_import", 1000),
+    ("tab_import_concurrent", 10000),
+    ("biosample_family_deep", 300),
+    ("biosample_family_wide", 1000),
+    ("memory_per_record", 5000),
+]
+
+#: The fields of the Biosamples created by the benchmarks. The foreign keys are given as names.
+BIOSAMPLE_FIELDS = ["name", "vendor_id", "donor_id", "biosample_type_id", "biosample_term_name_id"]
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def make_result(n, seconds, durations=None, **extra):
+    """
+    Builds the result of a benchmark.
+
+    Args:
+        n: `int`. The number of operations done.
+        seconds: `float`. The total elapsed time.
+        durations: `list`. The time each operation took, if timed separately.
+        extra: Additional values to include.
+
+    Returns:
+        `dict`.
+    """
+    res = {
+        "n": n,
+        "seconds": round(seconds, 4),
+        "ops_per_sec": round(n / seconds, 2) if seconds else None,
+        "p50_ms": None,
+        "p95_ms": None
+    }
+    if durations:
+        res["p50_ms"] = round(_percentile(durations, 50) * 1000, 3)
+        res["p95_ms"] = round(_percentile(durations, 95) * 1000, 3)
+    res.update(extra)
+    return res
+
+
+def _time_each(func, items):
+    durations = []
+    start = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        func(item)
+        durations.append(time.perf_counter() - t)
+    return time.perf_counter() - start, durations
+
+
+def seed_reference_records(server):
+    """
+    Adds the records that the Biosamples of the benchmarks refer to by name.
+    """
+    for model_name, field in zip(["Vendor", "Donor", "BiosampleType", "BiosampleTermName"], BIOSAMPLE_FIELDS[1:]):
+        for i in range(NUM_REFERENCE_RECORDS):
+            server.add_record(model_name, {"name": "{}_{}".format(field[:-3], i)})
+    server.schemas["Biosample"] = ["id", "created_at", "updated_at", "wild_type", "control",
+                                   "part_of_id", "biosample_part_ids", "pooled_biosample_ids",
+                                   "pooled_from_biosample_ids"] + BIOSAMPLE_FIELDS
+
+
+def _biosample_payload(name, i):
+    payload = {"name": name}
+    for field in BIOSAMPLE_FIELDS[1:]:
+        payload[field] = "{}_{}".format(field[:-3], i % NUM_REFERENCE_RECORDS)
+    return payload
+
+
+def bench_get(server, n, workdir):
+    ids = [server.add_record("Biosample", {"name": "get_{}".format(i)})["id"] for i in range(n)]
+    seconds, durations = _time_each(models.Biosample, ids)
+    return make_result(n, seconds, durations)
+
+
+def bench_find_by(server, n, workdir):
+    names = [server.add_record("Biosample", {"name": "find_by_{}".format(i)})["name"] for i in range(n)]
+    seconds, durations = _time_each(lambda x: models.Biosample.find_by({"name": x}), names)
+    return make_result(n, seconds, durations)
+
+
+def bench_post_fkeys(server, n, workdir):
+    payloads = [_biosample_payload("post_{}".format(i), i) for i in range(n)]
+    before = sum(server.request_counts.values())
+    seconds, durations = _time_each(models.Biosample.post, payloads)
+    requests_per_op = (sum(server.request_counts.values()) - before) / float(n)
+    return make_result(n, seconds, durations, requests_per_op=round(requests_per_op, 2))
+
+
+def _bench_tab_import(server, n, concurrent, workdir):
+    prefix = "tab_import_concurrent" if concurrent else "tab_import"
+    infile = os.path.join(workdir, prefix + ".tsv")
+    with open(infile, "w") as fh:
+        fh.write("\t".join(BIOSAMPLE_FIELDS) + "\n")
+        for i in range(n):
+            payload = _biosample_payload("{}_{}".format(prefix, i), i)
+            fh.write("\t".join(payload[x] for x in BIOSAMPLE_FIELDS) + "\n")
+    argv = ["-m", "Biosample", "-i", infile]
+    if concurrent:
+        argv.append("--concurrent")
+    before = sum(server.request_counts.values())
+    start = time.perf_counter()
+    # The script reports each row on stdout.
+    with contextlib.redirect_stdout(io.StringIO()):
+        tab_import.main(argv)
+    seconds = time.perf_counter() - start
+    requests_per_op = (sum(server.request_counts.values()) - before) / float(n)
+    return make_result(n, seconds, requests_per_op=round(requests_per_op, 2))
+
+
+def bench_tab_import(server, n, workdir):
+    return _bench_tab_import(server, n, concurrent=False, workdir=workdir)
+
+
+def bench_tab_import_concurrent(server, n, workdir):
+    return _bench_tab_import(server, n, concurrent=True, workdir=workdir)
+
+
+def make_biosample_family(server, n, shape):
+    """
+    Adds a synthetic family of Biosamples to the server.
+
+    Args:
+        server: `pulsarpy.fake_server.FakeServer`.
+        n: `int`. The number of Biosamples in the family.
+        shape: `str`. 'deep' for a chain in which each Biosample is a part of the previous one, or
+            'wide' for a root with all other Biosamples as its parts.
+
+    Returns:
+        `int`. The ID of the root Biosample.
+    """
+    def add(name, part_of_id):
+        return server.add_record("Biosample", {
+            "name": name, "wild_type": part_of_id is None, "control": False, "part_of_id": part_of_id,
+            "biosample_part_ids": [], "pooled_biosample_ids": [], "pooled_from_biosample_ids": []})
+
+    root = add("{}_family_0".format(shape), None)
+    parent = root
+    for i in range(1, n):
+        child = add("{}_family_{}".format(shape, i), parent["id"])
+        parent["biosample_part_ids"].append(child["id"])
+        if shape == "deep":
+            parent = child
+    return root["id"]
+
+
+def _bench_biosample_family(server, n, shape, workdir):
+    root_id = make_biosample_family(server, n, shape)
+    details = get_biosample_family.BiosampleDetails(outfile=os.path.join(workdir, shape + "_family.tsv"))
+    start = time.perf_counter()
+    try:
+        details.process(root_id)
+    finally:
+        details.fout.close()
+    return make_result(len(details.biosamples_seen), time.perf_counter() - start)
+
+
+def bench_biosample_family_deep(server, n, workdir):
+    # Each level of the chain is a level of recursion.
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, n * 4 + 1000))
+    try:
+        return _bench_biosample_family(server, n, "deep", workdir)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def bench_biosample_family_wide(server, n, workdir):
+    return _bench_biosample_family(server, n, "wide", workdir)
+
+
+def bench_memory_per_record(server, n, workdir):
+    rec = server.add_record("Biosample", _biosample_payload("memory", 0))
+    rec.update(wild_type=True, control=False, part_of_id=None, biosample_part_ids=list(range(5)),
+               pooled_biosample_ids=[], pooled_from_biosample_ids=[])
+    # Distinct dicts, as when records are decoded from separate responses.
+    recs = [dict(rec, id=rec["id"] + i, name="memory_{}".format(i)) for i in range(n)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        instances = [models.Biosample.from_json(x) for x in recs]
+        seconds = time.perf_counter() - start
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del instances
+    return make_result(n, seconds, bytes_per_record=int(held / n))
+
+
+def run_all(latency=0.0, scale=1.0, only=None, stream=sys.stderr):
+    """
+    Runs the benchmarks against a fresh ``FakeServer``, with pulsarpy pointed at it and using a
+    temporary cache directory. pulsarpy is left pointed at the stopped server afterwards.
+
+    Args:
+        latency: `float`. The number of seconds the server delays each request by.
+        scale: `float`. Multiplies the size of each benchmark.
+        only: `list`. The names of the benchmarks to run. Defaults to all of them.
+        stream: File object to report progress to, or `None`.
+
+    Returns:
+        `dict` with the keys 'meta', describing the run, and 'results', which holds the result of
+        each benchmark by name.
+    """
+    benchmarks = [(name, size) for name, size in BENCHMARKS if not only or name in only]
+    unknown = set(only or []) - set(name for name, _ in BENCHMARKS)
+    if unknown:
+        raise ValueError("Unknown benchmark(s): {}.".format(", ".join(sorted(unknown))))
+    workdir = tempfile.mkdtemp(prefix="pulsarpy_benchmark_")
+    cache_dir = p.CACHE_DIR
+    response_cache = models.RESPONSE_CACHE
+    mirror = models.MIRROR
+    log_level = models.Model.debug_logger.level
+    server = FakeServer(latency=latency, seed=0)
+    server.start()
+    results = {}
+    try:
+        p.CACHE_DIR = os.path.join(workdir, "cache")
+        models.use_response_cache(None)
+        models.use_mirror(None)
+        # The debug log records each request and would dominate the timings.
+        models.Model.debug_logger.setLevel(logging.WARNING)
+        models.configure(url=server.api_url, token="benchmark", es_url=server.es_url)
+        seed_reference_records(server)
+        # Open the connections and fill the schema caches before anything is timed.
+        for rec_id in list(server.tables["vendors"])[:20]:
+            models.Vendor(rec_id)
+        for name, size in benchmarks:
+            func = globals()["bench_" + name]
+            n = max(1, int(size * scale))
+            results[name] = func(server, n, workdir=workdir)
+            if stream:
+                stream.write("{:<24} {}\n".format(name, format_result(results[name])))
+                stream.flush()
+    finally:
+        server.stop()
+        p.CACHE_DIR = cache_dir
+        models.use_response_cache(response_cache)
+        models.use_mirror(mirror)
+        models.Model.debug_logger.setLevel(log_level)
+        shutil.rmtree(workdir, ignore_errors=True)
+    meta = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": latency,
+        "scale": scale
+    }
+    return {"meta": meta, "results": results}
+
+
+def format_result(res):
+    text = "n={n} {seconds:.3f}s {ops_per_sec} ops/s".format(**res)
+    if res.get("p50_ms") is not None:
+        text += " p50={p50_ms}ms p95={p95_ms}ms".format(**res)
+    for key in sorted(set(res) - {"n", "seconds", "ops_per_sec", "p50_ms", "p95_ms"}):
+        text += " {}={}".format(key, res[key])
+    return text
+
+
+def compare(previous, current, threshold=0.1):
+    """
+    Compares the throughput of two runs of ``run_all()``. Comparisons are only meaningful between
+    runs with the same latency and scale on the same machine.
+
+    Args:
+        previous: `dict`. The baseline run.
+        current: `dict`. The new run.
+        threshold: `float`. The relative change in throughput beyond which a benchmark is flagged
+            as a regression or an improvement.
+
+    Returns:
+        `list` of `dict`s, one per benchmark present in both runs, with the keys 'name',
+        'previous', 'current' (the ops/s of each), 'change' (the relative change), and 'verdict'
+        ('regression', 'improvement', or 'same').
+    """
+    rows = []
+    for name, res in current["results"].items():
+        prev = previous["results"].get(name)
+        if not prev or not prev.get("ops_per_sec") or not res.get("ops_per_sec"):
+            continue
+        change = res["ops_per_sec"] / prev["ops_per_sec"] - 1
+        verdict = "same"
+        if change < -threshold:
+            verdict = "regression"
+        elif change > threshold:
+            verdict = "improvement"
+        rows.append({"name": name, "previous": prev["ops_per_sec"], "current": res["ops_per_sec"],
+                     "change": round(change, 4), "verdict": verdict})
+    return rows
+
+
+def format_comparison(rows):
+    lines = ["{:<24} {:>12} {:>12} {:>8}".format("benchmark", "before ops/s", "after ops/s", "change")]
+    for row in rows:
+        lines.append("{:<24} {:>12} {:>12} {:>+7.1f}% {}".format(
+            row["name"], row["previous"], row["current"], row["change"] * 100,
+            "" if row["verdict"] == "same" else row["verdict"]))
+    return "\n".join(lines)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Records the HTTP interactions of a run with the Pulsar API and Elasticsearch into a cassette
+file, and replays them later without network access. A problematic run (i.e. a slow production
+import) can thus be captured once and then replayed any number of times, to profile and compare
+the client-side CPU time and request counts of different pulsarpy versions on the exact same
+traffic.
+
+A cassette is a gzip compressed file of JSON lines: a header line, followed by one line per
+interaction in the order they completed. Rails interactions hold the method, the URL path, a
+digest of the request payload, and the response's status, selected headers, and body. Elasticsearch
+interactions hold the client method, a digest of its arguments, and the result. Each also holds
+the time the request took. The API token is never stored. The payload is digested in a canonical
+form (decompressed, and JSON serialized with sorted keys), such that a cassette can be replayed
+regardless of the JSON codec and of the gzip compression of request bodies (see
+``pulsarpy.models.JSON_CODEC`` and ``pulsarpy.models.GZIP_MIN_BYTES``).
+
+When replaying, each request is answered with the recorded response of the interaction having
+the same method, path and body (or client method and arguments), so the replay doesn't depend on
+the URL of the server that was recorded, and identical requests are answered in the order they
+were recorded. The original latency of each interaction can be reproduced, scaled, or skipped.
+A request that wasn't recorded raises `CassetteMiss`.
+
+A cassette is activated with ``pulsarpy.models.use_cassette()``::
+
+    models.use_cassette(Cassette("import.ndjson.gz", mode="record"))
+    ...
+    models.use_cassette(None)  # Writes the cassette.
+
+or from the start by setting the environment variable PULSARPY_CASSETTE to the path of the file,
+along with PULSARPY_CASSETTE_MODE ('record' or 'replay', defaulting to 'replay' if the file exists
+and 'record' otherwise) and PULSARPY_CASSETTE_LATENCY_SCALE (defaulting to 1).
+"""
+
+import base64
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from elasticsearch import exceptions as es_exceptions
+
+#: The version of the cassette format.
+FORMAT_VERSION = 2
+
+#: The response headers that are recorded. Others (i.e. Date and Set-Cookie) aren't used by
+#: pulsarpy.
+RECORDED_HEADERS = ("content-type", "etag", "last-modified", "retry-after", "location")
+
+
+class CassetteMiss(Exception):
+    """
+    Raised when replaying a request that isn't in the cassette.
+    """
+    pass
+
+
+def _digest(data):
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def _get_body_key(data, headers):
+    """
+    Returns the digest of the canonical form of a request body. Bodies that aren't JSON are
+    digested as they are.
+    """
+    if data is None:
+        return None
+    if (headers or {}).get("content-encoding") == "gzip":
+        data = gzip.decompress(data)
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return _digest(data)
+    return _digest(json.dumps(payload, sort_keys=True, separators=(",", ":")))
+
+
+def _get_path(url):
+    parts = urlsplit(url)
+    return parts.path + ("?" + parts.query if parts.query else "")
+
+
+def _get_es_key(api, kwargs):
+    return _digest(json.dumps(kwargs, sort_keys=True, default=str))
+
+
+class Cassette():
+    """
+    Records interactions into, or replays them from, a cassette file.
+    """
+
+    def __init__(self, path, mode="replay", latency_scale=1.0):
+        """
+        Args:
+            path: `str`. The path to the cassette file.
+            mode: `str`. 'record' to record the interactions of this run, overwriting the file, or
+                'replay' to answer requests from the file.
+            latency_scale: `float`. When replaying, multiplies the recorded time each interaction
+                took, i.e. 1 for the original latencies and 0 to answer right away.
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError("Unknown cassette mode '{}'.".format(mode))
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        #: The number of interactions recorded or replayed, keyed by kind ('http' or 'es').
+        self.counts = {"http": 0, "es": 0}
+        #: The header line of the cassette.
+        self.header = {}
+        self._lock = threading.Lock()
+        self._fh = None
+        # When replaying, the recorded interactions by key, in the order they were recorded.
+        self._interactions = {}
+        if mode == "record":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.header = {"cassette": FORMAT_VERSION, "recorded_at": datetime.datetime.now().isoformat()}
+            self._fh = gzip.open(path, "wt", encoding="utf-8")
+            self._fh.write(json.dumps(self.header) + "\n")
+        else:
+            self._load()
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as fh:
+            self.header = json.loads(fh.readline())
+            if self.header.get("cassette") != FORMAT_VERSION:
+                raise ValueError("{} is not a cassette of version {}.".format(self.path, FORMAT_VERSION))
+            for line in fh:
+                entry = json.loads(line)
+                self._interactions.setdefault(self._get_entry_key(entry), []).append(entry)
+
+    @staticmethod
+    def _get_entry_key(entry):
+        if entry["kind"] == "http":
+            return ("http", entry["method"], entry["path"], entry["body"])
+        return ("es", entry["api"], entry["args"])
+
+    def _write(self, entry):
+        line = json.dumps(entry)
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.write(line + "\n")
+            self.counts[entry["kind"]] += 1
+
+    def _next(self, key):
+        """
+        Pops the next recorded interaction with the given key. The last one is kept, such that
+        requests repeated more often than when recording still get an answer.
+        """
+        with self._lock:
+            entries = self._interactions.get(key)
+            if not entries:
+                raise CassetteMiss("No recorded interaction matches {}.".format(key[:-1]))
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+            self.counts[entry["kind"]] += 1
+        if self.latency_scale:
+            time.sleep(entry["elapsed"] * self.latency_scale)
+        return entry
+
+    def wrap_session(self, session):
+        """
+        Returns a stand-in for the given ``requests.Session`` that records or replays the
+        requests sent through its ``request()`` method.
+        """
+        return _CassetteSession(self, session)
+
+    def wrap_es(self, client):
+        """
+        Returns a stand-in for the given ``elasticsearch.Elasticsearch`` client that records or
+        replays the calls to its methods.
+        """
+        return _CassetteESClient(self, client)
+
+    def close(self):
+        """
+        Finishes writing the cassette when recording.
+        """
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    ###
+    # Rails API
+    ###
+
+    def send(self, session, method, url, data=None, headers=None, **kwargs):
+        body_key = _get_body_key(data, headers)
+        if self.mode == "replay":
+            return self._replay_response(self._next(("http", method, _get_path(url), body_key)), url)
+        entry = {"kind": "http", "method": method, "path": _get_path(url), "body": body_key}
+        start = time.monotonic()
+        try:
+            res = session.request(method, url, data=data, headers=headers, **kwargs)
+        except requests.exceptions.RequestException as e:
+            entry.update(elapsed=time.monotonic() - start, error=type(e).__name__, message=str(e))
+            self._write(entry)
+            raise
+        entry["elapsed"] = time.monotonic() - start
+        entry["status"] = res.status_code
+        entry["headers"] = {k: v for k, v in res.headers.items() if k.lower() in RECORDED_HEADERS}
+        content = res.content
+        try:
+            entry["text"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["base64"] = base64.b64encode(content).decode("ascii")
+        self._write(entry)
+        return res
+
+    @staticmethod
+    def _replay_response(entry, url):
+        if "error" in entry:
+            raise getattr(requests.exceptions, entry["error"], requests.exceptions.ConnectionError)(entry["message"])
+        res = requests.models.Response()
+        res.status_code = entry["status"]
+        res.url = url
+        res.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+        if "text" in entry:
+            res._content = entry["text"].encode("utf-8")
+        else:
+            res._content = base64.b64decode(entry["base64"])
+        res.encoding = "utf-8"
+        return res
+
+    ###
+    # Elasticsearch
+    ###
+
+    def call_es(self, client, api, kwargs):
+        key = _get_es_key(api, kwargs)
+        if self.mode == "replay":
+            entry = self._next(("es", api, key))
+            if "error" in entry:
+                error = entry["error"]
+                status = error["status"]
+                exc_class = es_exceptions.HTTP_EXCEPTIONS.get(status, es_exceptions.TransportError)
+                raise exc_class(status, error["message"], error["info"])
+            return entry["result"]
+        entry = {"kind": "es", "api": api, "args": key}
+        start = time.monotonic()
+        try:
+            result = getattr(client, api)(**kwargs)
+        except es_exceptions.TransportError as e:
+            entry["elapsed"] = time.monotonic() - start
+            entry["error"] = {"status": e.status_code, "message": str(e.error), "info": e.info if isinstance(e.info, (dict, str)) else None}
+            self._write(entry)
+            raise
+        entry["elapsed"] = time.monotonic() - start
+        entry["result"] = result
+        self._write(entry)
+        return result
+
+
+class _CassetteSession():
+
+    def __init__(self, cassette, session):
+        self.cassette = cassette
+        #: The wrapped ``requests.Session``.
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.cassette.send(self.session, method, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class _CassetteESClient():
+
+    def __init__(self, cassette, client):
+        self.cassette = cassette
+        #: The wrapped ``elasticsearch.Elasticsearch`` client.
+        self.client = client
+
+    def __getattr__(self, api):
+        def call(**kwargs):
+            return self.cassette.call_es(self.client, api, kwargs)
+        return call
+
+
+def from_env():
+    """
+    Creates the cassette given by the environment variables PULSARPY_CASSETTE,
+    PULSARPY_CASSETTE_MODE, and PULSARPY_CASSETTE_LATENCY_SCALE, or returns `None` if
+    PULSARPY_CASSETTE isn't set.
+    """
+    path = os.environ.get("PULSARPY_CASSETTE")
+    if not path:
+        return None
+    mode = os.environ.get("PULSARPY_CASSETTE_MODE") or ("replay" if os.path.exists(path) else "record")
+    latency_scale = float(os.environ.get("PULSARPY_CASSETTE_LATENCY_SCALE", 1.0))
+    return Cassette(path, mode=mode, latency_scale=latency_scale)
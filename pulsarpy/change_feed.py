@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Durable cursors over the change feed of a model, as given by
+``pulsarpy.models.Model.changed_since()``. A cursor remembers the updated_at timestamp of the
+latest change a job has processed (its high-water mark), such that each run of a polling job (i.e.
+an ENCODE submission or a QC dashboard refresh) only processes the records that changed since the
+previous run::
+
+    cursor = ChangeCursor("qc_dashboard", models.Library)
+    for rec in cursor.changes():
+        process(rec)
+    cursor.commit()
+
+Delivery is at least once: the records updated exactly at the high-water mark are delivered again
+by the next run, so that records indexed late with the same timestamp aren't missed. Processing
+should therefore be idempotent.
+"""
+
+import json
+import os
+import tempfile
+
+import pulsarpy as p
+
+
+class ChangeCursor():
+    """
+    Stores the high-water mark of a named consumer of a model's changes in the file
+    $CACHE_DIR/cursors/$HOST/$NAME_$MODEL.json.
+    """
+
+    def __init__(self, name, model, cursor_dir=None):
+        """
+        Args:
+            name: `str`. The name of the consumer, which must be unique per job.
+            model: The model class whose changes to follow.
+            cursor_dir: `str`. The directory of the cursor file. Defaults to $CACHE_DIR/cursors/$HOST.
+        """
+        self.name = name
+        self.model = model
+        cursor_dir = cursor_dir or os.path.join(p.CACHE_DIR, "cursors", p.HOST or "localhost")
+        self.path = os.path.join(cursor_dir, "{}_{}.json".format(name, model.__name__))
+        #: The latest updated_at timestamp returned by ``changes()`` that isn't committed yet.
+        self.pending = None
+
+    def read(self):
+        """
+        Returns the committed high-water mark as an ISO 8601 `str`, or `None` if there isn't one.
+        """
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)["updated_at"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def changes(self, fields=None):
+        """
+        Lazily streams the records that changed since the committed high-water mark, or all
+        records if nothing was committed yet. The latest timestamp streamed is kept in ``pending``
+        until ``commit()`` is called.
+
+        Args:
+            fields: `list`. Only fetch these fields of each record. Defaults to all fields.
+
+        Returns:
+            A generator of `dict` records as indexed into Elasticsearch.
+        """
+        for rec in self.model.changed_since(self.read(), fields=fields, inclusive=True):
+            self.pending = max(self.pending or "", rec.get("updated_at") or "") or None
+            yield rec
+
+    def commit(self, timestamp=None):
+        """
+        Durably stores a new high-water mark. The file is replaced atomically, so an interrupted
+        commit leaves the previous high-water mark in place.
+
+        Args:
+            timestamp: ISO 8601 `str`. Defaults to ``pending``, in which case nothing is done if no
+                changes were streamed.
+        """
+        timestamp = timestamp or self.pending
+        if not timestamp:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump({"updated_at": timestamp}, fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.pending = None
+
+    def reset(self):
+        """
+        Forgets the high-water mark, such that the next run processes all records.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.pending = None
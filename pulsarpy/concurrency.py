@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Adaptive concurrency control for bulk operations against the Pulsar server.
+
+Bulk helpers such as ``bulk_map()`` run many model operations in a thread pool, while every HTTP
+call made on their behalf holds a slot of the process-wide ``LIMITER`` for the duration of the
+request. The limiter follows an AIMD (additive increase, multiplicative decrease) policy: the
+in-flight window grows by one request per round trip while latency stays near its baseline, and is
+cut back when the server responds with 429/5xx or latency spikes. Thus bulk jobs find the largest
+sustainable request rate on their own instead of being tuned by hand.
+"""
+
+import collections
+import concurrent.futures
+import contextvars
+import os
+import random
+import threading
+import time
+
+#: The largest number of requests that may be in flight at once. Can be set via the environment
+#: variable PULSARPY_MAX_CONCURRENCY.
+MAX_CONCURRENCY = int(os.environ.get("PULSARPY_MAX_CONCURRENCY", 32))
+
+#: The number of times a failed request is retried before giving up.
+MAX_RETRIES = int(os.environ.get("PULSARPY_MAX_RETRIES", 3))
+
+#: The base delay, in seconds, of the exponential backoff between retries.
+RETRY_BASE_DELAY = 0.5
+
+#: The longest delay, in seconds, between two retries.
+RETRY_MAX_DELAY = 30
+
+#: The result of one item processed by ``bulk_map()``. Exactly one of `value` and `error` is set.
+Result = collections.namedtuple("Result", ["item", "value", "error"])
+
+
+class AdaptiveLimiter():
+    """
+    Bounds the number of concurrent requests with a window that is adjusted after each completed
+    request.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=MAX_CONCURRENCY, backoff_ratio=0.5,
+                 latency_tolerance=2.0, smoothing=0.2):
+        """
+        Args:
+            initial: `int`. The initial size of the in-flight window.
+            min_limit: `int`. The window never shrinks below this.
+            max_limit: `int`. The window never grows above this.
+            backoff_ratio: `float`. The factor the window is multiplied by upon overload.
+            latency_tolerance: `float`. Latency is considered to spike once its moving average
+                exceeds the baseline latency by this factor. Both are tracked per kind of request,
+                since a bulk create is always much slower than a find_by.
+            smoothing: `float`. The weight of the newest sample in the latency moving average.
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        #: Exponentially weighted moving average of the request latency, in seconds, by kind of
+        #: request.
+        self.avg_latency = {}
+        #: The latency the server exhibits when it isn't under pressure, in seconds, by kind of
+        #: request.
+        self.baseline_latency = {}
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until there is room in the in-flight window and then takes a slot.
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded=False, kind=None):
+        """
+        Gives back a slot and adjusts the window based on how the request went.
+
+        Args:
+            latency: `float`. The number of seconds the request took.
+            overloaded: `bool`. True if the server signaled overload, i.e. with a 429 or 5xx status,
+                or if the connection failed.
+            kind: The kind of request, i.e. a (endpoint class, operation) `tuple`. Latency spikes
+                are only detected between requests of the same kind.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded:
+                self._decrease(now, self.avg_latency.get(kind))
+            else:
+                self._observe_latency(kind, latency)
+                if self.avg_latency[kind] > self.baseline_latency[kind] * self.latency_tolerance:
+                    self._decrease(now, self.avg_latency[kind])
+                else:
+                    # Additive increase: grow by about one request per full window of completions.
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _observe_latency(self, kind, latency):
+        avg = self.avg_latency.get(kind)
+        if avg is None:
+            self.avg_latency[kind] = latency
+            self.baseline_latency[kind] = latency
+            return
+        avg += self.smoothing * (latency - avg)
+        self.avg_latency[kind] = avg
+        baseline = self.baseline_latency[kind]
+        if latency < baseline:
+            self.baseline_latency[kind] = latency
+        else:
+            # Let the baseline follow slow, lasting changes in server latency.
+            self.baseline_latency[kind] = baseline + 0.01 * (avg - baseline)
+
+    def _decrease(self, now, round_trip):
+        # Back off at most once per round trip, since all requests in flight at the time of an
+        # overload signal are likely to report it as well.
+        if now - self._last_decrease < (round_trip or 0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+
+#: The limiter shared by all requests that are sent to the Pulsar server from this process.
+LIMITER = AdaptiveLimiter()
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Computes how long to wait before retrying a request using exponential backoff with full
+    jitter, so that concurrent clients don't retry in lock step.
+
+    Args:
+        attempt: `int`. The 0-based number of the attempt that failed.
+        retry_after: `str`. The value of the response's Retry-After header, if any, which is
+            honored when given in seconds.
+
+    Returns:
+        `float`. The number of seconds to sleep.
+    """
+    if retry_after:
+        try:
+            return min(RETRY_MAX_DELAY, float(retry_after))
+        except ValueError:
+            pass
+    cap = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def bulk_map(func, items, max_workers=None):
+    """
+    Calls `func` on each item using a thread pool. The number of requests actually in flight is
+    governed by ``LIMITER``, so the pool size merely caps it. Exceptions are captured per item
+    rather than aborting the whole batch. Each call runs in a copy of the caller's context, such
+    that ``pulsarpy.tracing`` spans opened by `func` nest under the caller's span.
+
+    Args:
+        func: A callable that takes a single item.
+        items: An iterable of items.
+        max_workers: `int`. The size of the thread pool. Defaults to ``LIMITER.max_limit``.
+
+    Returns:
+        `list` of `Result` instances in the same order as `items`.
+    """
+    items = list(items)
+    if not items:
+        return []
+    max_workers = min(len(items), max_workers or LIMITER.max_limit)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    results = []
+    for item, future in zip(items, futures):
+        error = future.exception()
+        if error:
+            results.append(Result(item=item, value=None, error=error))
+        else:
+            results.append(Result(item=item, value=future.result(), error=None))
+    return results
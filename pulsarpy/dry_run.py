@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+A dry-run mode for the model layer, which tells how many calls a job (i.e. a large tab_import
+or clone_crispr_modification batch) would make to the Pulsar API and to Elasticsearch before it
+is run for real, such that heavy jobs can be scheduled off-peak::
+
+    with DryRun() as plan:
+        models.Biosample.post_many(payloads)
+    print(plan.format_summary(concurrency=8))
+
+While a dry run is active, reads (GET requests, find_by and find_by_or searches, and all
+Elasticsearch requests) are sent to the servers as usual, or served from the response cache and
+the mirror when those are in use. Writes (POST, PATCH, PUT, and DELETE requests) are intercepted
+instead and answered with a made-up success: created records are given synthetic IDs starting at
+``SYNTHETIC_ID_START``, and later requests for a synthetic record are answered from memory. Every
+call is counted by endpoint along with the time it took, or is estimated to take in the case of
+writes, and the names that were resolved to record IDs are collected by model.
+
+A dry run can't resolve the names of records that the job itself would create, so jobs whose
+input refers to records created earlier in the same input fail in dry-run mode. Whether the server
+has a model's bulk create endpoint is found out the first time it would be used, by sending it an
+empty list of records; if it doesn't, the intercepted bulk create is answered with a 404, such that
+the per-record POSTs that the job would fall back to are counted.
+"""
+
+import gzip
+import itertools
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import pulsarpy.models as models
+from pulsarpy import tracing
+
+#: The first ID given to the records created during a dry run.
+SYNTHETIC_ID_START = 10 ** 12
+
+#: The number of seconds an intercepted write is estimated to take, by default.
+DEFAULT_WRITE_LATENCY = 0.25
+
+#: Custom actions that are sent as POST requests but only read.
+READ_ACTIONS = ("find_by", "find_by_or")
+
+#: Matches names that ``Model.replace_name_with_id()`` treats as IDs, i.e. 8 or B-8.
+_ID_REGEX = re.compile(r"^([A-Z]+-)?\d+$")
+
+
+class DryRun():
+    """
+    Counts the calls made while active, with writes intercepted. Use as a context manager, or call
+    ``start()`` and ``stop()``.
+    """
+
+    def __init__(self, write_latency=DEFAULT_WRITE_LATENCY):
+        """
+        Args:
+            write_latency: `float`. The number of seconds each intercepted write is estimated to
+                take.
+        """
+        self.write_latency = write_latency
+        #: The calls, keyed by (service, model, op), where service is 'rails' or 'es', model is the
+        #: model name or index name, and op is as in ``pulsarpy.metrics``. Each value is a `dict`
+        #: with the keys 'count', 'seconds' (measured, or estimated for writes), 'intercepted', and
+        #: 'write'.
+        self.calls = {}
+        #: The distinct names that were resolved to record IDs, keyed by model name.
+        self.fkey_names = {}
+        #: The synthetic records, keyed by URL.
+        self.records = {}
+        self._ids = itertools.count(SYNTHETIC_ID_START)
+        self._lock = threading.Lock()
+        self._session = None
+        self._es_client = None
+        self._bulk_create_support = None
+        #: Whether the server has the bulk create endpoint, keyed by its URL.
+        self._bulk_create_probes = {}
+
+    def start(self):
+        """
+        Installs the dry run in ``pulsarpy.models``.
+        """
+        self._session = models.SESSION
+        models.SESSION = _DryRunSession(self, self._session)
+        self._es_client = models.Model.ES.ES
+        models.Model.ES.ES = _DryRunESClient(self, self._es_client)
+        self._bulk_create_support = dict(models._BULK_CREATE_SUPPORT)
+        tracing.add_exporter(self)
+        return self
+
+    def stop(self):
+        """
+        Restores the normal sending of requests.
+        """
+        tracing.remove_exporter(self)
+        models.SESSION = self._session
+        models.Model.ES.ES = self._es_client
+        # Don't let the made-up bulk create responses stick.
+        models._BULK_CREATE_SUPPORT.clear()
+        models._BULK_CREATE_SUPPORT.update(self._bulk_create_support)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, key, seconds, intercepted, write=False):
+        with self._lock:
+            entry = self.calls.setdefault(key, {"count": 0, "seconds": 0.0, "intercepted": intercepted, "write": write})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+
+    ###
+    # Tracing exporter, which sees the name lookups.
+    ###
+
+    def export(self, sp):
+        if not sp.name.endswith(".replace_name_with_id"):
+            return
+        name = sp.attrs.get("name")
+        if not isinstance(name, str) or _ID_REGEX.match(name):
+            return
+        with self._lock:
+            self.fkey_names.setdefault(sp.name.split(".")[0], set()).add(name)
+
+    def close(self):
+        pass
+
+    ###
+    # Rails API
+    ###
+
+    def send(self, session, method, url, data=None, headers=None, **kwargs):
+        model = models.get_model_for_url(url)
+        op = models.get_request_op(method, url)
+        key = ("rails", model.__name__ if model else "", op)
+        write = not (method in ("GET", "HEAD") or (method == "POST" and op in READ_ACTIONS))
+        if not write and not _is_synthetic_url(url):
+            start = time.monotonic()
+            res = session.request(method, url, data=data, headers=headers, **kwargs)
+            self._count(key, time.monotonic() - start, intercepted=False)
+            return res
+        self._count(key, self.write_latency if write else 0.0, intercepted=True, write=write)
+        if op == "bulk_create" and not self._has_bulk_create(session, url, headers or {}, model):
+            return _make_response(url, 404, {"error": "not found"})
+        return self._make_response(method, url, data, headers or {}, model, op)
+
+    def _has_bulk_create(self, session, url, headers, model):
+        """
+        Tells whether the server has the bulk create endpoint at the given URL, by sending it an
+        empty list of records the first time, which creates nothing when it does.
+        """
+        if model and models._BULK_CREATE_SUPPORT.get(model.URL) is True:
+            return True
+        with self._lock:
+            if url in self._bulk_create_probes:
+                return self._bulk_create_probes[url]
+        key = model.ES_INDEX_NAME if model else url.rstrip("/").split("/")[-2]
+        headers = {k: v for k, v in headers.items() if k.lower() != "content-encoding"}
+        # Not counted, since the job itself doesn't send it.
+        res = session.request("POST", url, data=models.json_dumps({key: []}), headers=headers, verify=False)
+        supported = res.status_code not in (404, 405, 501)
+        with self._lock:
+            self._bulk_create_probes[url] = supported
+        return supported
+
+    def _make_response(self, method, url, data, headers, model, op):
+        payload = None
+        if data:
+            if headers.get("content-encoding") == "gzip":
+                data = gzip.decompress(data)
+            payload = models.json_loads(data)
+        record_url = url.split("?", 1)[0].rstrip("/")
+        status = 200
+        if method in ("GET", "HEAD"):
+            body = self.records.get(record_url)
+            if body is None:
+                status, body = 404, {"error": "not found"}
+        elif method == "DELETE":
+            self.records.pop(record_url, None)
+            status, body = 204, None
+        elif op == "bulk_create":
+            status = 201
+            body = [self._create(model, x) for x in next(iter(payload.values()))]
+        elif op == "post" and model:
+            status = 201
+            body = self._create(model, payload)
+        elif method in ("PATCH", "PUT"):
+            rec_id = record_url.rsplit("/", 1)[-1]
+            body = dict(self.records.get(record_url) or {"id": int(rec_id) if rec_id.isdigit() else rec_id})
+            body.update(_unwrap(payload))
+            if record_url in self.records:
+                self.records[record_url] = body
+        else:
+            # Another custom action, i.e. clone.
+            body = {}
+        return _make_response(url, status, body)
+
+    def _create(self, model, payload):
+        rec = dict(_unwrap(payload))
+        rec["id"] = next(self._ids)
+        with self._lock:
+            self.records[model.get_record_url(rec["id"])] = rec
+        return rec
+
+    ###
+    # Elasticsearch
+    ###
+
+    def call_es(self, client, api, kwargs):
+        start = time.monotonic()
+        try:
+            return getattr(client, api)(**kwargs)
+        finally:
+            self._count(("es", kwargs.get("index") or "", api), time.monotonic() - start, intercepted=False)
+
+    ###
+    # Reporting
+    ###
+
+    def summary(self, concurrency=1):
+        """
+        Summarizes the calls made so far.
+
+        Args:
+            concurrency: `int`. The number of calls the job would have in flight at once, which the
+                wall time is estimated for.
+
+        Returns:
+            `dict` with the keys:
+
+                * calls: `list` of `dict`s, one per endpoint, with the keys 'service', 'model',
+                  'op', 'count', 'seconds', 'intercepted', and 'write', sorted by count.
+                * reads, writes, total: The number of calls.
+                * call_seconds: The total time of all calls, measured or estimated.
+                * concurrency: As given.
+                * estimated_seconds: The estimated wall time at the given concurrency.
+                * fkey_names: `dict` of the sorted distinct names resolved, by model name.
+        """
+        with self._lock:
+            calls = [dict(service=k[0], model=k[1], op=k[2], **v) for k, v in self.calls.items()]
+            fkey_names = {k: sorted(v) for k, v in self.fkey_names.items()}
+        calls.sort(key=lambda x: (-x["count"], x["service"], x["model"], x["op"]))
+        writes = sum(x["count"] for x in calls if x["write"])
+        total = sum(x["count"] for x in calls)
+        call_seconds = sum(x["seconds"] for x in calls)
+        return {
+            "calls": calls,
+            "reads": total - writes,
+            "writes": writes,
+            "total": total,
+            "call_seconds": round(call_seconds, 3),
+            "concurrency": concurrency,
+            "estimated_seconds": round(call_seconds / max(1, concurrency), 3),
+            "fkey_names": fkey_names
+        }
+
+    def format_summary(self, concurrency=1):
+        """
+        Returns ``summary()`` as human-readable text.
+        """
+        summary = self.summary(concurrency=concurrency)
+        lines = ["Dry run: {total} calls ({reads} reads, {writes} intercepted writes).".format(**summary)]
+        lines.append("{:<6} {:<28} {:<26} {:>8} {:>10}".format("", "model", "endpoint", "calls", "seconds"))
+        for call in summary["calls"]:
+            op = call["op"] + (" (intercepted)" if call["intercepted"] else "")
+            lines.append("{:<6} {:<28} {:<26} {:>8} {:>10.2f}".format(call["service"], call["model"], op, call["count"], call["seconds"]))
+        lines.append("Estimated wall time at a concurrency of {concurrency}: {estimated_seconds:.1f}s".format(**summary))
+        for model_name, names in sorted(summary["fkey_names"].items()):
+            lines.append("{} distinct {} names to resolve: {}".format(len(names), model_name, ", ".join(names)))
+        return "\n".join(lines)
+
+
+def _make_response(url, status, body):
+    res = requests.models.Response()
+    res.status_code = status
+    res.url = url
+    res.headers = requests.structures.CaseInsensitiveDict({"content-type": "application/json"})
+    res._content = b"" if body is None else models.json_dumps(body)
+    res.encoding = "utf-8"
+    return res
+
+
+def _is_synthetic_url(url):
+    return any(x.isdigit() and int(x) >= SYNTHETIC_ID_START for x in urlsplit(url).path.split("/"))
+
+
+def _unwrap(payload):
+    # Payloads are nested under the model name, i.e. {"biosample": {...}}.
+    if isinstance(payload, dict) and len(payload) == 1:
+        value = next(iter(payload.values()))
+        if isinstance(value, dict):
+            return value
+    return payload or {}
+
+
+class _DryRunSession():
+
+    def __init__(self, dry_run, session):
+        self.dry_run = dry_run
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.dry_run.send(self.session, method, url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class _DryRunESClient():
+
+    def __init__(self, dry_run, client):
+        self.dry_run = dry_run
+        self.client = client
+
+    def __getattr__(self, api):
+        def call(**kwargs):
+            return self.dry_run.call_es(self.client, api, kwargs)
+        return call
@@ -8,9 +8,28 @@
 
 import os
 import pdb
+import time
 
 import pulsarpy
+from pulsarpy import concurrency
+from pulsarpy import metrics
+from pulsarpy import rate_limit
+from pulsarpy import tracing
 from elasticsearch import Elasticsearch
+from elasticsearch import exceptions as es_exceptions
+
+
+#: The largest number of documents to request in a single multi-get request.
+MGET_CHUNK_SIZE = 1000
+#: The number of hits to fetch per page when streaming search results.
+SEARCH_PAGE_SIZE = 1000
+#: How long Elasticsearch should keep a point in time open between two pages of search results.
+PIT_KEEP_ALIVE = "2m"
+#: How long Elasticsearch should keep a scroll context open between two batches of results.
+SCROLL_KEEP_ALIVE = "5m"
+#: Response status codes signaling that the cluster is overloaded, after which requests are
+#: retried.
+RETRY_STATUSES = (429, 502, 503, 504)
 
 
 class MultipleHitsException(Exception):
@@ -21,8 +40,13 @@ class MultipleHitsException(Exception):
 
 class Connection():
 
-    def __init__(self):
-        ES_URL = os.environ.get("ES_URL", None)
+    def __init__(self, url=None):
+        """
+        Args:
+            url: `str`. The URL of the Elasticsearch cluster. Defaults to the value of the
+                environment variable ES_URL.
+        """
+        ES_URL = url or os.environ.get("ES_URL", None)
         if not ES_URL:
             print("Warning: environment variable ES_URL not set.")
         ES_USER = os.environ.get("ES_USER", "")
@@ -32,8 +56,229 @@ class Connection():
         if not ES_PW:
             print("Warning: environment variable ES_PW not set.")
         ES_AUTH = (ES_USER, ES_PW)
-        self.ES = Elasticsearch(ES_URL, http_auth=ES_AUTH)
+        #: The URL of the Elasticsearch cluster.
+        self.url = ES_URL
+        # Retries are done with backoff in _call() rather than right away by the client.
+        self.ES = Elasticsearch(ES_URL, http_auth=ES_AUTH, max_retries=0)
+
+    def _call(self, api, index_label=None, **kwargs):
+        """
+        Calls the given method of the Elasticsearch client. All requests to the cluster go through
+        here, such that they are subject to the ``rate_limit.ES_SEARCH`` rate limit and to the
+        adaptive concurrency limit in ``pulsarpy.concurrency``, and are recorded in
+        ``pulsarpy.metrics``. Requests that fail with one of ``RETRY_STATUSES`` or a connection
+        error are retried with jittered exponential backoff up to ``concurrency.MAX_RETRIES``
+        times, all of the client methods used being safe to repeat.
+
+        Args:
+            api: `str`. The name of the ``elasticsearch.Elasticsearch`` method, i.e. search.
+            index_label: `str`. The index to record the request under when the method isn't
+                given one, i.e. for searches of a point in time and scrolls.
+            kwargs: Passed on to the method.
+        """
+        index = kwargs.get("index") or index_label
+        # Latency is compared between requests of the same kind only.
+        kind = (rate_limit.ES_SEARCH, api)
+        start = time.monotonic()
+        attempt = 0
+        with tracing.span("ES " + api, index=index):
+            while True:
+                rate_limit.acquire(rate_limit.ES_SEARCH)
+                concurrency.LIMITER.acquire()
+                attempt_start = time.monotonic()
+                try:
+                    result = getattr(self.ES, api)(**kwargs)
+                except Exception as e:
+                    status = getattr(e, "status_code", None)
+                    unreachable = isinstance(e, es_exceptions.ConnectionError)
+                    overloaded = unreachable or status in RETRY_STATUSES or (isinstance(status, int) and status >= 500)
+                    concurrency.LIMITER.release(time.monotonic() - attempt_start, overloaded=overloaded, kind=kind)
+                    if (unreachable or status in RETRY_STATUSES) and attempt < concurrency.MAX_RETRIES:
+                        metrics.record_retry(index, "es_" + api, status=status if isinstance(status, int) else "error")
+                        time.sleep(concurrency.retry_delay(attempt))
+                        attempt += 1
+                        continue
+                    metrics.record_request(index, "es_" + api, status if isinstance(status, int) else "error", time.monotonic() - start)
+                    raise
+                concurrency.LIMITER.release(time.monotonic() - attempt_start, kind=kind)
+                break
+        metrics.record_request(index, "es_" + api, "ok", time.monotonic() - start)
+        return result
+
+    def search(self, index, body, **kwargs):
+        """
+        Runs a search request against the given index.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            body: `dict`. The search request body.
+            kwargs: Additional parameters for ``elasticsearch.Elasticsearch.search``.
+
+        Returns:
+            `dict`. The search response.
+        """
+        return self._call("search", index=index, body=body, **kwargs)
+
+    def count(self, index, query):
+        """
+        Counts the documents matching the query without fetching any of them.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            query: `dict`. An Elasticsearch query, i.e. ``{"match_all": {}}``.
+
+        Returns:
+            `int`.
+        """
+        return self._call("count", index=index, body={"query": query})["count"]
+
+    def count_by_filters(self, index, filters, query=None):
+        """
+        Counts the documents matching each of several queries at once, using a single filters
+        aggregation rather than one count request per query.
 
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            filters: `dict`. The queries to count the matches of, by name.
+            query: `dict`. An Elasticsearch query that restricts the documents counted. Defaults to
+                all documents.
+
+        Returns:
+            `dict`. The number of matching documents, keyed by the names in `filters`.
+        """
+        body = {
+            "size": 0,
+            "query": query or {"match_all": {}},
+            "aggs": {"counts": {"filters": {"filters": filters}}}
+        }
+        result = self._call("search", index=index, body=body)
+        buckets = result["aggregations"]["counts"]["buckets"]
+        return {name: buckets[name]["doc_count"] for name in filters}
+
+    def search_iter(self, index, query, fields=None, sort=None, page_size=SEARCH_PAGE_SIZE):
+        """
+        Lazily streams all documents matching the query. Results are paged with ``search_after``,
+        which unlike from/size paging has no limit on the number of results and doesn't slow down
+        on deep pages. If the cluster supports it, all pages are read from a single point in time,
+        such that documents indexed meanwhile don't shift the pages.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            query: `dict`. An Elasticsearch query, i.e. ``{"match_all": {}}``.
+            fields: `list`. Only fetch these fields of each document. Defaults to all fields.
+            sort: `list`. The sort order, which must be unique per document. Defaults to ascending 'id'.
+            page_size: `int`. The number of documents to fetch per request.
+
+        Returns:
+            A generator of `dict` documents.
+        """
+        body = {"query": query, "size": page_size, "sort": sort or [{"id": "asc"}]}
+        if fields is not None:
+            body["_source"] = fields
+        pit_id = self._open_pit(index)
+        try:
+            while True:
+                if pit_id:
+                    body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+                    result = self._call("search", index_label=index, body=body)
+                    pit_id = result.get("pit_id", pit_id)
+                else:
+                    result = self._call("search", index=index, body=body)
+                hits = result["hits"]["hits"]
+                for hit in hits:
+                    yield hit["_source"]
+                if len(hits) < page_size:
+                    return
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            if pit_id:
+                self._close_pit(index, pit_id)
+
+    def scroll(self, index, query=None, fields=None, slice_id=0, max_slices=1, page_size=SEARCH_PAGE_SIZE):
+        """
+        Lazily streams all documents matching the query with a scroll in index order, which is the
+        cheapest way to read an entire index. When `max_slices` is more than 1, only the given
+        slice of the documents is read, such that several workers can each scroll over their own
+        slice in parallel.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            query: `dict`. An Elasticsearch query. Defaults to matching all documents.
+            fields: `list`. Only fetch these fields of each document. Defaults to all fields.
+            slice_id: `int`. The 0-based slice to read.
+            max_slices: `int`. The number of slices the documents are split into.
+            page_size: `int`. The number of documents to fetch per request.
+
+        Returns:
+            A generator of `dict` documents.
+        """
+        body = {"query": query or {"match_all": {}}, "size": page_size, "sort": ["_doc"]}
+        if fields is not None:
+            body["_source"] = fields
+        if max_slices > 1:
+            body["slice"] = {"id": slice_id, "max": max_slices}
+        result = self._call("search", index=index, body=body, scroll=SCROLL_KEEP_ALIVE)
+        scroll_id = result.get("_scroll_id")
+        try:
+            while True:
+                hits = result["hits"]["hits"]
+                if not hits:
+                    return
+                for hit in hits:
+                    yield hit["_source"]
+                result = self._call("scroll", index_label=index, body={"scroll_id": scroll_id, "scroll": SCROLL_KEEP_ALIVE})
+                scroll_id = result.get("_scroll_id", scroll_id)
+        finally:
+            if scroll_id:
+                try:
+                    self._call("clear_scroll", index_label=index, body={"scroll_id": [scroll_id]})
+                except Exception:
+                    # The scroll context will expire on its own.
+                    pass
+
+    def _open_pit(self, index):
+        """
+        Opens a point in time on the index.
+
+        Returns:
+            `str`. The point in time ID, or `None` if the cluster (or client) doesn't support it.
+        """
+        try:
+            return self._call("open_point_in_time", index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+        except Exception:
+            return None
+
+    def _close_pit(self, index, pit_id):
+        try:
+            self._call("close_point_in_time", index_label=index, body={"id": pit_id})
+        except Exception:
+            # The point in time will expire on its own.
+            pass
+
+    def mget(self, index, ids, fields=None):
+        """
+        Fetches many documents by ID with multi-get requests of at most ``MGET_CHUNK_SIZE`` IDs.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            ids: `list` of document IDs.
+            fields: `list`. Only fetch these fields of each document. Defaults to all fields.
+
+        Returns:
+            `dict`. Each key is the ID (as a `str`) of a document that was found and each value is
+            the document.
+        """
+        docs = {}
+        ids = [str(x) for x in ids]
+        for start in range(0, len(ids), MGET_CHUNK_SIZE):
+            kwargs = {}
+            if fields:
+                kwargs["_source"] = fields
+            result = self._call("mget", index=index, body={"ids": ids[start:start + MGET_CHUNK_SIZE]}, **kwargs)
+            for doc in result["docs"]:
+                if doc.get("found"):
+                    docs[doc["_id"]] = doc["_source"]
+        return docs
 
     def get_record_by_name(self, index, name):
         """
@@ -50,7 +295,7 @@ class Connection():
         Raises:
             `MultipleHitsException`: More than 1 hit is returned.
         """
-        result = self.ES.search(
+        result = self.search(
             index=index,
             body={
                 "query": {
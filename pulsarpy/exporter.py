@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Exports an Elasticsearch index (i.e. all biosamples) to gzip compressed NDJSON files, one JSON
+document per line. The index is read with a sliced scroll: each slice is scrolled by its own worker
+process and streamed to its own shard file, named $INDEX-$SLICE.ndjson.gz, so an export uses all
+cores while memory use stays constant regardless of the size of the index.
+"""
+
+import concurrent.futures
+import gzip
+import multiprocessing
+import os
+import sys
+import time
+
+from pulsarpy.elasticsearch_utils import Connection, SEARCH_PAGE_SIZE
+import pulsarpy.models as models
+
+#: The number of documents exported so far by all workers. Set in each worker by ``_init_worker()``.
+_exported = None
+
+
+def _init_worker(counter):
+    global _exported
+    _exported = counter
+
+
+def export_slice(es_url, index, outdir, slice_id, max_slices, query=None, fields=None, page_size=SEARCH_PAGE_SIZE):
+    """
+    Exports a single slice of the index to its shard file. Runs in a worker process, which
+    connects to the cluster at the given URL on its own, since connections can't be shared across
+    processes.
+
+    Returns:
+        `tuple` of the form (shard_path, number_of_documents).
+    """
+    conn = Connection(url=es_url)
+    path = os.path.join(outdir, "{}-{:03d}.ndjson.gz".format(index, slice_id))
+    count = 0
+    with gzip.open(path, "wb") as fout:
+        for doc in conn.scroll(index, query=query, fields=fields, slice_id=slice_id, max_slices=max_slices, page_size=page_size):
+            fout.write(models.json_dumps(doc) + b"\n")
+            count += 1
+            if _exported is not None and count % page_size == 0:
+                with _exported.get_lock():
+                    _exported.value += page_size
+    if _exported is not None:
+        with _exported.get_lock():
+            _exported.value += count % page_size
+    return path, count
+
+
+def export_index(index, outdir, slices=None, query=None, fields=None, page_size=SEARCH_PAGE_SIZE,
+                 report_interval=5, stream=sys.stderr, es_url=None):
+    """
+    Exports the index with one worker process per slice, periodically reporting progress.
+
+    Args:
+        index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+        outdir: `str`. The directory to write the shard files to. Created if need be.
+        slices: `int`. The number of slices, and thus workers and shard files. Defaults to the
+            number of CPUs.
+        query: `dict`. Only export the documents matching this Elasticsearch query.
+        fields: `list`. Only export these fields of each document.
+        page_size: `int`. The number of documents each worker fetches per request.
+        report_interval: `int`. The number of seconds between progress reports.
+        stream: The file object progress reports are written to, or `None` for no reports.
+        es_url: `str`. The URL of the Elasticsearch cluster. Defaults to the one of
+            ``pulsarpy.models.Model.ES``, i.e. as set with ``pulsarpy.models.configure()``.
+
+    Returns:
+        `dict` with the keys 'files', 'docs', 'seconds', and 'docs_per_sec'.
+    """
+    slices = slices or os.cpu_count() or 1
+    es_url = es_url or models.Model.ES.url
+    os.makedirs(outdir, exist_ok=True)
+    counter = multiprocessing.Value("q", 0)
+    start = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=slices, initializer=_init_worker, initargs=(counter,)) as executor:
+        futures = [executor.submit(export_slice, es_url, index, outdir, x, slices, query, fields, page_size) for x in range(slices)]
+        pending = set(futures)
+        while pending:
+            _, pending = concurrent.futures.wait(pending, timeout=report_interval)
+            if stream and pending:
+                elapsed = time.monotonic() - start
+                stream.write("{}: {} docs ({:.0f} docs/s)\n".format(index, counter.value, counter.value / elapsed))
+    files = []
+    docs = 0
+    for future in futures:
+        path, count = future.result()
+        files.append(path)
+        docs += count
+    elapsed = time.monotonic() - start
+    stats = {"files": files, "docs": docs, "seconds": elapsed, "docs_per_sec": docs / elapsed if elapsed else 0}
+    if stream:
+        stream.write("{}: exported {} docs in {:.1f}s ({:.0f} docs/s)\n".format(index, docs, elapsed, stats["docs_per_sec"]))
+    return stats
@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+An in-process stand-in for a Pulsar server and its Elasticsearch cluster, for measuring and
+exercising pulsarpy without touching production. A single HTTP server running in a background
+thread serves both:
+
+    * The Rails API under /api: the CRUD routes of every model, find_by, find_by_or, bulk_create,
+      utils/model_attrs, and the custom actions that the model classes call. Successful GETs carry
+      an ETag, and a GET whose If-None-Match header matches it is answered with a 304.
+    * The subset of the Elasticsearch API that pulsarpy uses: search (with search_after, scroll,
+      slicing, points in time, and filters aggregations), count, and mget, supporting the
+      match_all, match_phrase, term, terms, range, exists, and bool queries.
+    * A mail endpoint under /mail that accepts the forms sent by ``pulsarpy.utils.send_mail()``
+      and keeps them in ``mails``.
+
+Both are backed by the same in-memory records, such that a record created through the API can be
+found in Elasticsearch right away. A configurable latency and error rate are injected into every
+request. Typical use::
+
+    server = FakeServer(latency=0.005)
+    server.start()
+    models.configure(url=server.api_url, token="fake", es_url=server.es_url)
+    ...
+    server.stop()
+"""
+
+import datetime
+import gzip
+import hashlib
+import http.server
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import inflection
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def get_index_name(model_name):
+    """
+    Returns the name of the table, and Elasticsearch index, of a model, i.e. biosamples for
+    Biosample.
+    """
+    return inflection.pluralize(inflection.underscore(model_name))
+
+
+def _phrase_matches(value, phrase):
+    if value is None:
+        return False
+    if isinstance(value, list):
+        return any(_phrase_matches(x, phrase) for x in value)
+    return str(phrase).lower() in str(value).lower()
+
+
+def _term_matches(value, term):
+    if isinstance(value, list):
+        return term in value
+    if isinstance(value, str) and isinstance(term, str):
+        return value.lower() == term.lower()
+    return value == term or str(value) == str(term)
+
+
+def query_matches(doc, query):
+    """
+    Evaluates a subset of the Elasticsearch query DSL against a document.
+
+    Raises:
+        `ValueError`: The query uses an unsupported clause.
+    """
+    if not query:
+        return True
+    (clause, spec), = query.items()
+    if clause == "match_all":
+        return True
+    if clause in ("match_phrase", "match"):
+        (field, val), = spec.items()
+        if isinstance(val, dict):
+            val = val["query"]
+        return _phrase_matches(doc.get(field), val)
+    if clause == "term":
+        (field, val), = spec.items()
+        if isinstance(val, dict):
+            val = val["value"]
+        return _term_matches(doc.get(field), val)
+    if clause == "terms":
+        (field, vals), = spec.items()
+        return any(_term_matches(doc.get(field), x) for x in vals)
+    if clause == "exists":
+        return doc.get(spec["field"]) not in (None, "", [])
+    if clause == "range":
+        (field, bounds), = spec.items()
+        val = doc.get(field)
+        if val is None:
+            return False
+        ops = {"gt": lambda a, b: a > b, "gte": lambda a, b: a >= b, "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b}
+        return all(ops[op](val, bound) for op, bound in bounds.items() if op in ops)
+    if clause == "bool":
+        def as_list(x):
+            return x if isinstance(x, list) else [x]
+        for sub in as_list(spec.get("must", [])) + as_list(spec.get("filter", [])):
+            if not query_matches(doc, sub):
+                return False
+        for sub in as_list(spec.get("must_not", [])):
+            if query_matches(doc, sub):
+                return False
+        should = as_list(spec.get("should", []))
+        if should:
+            minimum = int(spec.get("minimum_should_match", 1))
+            if sum(1 for sub in should if query_matches(doc, sub)) < minimum:
+                return False
+        return True
+    raise ValueError("Unsupported query clause '{}'.".format(clause))
+
+
+class FakeServer():
+    """
+    Serves the fake Pulsar API and Elasticsearch cluster from a background thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        """
+        Args:
+            host: `str`. The address to listen on.
+            port: `int`. The port to listen on. Defaults to a free port.
+            latency: `float`. The number of seconds each request is delayed by.
+            jitter: `float`. Up to this many extra seconds are randomly added to the latency.
+            error_rate: `float`. The fraction of requests that fail with `error_status` instead of
+                being processed.
+            error_status: `int`. The status code of injected errors.
+            seed: Seed of the random number generator, for reproducible runs.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        #: The records, keyed by table name (i.e. biosamples) and then by ID.
+        self.tables = {}
+        #: Attribute names returned by utils/model_attrs, keyed by model name. Defaults to the
+        #: attributes of the model's records.
+        self.schemas = {}
+        #: The number of requests served, keyed by (method, route), where route is the URL path
+        #: with IDs replaced by ':id'.
+        self.request_counts = {}
+        #: The mail forms received at ``mail_url``, each a `dict` of lists of field values.
+        self.mails = []
+        #: Whether the bulk_create action is served. Otherwise it's answered with a 404, like by a
+        #: server that predates it.
+        self.bulk_create = True
+        self._ids = itertools.count(1)
+        self._scrolls = {}
+        # The names in use, keyed by table name, to reject duplicates without scanning the table.
+        self._names = {}
+        self._lock = threading.RLock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+    @property
+    def api_url(self):
+        """The URL to use as PULSAR_API_URL."""
+        return self.url + "/api"
+
+    @property
+    def es_url(self):
+        """The URL to use as ES_URL."""
+        return self.url
+
+    @property
+    def mail_url(self):
+        """The URL to send mail forms to, i.e. with ``pulsarpy.utils.send_mail()``."""
+        return self.url + "/mail/messages"
+
+    def start(self):
+        """
+        Starts serving in a daemon thread.
+
+        Returns:
+            `str`. The server's base URL.
+        """
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self._httpd = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_record(self, model_name, record):
+        """
+        Stores a record directly, without going through the API. An ID and timestamps are assigned
+        unless given.
+
+        Args:
+            model_name: `str`. The model name, i.e. Biosample.
+            record: `dict`. The record's attributes.
+
+        Returns:
+            `dict`. The stored record.
+        """
+        with self._lock:
+            rec = dict(record)
+            if "id" not in rec:
+                rec["id"] = next(self._ids)
+            else:
+                # Keep generated IDs clear of explicitly given ones.
+                self._ids = itertools.count(max(rec["id"] + 1, next(self._ids)))
+            now = _now()
+            rec.setdefault("created_at", now)
+            rec.setdefault("updated_at", now)
+            table_name = get_index_name(model_name)
+            self.tables.setdefault(table_name, {})[rec["id"]] = rec
+            if rec.get("name"):
+                self._names.setdefault(table_name, set()).add(rec["name"])
+            return rec
+
+    def count_request(self, method, path):
+        route = re.sub(r"/\d+(?=/|$)", "/:id", path)
+        with self._lock:
+            key = (method, route)
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    ###
+    # Rails API
+    ###
+
+    def handle_api(self, method, parts, body, query):
+        """
+        Returns:
+            `tuple` of the form (status, response object).
+        """
+        if parts[:2] == ["utils", "model_attrs"]:
+            model_name = (body or {}).get("model_name") or query.get("model_name", [""])[0]
+            attrs = self.schemas.get(model_name)
+            if attrs is None:
+                attrs = set(["id", "created_at", "updated_at"])
+                for rec in self.tables.get(get_index_name(model_name), {}).values():
+                    attrs.update(rec)
+                attrs = sorted(attrs)
+            return 200, attrs
+        table_name = parts[0]
+        table = self.tables.setdefault(table_name, {})
+        model_key = inflection.singularize(table_name)
+        if len(parts) == 1:
+            if method == "GET":
+                return 200, sorted(table.values(), key=lambda x: x["id"])
+            if method == "POST":
+                return self.create(table_name, (body or {}).get(model_key, {}))
+        elif len(parts) == 2 and not parts[1].isdigit():
+            action = parts[1]
+            if action in ("find_by", "find_by_or"):
+                criteria = (body or {}).get(action, {})
+                combine = all if action == "find_by" else any
+                for rec in sorted(table.values(), key=lambda x: x["id"]):
+                    if combine(_term_matches(rec.get(k), v) if not isinstance(v, list) else rec.get(k) == v for k, v in criteria.items()):
+                        return 200, {model_key: rec}
+                return 200, None
+            if action == "bulk_create":
+                if not self.bulk_create:
+                    return 404, {"error": "not found"}
+                results = []
+                for payload in (body or {}).get(table_name, []):
+                    status, res = self.create(table_name, payload.get(model_key, payload))
+                    results.append(res)
+                return 200, results
+        else:
+            rec_id = int(parts[1])
+            rec = table.get(rec_id)
+            if rec is None:
+                return 404, {"exception": "ActiveRecord::RecordNotFound", "message": "Couldn't find record with 'id'={}".format(rec_id)}
+            if len(parts) == 2:
+                if method == "GET":
+                    return 200, rec
+                if method in ("PATCH", "PUT"):
+                    with self._lock:
+                        names = self._names.setdefault(table_name, set())
+                        names.discard(rec.get("name"))
+                        rec.update((body or {}).get(model_key, {}))
+                        rec["updated_at"] = _now()
+                        if rec.get("name"):
+                            names.add(rec["name"])
+                    return 200, rec
+                if method == "DELETE":
+                    with self._lock:
+                        table.pop(rec_id, None)
+                        self._names.get(table_name, set()).discard(rec.get("name"))
+                    return 204, None
+            else:
+                return self.custom_action(table_name, rec, parts[2], method, body or {})
+        return 404, {"exception": "ActionController::RoutingError", "message": "No route matches"}
+
+    def create(self, table_name, payload):
+        with self._lock:
+            table = self.tables.setdefault(table_name, {})
+            names = self._names.setdefault(table_name, set())
+            name = payload.get("name")
+            if name and name in names:
+                return 422, {"exception": "ActiveRecord::RecordNotUnique", "message": "Duplicate name '{}'".format(name)}
+            rec = dict(payload)
+            rec["id"] = next(self._ids)
+            rec["created_at"] = rec["updated_at"] = _now()
+            table[rec["id"]] = rec
+            if name:
+                names.add(name)
+            return 201, rec
+
+    def custom_action(self, table_name, rec, action, method, body):
+        tables = self.tables
+        if action == "parent_ids":
+            if rec.get("part_of_id"):
+                return 200, {"biosamples": [rec["part_of_id"]]}
+            return 200, {"biosamples": rec.get("pooled_from_biosample_ids") or []}
+        if action == "get_library_barcode_sequence_hash":
+            seqs = {}
+            for lib_id in rec.get("library_ids") or []:
+                lib = tables.get("libraries", {}).get(lib_id, {})
+                if lib.get("barcode_id"):
+                    seqs[str(lib_id)] = tables.get("barcodes", {}).get(lib["barcode_id"], {}).get("sequence")
+                elif lib.get("paired_barcode_id"):
+                    seqs[str(lib_id)] = tables.get("paired_barcodes", {}).get(lib["paired_barcode_id"], {}).get("name")
+            return 200, seqs
+        if action == "library_sequencing_result":
+            for sres in tables.get("sequencing_results", {}).values():
+                if sres.get("sequencing_run_id") == rec["id"] and str(sres.get("library_id")) == str(body.get("library_id")):
+                    return 200, sres
+            return 404, {"exception": "ActiveRecord::RecordNotFound", "message": "No SequencingResult"}
+        if action == "generate_api_key":
+            return 200, {"token": "fake-token-{}".format(rec["id"])}
+        # Other actions, i.e. paired_input_control_map, archive, and remove_api_key.
+        return 200, {}
+
+    ###
+    # Elasticsearch
+    ###
+
+    def handle_es(self, method, parts, body, query):
+        body = body or {}
+        if not parts:
+            return 200, {"name": "fake", "cluster_name": "pulsarpy-fake", "version": {"number": "7.17.0", "build_flavor": "default"}, "tagline": "You Know, for Search"}
+        if parts == ["_search", "scroll"]:
+            scroll_id = body.get("scroll_id") or query.get("scroll_id", [None])[0]
+            if method == "DELETE":
+                ids = scroll_id if isinstance(scroll_id, list) else [scroll_id]
+                with self._lock:
+                    for x in ids:
+                        self._scrolls.pop(x, None)
+                return 200, {"succeeded": True, "num_freed": len(ids)}
+            with self._lock:
+                hits, size = self._scrolls.get(scroll_id, ([], 0))
+                self._scrolls[scroll_id] = (hits[size:], size)
+            return 200, {"_scroll_id": scroll_id, "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits[:size]}}
+        if parts == ["_pit"] and method == "DELETE":
+            return 200, {"succeeded": True, "num_freed": 1}
+        if parts == ["_search"]:
+            # A search in a point in time, whose ID is the index name.
+            return self.search(body["pit"]["id"], body, query)
+        index = parts[0]
+        if len(parts) == 2 and parts[1] == "_pit":
+            return 200, {"id": index}
+        if len(parts) == 2 and parts[1] == "_search":
+            return self.search(index, body, query)
+        if len(parts) == 2 and parts[1] == "_count":
+            docs = self.tables.get(index, {}).values()
+            return 200, {"count": sum(1 for x in docs if query_matches(x, body.get("query")))}
+        if len(parts) == 2 and parts[1] == "_mget":
+            table = self.tables.get(index, {})
+            fields = self._source_fields(body, query)
+            docs = []
+            for doc_id in body.get("ids", []):
+                rec = table.get(int(doc_id)) if str(doc_id).isdigit() else None
+                doc = {"_index": index, "_id": str(doc_id), "found": rec is not None}
+                if rec is not None:
+                    doc["_source"] = self._project(rec, fields)
+                docs.append(doc)
+            return 200, {"docs": docs}
+        return 404, {"error": {"type": "index_not_found_exception"}, "status": 404}
+
+    @staticmethod
+    def _source_fields(body, query):
+        fields = body.get("_source")
+        if fields is None and "_source" in query:
+            fields = query["_source"][0].split(",")
+        if fields is None and "_source_includes" in query:
+            fields = query["_source_includes"][0].split(",")
+        if isinstance(fields, str):
+            fields = [fields]
+        return fields if isinstance(fields, list) else None
+
+    @staticmethod
+    def _project(rec, fields):
+        if fields is None:
+            return rec
+        return {k: rec[k] for k in fields if k in rec}
+
+    def search(self, index, body, query):
+        docs = [x for x in self.tables.get(index, {}).values() if query_matches(x, body.get("query"))]
+        sort = body.get("sort") or [{"_score": "desc"}]
+        keys = []
+        for item in sort:
+            if isinstance(item, str):
+                keys.append((item, "asc"))
+            else:
+                (field, order), = item.items()
+                keys.append((field, order["order"] if isinstance(order, dict) else order))
+        sortable = [(field, order) for field, order in keys if field not in ("_doc", "_score")]
+
+        def sort_values(doc):
+            return [doc.get(field) if doc.get(field) is not None else "" for field, _ in sortable] or [doc["id"]]
+
+        for field, order in reversed(sortable):
+            docs.sort(key=lambda x: (x.get(field) is None, x.get(field) if x.get(field) is not None else ""), reverse=(order == "desc"))
+        if not sortable:
+            docs.sort(key=lambda x: x["id"])
+        if "slice" in body:
+            docs = [x for x in docs if x["id"] % body["slice"]["max"] == body["slice"]["id"]]
+        total = len(docs)
+        if "search_after" in body:
+            after = body["search_after"]
+            desc = [order == "desc" for _, order in sortable] or [False]
+            docs = [x for x in docs if _after(sort_values(x), after, desc)]
+        start = int(body.get("from", query.get("from", [0])[0]))
+        size = int(body.get("size", query.get("size", [10])[0]))
+        fields = self._source_fields(body, query)
+        hits = []
+        for doc in docs[start:]:
+            hits.append({"_index": index, "_id": str(doc["id"]), "_score": 1.0, "_source": self._project(doc, fields), "sort": sort_values(doc)})
+        result = {"took": 1, "timed_out": False, "hits": {"total": {"value": total, "relation": "eq"}, "hits": hits[:size]}}
+        if body.get("aggs"):
+            result["aggregations"] = {name: self.aggregate(docs, spec) for name, spec in body["aggs"].items()}
+        if "pit" in body:
+            result["pit_id"] = body["pit"]["id"]
+        if "scroll" in query:
+            scroll_id = "scroll-{}".format(next(self._ids))
+            with self._lock:
+                self._scrolls[scroll_id] = (hits[size:], size)
+            result["_scroll_id"] = scroll_id
+        return 200, result
+
+
+    @staticmethod
+    def aggregate(docs, spec):
+        """
+        Computes an aggregation over the matching documents. Only filters aggregations are
+        supported.
+        """
+        if "filters" not in spec:
+            raise ValueError("Unsupported aggregation {}.".format(list(spec)))
+        filters = spec["filters"]["filters"]
+        buckets = {}
+        for name, query in filters.items():
+            buckets[name] = {"doc_count": sum(1 for x in docs if query_matches(x, query))}
+        return {"buckets": buckets}
+
+
+def _after(values, after, desc):
+    for val, ref, is_desc in zip(values, after, desc):
+        if val == ref:
+            continue
+        try:
+            greater = val > ref
+        except TypeError:
+            greater = str(val) > str(ref)
+        return greater != is_desc
+    return False
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    #: The ``FakeServer`` that the requests are served for. Set on subclasses.
+    fake = None
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, which would otherwise stall each response
+    # of a kept-alive connection on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, obj, headers=None):
+        data = b"" if (obj is None and status == 204) or status == 304 else json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _handle(self, method):
+        fake = self.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        url = urlparse(self.path)
+        fake.count_request(method, url.path)
+        delay = fake.latency + (fake.random.uniform(0, fake.jitter) if fake.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if fake.error_rate and fake.random.random() < fake.error_rate:
+            return self._respond(fake.error_status, {"error": "injected"}, headers={"Retry-After": "0"})
+        if url.path.startswith("/mail/"):
+            with fake._lock:
+                fake.mails.append(parse_qs(raw.decode("utf-8")))
+                mail_id = len(fake.mails)
+            return self._respond(200, {"id": "<{}@fake>".format(mail_id), "message": "Queued. Thank you."})
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            return self._respond(400, {"error": "malformed JSON"})
+        query = parse_qs(url.query)
+        parts = [x for x in url.path.split("/") if x]
+        try:
+            if parts and parts[0] == "api":
+                status, obj = fake.handle_api(method, parts[1:], body, query)
+            else:
+                status, obj = fake.handle_es(method, parts, body, query)
+        except Exception as e:
+            status, obj = 500, {"exception": type(e).__name__, "message": str(e)}
+        headers = {}
+        if parts and parts[0] == "api" and method == "GET" and status == 200:
+            etag = '"{}"'.format(hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest())
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status = 304
+        self._respond(status, obj, headers=headers)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
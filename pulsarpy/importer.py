@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Imports a workbook of records for several models at once, i.e. all of the Donors, Biosamples,
+Libraries and SequencingRequests of a new project. The workbook is either a directory containing
+one tab-delimited sheet per model, named after the model (i.e. Biosample.tsv), or an Excel workbook
+whose worksheets are named after the models (reading these requires the openpyxl package).
+
+Each sheet follows the same format as the input of the tab_import.py script: the first row is the
+header of field names; columns whose name starts with a '#' and rows that start with a '#' are
+skipped; and values of fields whose name ends in 'ids' are comma-delimited lists.
+
+The order in which the models are imported is derived from each model's ``FKEY_MAP``: a model is
+only imported after all of the models that it references and that are also in the workbook. The
+models that don't depend on each other are imported concurrently, each with
+``pulsarpy.models.Model.post_many()``. Names that refer to records created earlier in the same
+import are resolved from those records rather than looked up on the server.
+"""
+
+import csv
+import os
+
+import pulsarpy.models as models
+from pulsarpy import concurrency
+
+#: The file extensions of the sheets read from a workbook directory.
+SHEET_EXTENSIONS = (".tsv", ".txt")
+
+
+class ImportRow():
+    """
+    A row of a sheet, along with the outcome of submitting it.
+    """
+
+    def __init__(self, line_num, payload):
+        """
+        Args:
+            line_num: `int`. The line number of the row in the sheet (the header is line 1).
+            payload: `dict`. The record attributes given in the row.
+        """
+        self.line_num = line_num
+        self.payload = payload
+        #: Set to the ``pulsarpy.concurrency.Result`` of POSTing the row.
+        self.result = None
+
+
+def check_fields(model, fields):
+    """
+    Checks that the given field names are attributes of the model, or foreign keys in its
+    ``FKEY_MAP``.
+
+    Args:
+        model: A model class.
+        fields: `list` of field names.
+
+    Raises:
+        `Exception`: A field name is unknown.
+    """
+    model_attrs = models.get_model_attrs(model.__name__)
+    for field_name in fields:
+        if field_name not in model.FKEY_MAP and field_name not in model_attrs:
+            raise Exception("Unknown field name '{}' in the {} sheet.".format(field_name, model.__name__))
+
+
+def parse_rows(rows, model=None):
+    """
+    Converts the rows of a sheet into payloads.
+
+    Args:
+        rows: An iterable of rows, each a `list` of `str` values, where the first row is the header.
+        model: A model class. If given, the field names of the header are checked with
+            ``check_fields()``.
+
+    Returns:
+        `list` of `ImportRow` instances.
+    """
+    rows = iter(rows)
+    header = [x.strip() for x in next(rows)]
+    field_positions = [i for i, x in enumerate(header) if x and not x.startswith("#")]
+    if model:
+        check_fields(model, [header[i] for i in field_positions])
+    import_rows = []
+    line_num = 1
+    for row in rows:
+        line_num += 1
+        if not row or (row[0] and row[0].startswith("#")):
+            continue
+        payload = {}
+        for pos in field_positions:
+            val = row[pos].strip() if pos < len(row) else ""
+            if not val:
+                continue
+            field_name = header[pos]
+            if field_name.endswith("ids"):
+                val = [x.strip() for x in val.split(",")]
+            payload[field_name] = val
+        if payload:
+            import_rows.append(ImportRow(line_num, payload))
+    return import_rows
+
+
+def read_workbook(path):
+    """
+    Reads a workbook directory or Excel workbook.
+
+    Args:
+        path: `str`. The path to a directory of sheets or to an .xlsx file.
+
+    Returns:
+        `dict`. Each key is a model class and each value is a `list` of `ImportRow` instances.
+
+    Raises:
+        `Exception`: A sheet isn't named after a model, or has an unknown field name.
+    """
+    workbook = {}
+    if os.path.isdir(path):
+        for file_name in sorted(os.listdir(path)):
+            model_name, ext = os.path.splitext(file_name)
+            if ext not in SHEET_EXTENSIONS:
+                continue
+            model = get_sheet_model(model_name)
+            with open(os.path.join(path, file_name), newline="") as fh:
+                # Quotes have no special meaning in the tab-delimited format.
+                workbook[model] = parse_rows(csv.reader(fh, delimiter="\t", quoting=csv.QUOTE_NONE), model=model)
+    else:
+        try:
+            import openpyxl
+        except ImportError:
+            raise Exception("Reading Excel workbooks requires the openpyxl package.")
+        excel_workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        for worksheet in excel_workbook.worksheets:
+            model = get_sheet_model(worksheet.title)
+            rows = ([str(x) if x is not None else "" for x in row] for row in worksheet.iter_rows(values_only=True))
+            workbook[model] = parse_rows(rows, model=model)
+    return workbook
+
+
+def get_sheet_model(sheet_name):
+    """
+    Returns the model class that the sheet with the given name holds records of.
+
+    Raises:
+        `Exception`: The sheet isn't named after a model.
+    """
+    if sheet_name not in models.Meta._MODELS:
+        raise Exception("Sheet '{}' isn't named after a model.".format(sheet_name))
+    return models.Meta._MODELS[sheet_name]
+
+
+def get_dependencies(model, rows, model_names):
+    """
+    Determines which of the given models the rows of the given model refer to.
+
+    Args:
+        model: A model class.
+        rows: `list` of `ImportRow` instances of the model.
+        model_names: `set` of the names of the models being imported.
+
+    Returns:
+        `set` of model names, not including the model itself.
+    """
+    fields = set()
+    for row in rows:
+        fields.update(row.payload)
+    deps = set(model.FKEY_MAP[x] for x in fields if x in model.FKEY_MAP)
+    deps.discard(model.__name__)
+    return deps & model_names
+
+
+def get_import_levels(workbook):
+    """
+    Orders the models of the workbook into levels, such that each model only refers to models in
+    earlier levels.
+
+    Args:
+        workbook: `dict` as returned by ``read_workbook()``.
+
+    Returns:
+        `list` of levels, each a `list` of model classes.
+
+    Raises:
+        `Exception`: The models refer to each other in a cycle.
+    """
+    model_names = set(x.__name__ for x in workbook)
+    pending = {}
+    for model in workbook:
+        pending[model] = get_dependencies(model, workbook[model], model_names)
+    levels = []
+    done = set()
+    while pending:
+        level = [x for x in pending if pending[x] <= done]
+        if not level:
+            raise Exception("The models {} refer to each other in a cycle.".format(sorted(x.__name__ for x in pending)))
+        level.sort(key=lambda x: x.__name__)
+        levels.append(level)
+        for model in level:
+            pending.pop(model)
+            done.add(model.__name__)
+    return levels
+
+
+def get_row_waves(model, rows):
+    """
+    Splits the rows of a model that refer to other rows of the same model by name (i.e. a
+    Biosample whose part_of_id is the name of another Biosample in the sheet) into waves, such
+    that each row comes after the rows it refers to.
+
+    Returns:
+        `list` of waves, each a `list` of `ImportRow` instances.
+
+    Raises:
+        `Exception`: The rows refer to each other in a cycle.
+    """
+    self_fkeys = [x for x in model.FKEY_MAP if model.FKEY_MAP[x] == model.__name__]
+    names = set(row.payload.get("name") for row in rows)
+    pending = {}
+    for row in rows:
+        refs = set()
+        for key in self_fkeys:
+            val = row.payload.get(key)
+            if val:
+                refs.update(val if isinstance(val, list) else [val])
+        pending[id(row)] = (row, (refs & names) - {row.payload.get("name")})
+    waves = []
+    created = set()
+    while pending:
+        wave = [row for row, refs in pending.values() if refs <= created]
+        if not wave:
+            raise Exception("{} rows refer to each other in a cycle.".format(model.__name__))
+        waves.append(wave)
+        for row in wave:
+            pending.pop(id(row))
+            created.add(row.payload.get("name"))
+    return waves
+
+
+def import_workbook(workbook, skip_dups=False):
+    """
+    Imports the workbook level by level. The rows of all models in a level are submitted
+    concurrently.
+
+    Args:
+        workbook: `dict` as returned by ``read_workbook()``.
+        skip_dups: `bool`. Passed on to ``import_model()``.
+
+    Returns:
+        `dict`. Each key is a model class and each value is its `list` of `ImportRow` instances,
+        each with the result set.
+    """
+    # The IDs of the records created so far, keyed by model name and then by record name.
+    known_ids = {}
+    for level in get_import_levels(workbook):
+        models.Model.debug_logger.debug("Importing {}".format(", ".join(x.__name__ for x in level)))
+        results = concurrency.bulk_map(lambda model: import_model(model, workbook[model], known_ids, skip_dups=skip_dups), level)
+        for res in results:
+            if res.error:
+                raise res.error
+    return workbook
+
+
+def import_model(model, rows, known_ids, skip_dups=False):
+    """
+    Creates the records of a single model.
+
+    Args:
+        model: A model class.
+        rows: `list` of `ImportRow` instances.
+        known_ids: `dict` of the form accepted by ``pulsarpy.models.Model.resolve_fkey_names()``.
+            The records created here are added to it.
+        skip_dups: `bool`. True means to look up the existing record when a row is rejected as a
+            duplicate (``pulsarpy.models.RecordNotUnique``), such that rows referring to it can
+            still be imported.
+    """
+    created = known_ids.setdefault(model.__name__, {})
+    for wave in get_row_waves(model, rows):
+        results = model.post_many([row.payload for row in wave], known_ids=known_ids)
+        for row, res in zip(wave, results):
+            row.result = res
+            name = row.payload.get("name")
+            if not name:
+                continue
+            if not res.error:
+                created[name] = res.value["id"]
+            elif skip_dups and isinstance(res.error, models.RecordNotUnique):
+                try:
+                    created[name] = model.replace_name_with_id(name)
+                except models.RecordNotFound:
+                    pass
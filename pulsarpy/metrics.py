@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+In-process metrics of the requests sent to the Pulsar API and to Elasticsearch, such that it's
+possible to tell where a slow job spends its time (i.e. name lookups in Elasticsearch versus
+Rails writes).
+
+Every request is counted and timed, labelled by model, operation, and status:
+
+    * model: The model class name for Pulsar API requests (i.e. Biosample), or the index name for
+      Elasticsearch requests (i.e. biosamples).
+    * op: For Pulsar API requests, the custom action of the URL if any (i.e. find_by,
+      bulk_create, parent_ids), otherwise the lower-cased HTTP method (get, post, patch, delete).
+      For Elasticsearch requests, ``es_`` followed by the client method (i.e. es_search, es_mget).
+    * status: The HTTP status code, 'cached' for responses served from the response cache, 'ok'
+      for successful Elasticsearch requests, or 'error' when no response was received.
+
+The metrics are read in-process with ``snapshot()``, or rendered in the Prometheus text exposition
+format with ``to_prometheus()``. When the environment variable PULSARPY_METRICS_FILE is set, they
+are written to that file when the process exits, in the Prometheus format if the file name ends
+in .prom and as a JSON snapshot otherwise.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+
+#: The upper bounds, in seconds, of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+#: The label names of all metrics, in order.
+LABELS = ("model", "op", "status")
+
+REQUESTS = "pulsarpy_requests_total"
+REQUEST_BYTES = "pulsarpy_request_bytes_total"
+RESPONSE_BYTES = "pulsarpy_response_bytes_total"
+RETRIES = "pulsarpy_retries_total"
+LATENCY = "pulsarpy_request_duration_seconds"
+
+HELP = {
+    REQUESTS: "The number of requests sent.",
+    REQUEST_BYTES: "The number of bytes of request bodies sent, after compression.",
+    RESPONSE_BYTES: "The number of bytes of response bodies received, after decompression.",
+    RETRIES: "The number of retried requests.",
+    LATENCY: "The time it took to complete requests, including retries.",
+}
+
+
+class Registry():
+    """
+    Thread-safe storage of counters and latency histograms.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Each is keyed by metric name and then by a tuple of label values in the order of LABELS.
+        self._counters = {}
+        self._histograms = {}
+        #: Callables that return a `dict` of extra values to include in snapshots, by name.
+        self.collectors = {}
+
+    def inc(self, name, labels, value=1):
+        """
+        Increments a counter.
+
+        Args:
+            name: `str`. The name of the metric.
+            labels: `tuple` of label values in the order of ``LABELS``.
+            value: `int`. The amount to add.
+        """
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, labels, value):
+        """
+        Adds an observation to a histogram.
+        """
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(labels)
+            if hist is None:
+                hist = series[labels] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+            hist["buckets"][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """
+        Returns a JSON serializable copy of all metrics.
+
+        Returns:
+            `dict` with the keys 'counters', 'histograms', and one key per collector. Each series of
+            a counter or histogram is a `dict` that holds its labels along with its value(s).
+        """
+        with self._lock:
+            counters = {}
+            for name, series in self._counters.items():
+                counters[name] = [dict(zip(LABELS, labels), value=value) for labels, value in sorted(series.items())]
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = []
+                for labels, hist in sorted(series.items()):
+                    entry = dict(zip(LABELS, labels))
+                    entry.update(buckets=list(hist["buckets"]), sum=hist["sum"], count=hist["count"])
+                    histograms[name].append(entry)
+        snapshot = {"counters": counters, "histograms": histograms, "latency_buckets": list(LATENCY_BUCKETS)}
+        for name, collector in self.collectors.items():
+            snapshot[name] = collector()
+        return snapshot
+
+    def to_prometheus(self):
+        """
+        Renders the counters and histograms in the Prometheus text exposition format.
+
+        Returns:
+            `str`.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in sorted(snapshot["counters"].items()):
+            lines.append("# HELP {} {}".format(name, HELP.get(name, "")))
+            lines.append("# TYPE {} counter".format(name))
+            for entry in series:
+                lines.append("{}{{{}}} {}".format(name, _format_labels(entry), entry["value"]))
+        for name, series in sorted(snapshot["histograms"].items()):
+            lines.append("# HELP {} {}".format(name, HELP.get(name, "")))
+            lines.append("# TYPE {} histogram".format(name))
+            for entry in series:
+                labels = _format_labels(entry)
+                cumulative = 0
+                bounds = [str(x) for x in LATENCY_BUCKETS] + ["+Inf"]
+                for bound, count in zip(bounds, entry["buckets"]):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+                lines.append("{}_sum{{{}}} {}".format(name, labels, entry["sum"]))
+                lines.append("{}_count{{{}}} {}".format(name, labels, entry["count"]))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(entry):
+    values = []
+    for label in LABELS:
+        val = str(entry[label]).replace("\\", "\\\\").replace('"', '\\"')
+        values.append('{}="{}"'.format(label, val))
+    return ",".join(values)
+
+#: The registry that all requests of this process are recorded in.
+REGISTRY = Registry()
+
+
+def record_request(model, op, status, latency, request_bytes=0, response_bytes=0):
+    """
+    Records a completed request in ``REGISTRY``.
+
+    Args:
+        model: `str`. The model or index name.
+        op: `str`. The operation.
+        status: The HTTP status code or another status, see the module documentation.
+        latency: `float`. The number of seconds the request took.
+        request_bytes: `int`. The size of the request body.
+        response_bytes: `int`. The size of the response body.
+    """
+    labels = (model or "", op, str(status))
+    REGISTRY.inc(REQUESTS, labels)
+    if request_bytes:
+        REGISTRY.inc(REQUEST_BYTES, labels, request_bytes)
+    if response_bytes:
+        REGISTRY.inc(RESPONSE_BYTES, labels, response_bytes)
+    REGISTRY.observe(LATENCY, labels, latency)
+
+
+def record_retry(model, op, status):
+    """
+    Records that a request is retried after a response with the given status.
+    """
+    REGISTRY.inc(RETRIES, (model or "", op, str(status)))
+
+
+def snapshot():
+    """
+    Returns ``REGISTRY.snapshot()``.
+    """
+    return REGISTRY.snapshot()
+
+
+def to_prometheus():
+    """
+    Returns ``REGISTRY.to_prometheus()``.
+    """
+    return REGISTRY.to_prometheus()
+
+
+def write(path):
+    """
+    Writes the metrics to the given file, in the Prometheus format if its name ends in .prom and as
+    a JSON snapshot otherwise.
+    """
+    if path.endswith(".prom"):
+        content = to_prometheus()
+    else:
+        content = json.dumps(snapshot(), indent=2)
+    with open(path, "w") as fh:
+        fh.write(content)
+
+
+def _write_at_exit():
+    path = os.environ.get("PULSARPY_METRICS_FILE")
+    if path:
+        write(path)
+
+atexit.register(_write_at_exit)
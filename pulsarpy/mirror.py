@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+A local, read-only replica of chosen Pulsar models in a sqlite database, such that read-heavy jobs
+(i.e. analyses walking from experiments down to sequencing results) run at local disk speed without
+loading the Pulsar server.
+
+Each model is mirrored from its Elasticsearch index into a table named after the index. Besides
+the JSON document itself, each row has the record's id, name, normalized name (stripped and
+lower-cased, as in ``pulsarpy.name_index``), and updated_at, plus one column
+per foreign key field in the model's ``FKEY_MAP``, all of them indexed. Each array foreign key
+field (i.e. library_ids) gets a link table of its own, named $INDEX__$FIELD, with one row per
+referenced ID. ``Mirror.sync()`` brings a table up to date incrementally by only fetching the
+records whose updated_at timestamp is at or after the latest one seen so far (see
+``pulsarpy.models.Model.changed_since()``).
+
+Once ``pulsarpy.models.use_mirror()`` is called with a ``Mirror``, ``Model(uid)``,
+``Model.find_by()``, ``Model.get_many()``, and ``Model.load_related()`` are served from the
+mirror for all models that have been synced into it. Lookups that the mirror can't answer, i.e.
+for records created after the last sync, fall back to the Pulsar server. Writes still go to the
+Pulsar server, and aren't visible in the mirror until the next sync. Records deleted in Pulsar are
+only dropped from the mirror by a full sync.
+
+Note that the records served from the mirror are the documents as indexed into Elasticsearch,
+rather than the JSON serialization returned by the Pulsar API. They hold the same attributes, but
+may lack the ones the server doesn't index.
+
+A model counts as synced once its first sync completed. A full sync marks the model as not synced
+until it completes, such that reads go to the Pulsar server rather than to a partly filled table
+in the meantime, and a sync that fails midway leaves the model to be fully synced next time.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+import pulsarpy as p
+from pulsarpy.name_index import normalize
+
+#: The number of documents written to the database per transaction while syncing.
+SYNC_BATCH_SIZE = 1000
+
+
+class Mirror():
+    """
+    A sqlite replica of the Elasticsearch indices of some models. The database may be shared by
+    several threads and processes.
+    """
+
+    def __init__(self, path=None, es=None):
+        """
+        Args:
+            path: `str`. The path to the sqlite database. Defaults to $CACHE_DIR/mirror/$HOST.sqlite.
+            es: `pulsarpy.elasticsearch_utils.Connection`. Used to fetch the records to mirror.
+                Defaults to ``pulsarpy.models.Model.ES`` as it is at the time of use, such that
+                ``pulsarpy.models.configure()``, cassettes, and dry runs apply.
+        """
+        if not path:
+            path = os.path.join(p.CACHE_DIR, "mirror", (p.HOST or "localhost") + ".sqlite")
+        self.path = path
+        self.es = es
+        self._local = threading.local()
+        # The foreign key columns of the tables, keyed by table name.
+        self._columns = {}
+        # The tables known to have the normalized_name column.
+        self._normalized_tables = set()
+
+    def _get_db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS mirror_state (es_index TEXT PRIMARY KEY, updated_at TEXT)")
+            db.commit()
+            self._local.db = db
+        return db
+
+    def _get_es(self):
+        if self.es is not None:
+            return self.es
+        # Imported here since pulsarpy.models imports this module.
+        import pulsarpy.models as models
+        return models.Model.ES
+
+    @staticmethod
+    def get_fkey_columns(model):
+        """
+        Returns the `list` of the model's foreign key fields that hold a single ID.
+        """
+        return sorted(x for x in model.FKEY_MAP if not x.endswith("_ids"))
+
+    @staticmethod
+    def get_link_fields(model):
+        """
+        Returns the `list` of the model's foreign key fields that hold an array of IDs.
+        """
+        return sorted(x for x in model.FKEY_MAP if x.endswith("_ids"))
+
+    @staticmethod
+    def get_link_table(model, field):
+        return "{}__{}".format(model.ES_INDEX_NAME, field)
+
+    def _create_tables(self, db, model):
+        table = model.ES_INDEX_NAME
+        db.execute('CREATE TABLE IF NOT EXISTS "{}" (id INTEGER PRIMARY KEY, name TEXT, normalized_name TEXT, updated_at TEXT, data TEXT)'.format(table))
+        existing = set(x[1] for x in db.execute('PRAGMA table_info("{}")'.format(table)))
+        if "normalized_name" not in existing:
+            self._add_normalized_names(db, table)
+        columns = self.get_fkey_columns(model)
+        for col in columns:
+            if col not in existing:
+                # FKEY_MAP gained a field since the table was created.
+                db.execute('ALTER TABLE "{}" ADD COLUMN "{}" INTEGER'.format(table, col))
+            db.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}")'.format(table, col))
+        db.execute('CREATE INDEX IF NOT EXISTS "{0}_name" ON "{0}" (name)'.format(table))
+        db.execute('CREATE INDEX IF NOT EXISTS "{0}_normalized_name" ON "{0}" (normalized_name)'.format(table))
+        db.execute('CREATE INDEX IF NOT EXISTS "{0}_updated_at" ON "{0}" (updated_at)'.format(table))
+        for field in self.get_link_fields(model):
+            link_table = self.get_link_table(model, field)
+            db.execute('CREATE TABLE IF NOT EXISTS "{}" (id INTEGER, ref_id INTEGER)'.format(link_table))
+            db.execute('CREATE INDEX IF NOT EXISTS "{0}_id" ON "{0}" (id)'.format(link_table))
+            db.execute('CREATE INDEX IF NOT EXISTS "{0}_ref_id" ON "{0}" (ref_id)'.format(link_table))
+        self._columns[table] = columns
+
+    def _add_normalized_names(self, db, table):
+        # Fills in the normalized_name column of a table created by an older version of this module.
+        db.execute('ALTER TABLE "{}" ADD COLUMN normalized_name TEXT'.format(table))
+        rows = db.execute('SELECT id, name FROM "{}" WHERE name IS NOT NULL'.format(table)).fetchall()
+        db.executemany('UPDATE "{}" SET normalized_name = ? WHERE id = ?'.format(table), [(normalize(x[1]), x[0]) for x in rows])
+        db.execute('CREATE INDEX IF NOT EXISTS "{0}_normalized_name" ON "{0}" (normalized_name)'.format(table))
+
+    def is_synced(self, model):
+        """
+        Returns `True` if the model has been synced into the mirror.
+        """
+        row = self._get_db().execute("SELECT 1 FROM mirror_state WHERE es_index = ?", (model.ES_INDEX_NAME,)).fetchone()
+        return row is not None
+
+    def get_high_water_mark(self, model):
+        """
+        Returns the latest updated_at timestamp of the model's records in the mirror, as an ISO 8601
+        `str`, or `None` if the model was never synced.
+        """
+        row = self._get_db().execute("SELECT updated_at FROM mirror_state WHERE es_index = ?", (model.ES_INDEX_NAME,)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, model, full=False):
+        """
+        Brings the model's table up to date with its Elasticsearch index.
+
+        Args:
+            model: A model class.
+            full: `bool`. True means to replace the table's content with all of the model's records,
+                which also drops the records that were deleted in Pulsar. Done anyway the first time
+                the model is synced.
+
+        Returns:
+            `int`. The number of records fetched.
+        """
+        db = self._get_db()
+        table = model.ES_INDEX_NAME
+        last_updated = None if full else self.get_high_water_mark(model)
+        with db:
+            self._create_tables(db, model)
+            if last_updated is None:
+                db.execute("DELETE FROM mirror_state WHERE es_index = ?", (table,))
+                db.execute('DELETE FROM "{}"'.format(table))
+                for field in self.get_link_fields(model):
+                    db.execute('DELETE FROM "{}"'.format(self.get_link_table(model, field)))
+        if last_updated:
+            docs = model.changed_since(last_updated, inclusive=True, es=self._get_es())
+        else:
+            docs = self._get_es().scroll(table)
+        high_water_mark = last_updated or ""
+        count = 0
+        batch = []
+        for doc in docs:
+            count += 1
+            batch.append(doc)
+            high_water_mark = max(high_water_mark, doc.get("updated_at") or "")
+            if len(batch) >= SYNC_BATCH_SIZE:
+                self._store(db, model, batch)
+                batch = []
+        self._store(db, model, batch)
+        with db:
+            db.execute("INSERT OR REPLACE INTO mirror_state VALUES (?, ?)", (table, high_water_mark))
+        return count
+
+    def _store(self, db, model, docs):
+        table = model.ES_INDEX_NAME
+        columns = self._columns[table]
+        placeholders = ", ".join(["?"] * (5 + len(columns)))
+        col_names = ", ".join(['"{}"'.format(x) for x in ["id", "name", "normalized_name", "updated_at", "data"] + columns])
+        sql = 'INSERT OR REPLACE INTO "{}" ({}) VALUES ({})'.format(table, col_names, placeholders)
+        with db:
+            for doc in docs:
+                name = doc.get("name")
+                row = [doc["id"], name, normalize(name) if name else None, doc.get("updated_at"), json.dumps(doc)]
+                row.extend(doc.get(x) or None for x in columns)
+                db.execute(sql, row)
+                for field in self.get_link_fields(model):
+                    link_table = self.get_link_table(model, field)
+                    db.execute('DELETE FROM "{}" WHERE id = ?'.format(link_table), (doc["id"],))
+                    db.executemany('INSERT INTO "{}" VALUES (?, ?)'.format(link_table), [(doc["id"], x) for x in doc.get(field) or []])
+
+    def get(self, model, rec_id):
+        """
+        Returns the document of the record with the given ID as a `dict`, or `None` if it isn't in
+        the mirror.
+        """
+        row = self._get_db().execute('SELECT data FROM "{}" WHERE id = ?'.format(model.ES_INDEX_NAME), (int(rec_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lookup_name(self, model, name):
+        """
+        Returns the `list` of the IDs of the records with the given name. Names are compared once
+        normalized (see ``pulsarpy.name_index.normalize()``).
+        """
+        table = model.ES_INDEX_NAME
+        db = self._get_db()
+        if table not in self._normalized_tables:
+            existing = set(x[1] for x in db.execute('PRAGMA table_info("{}")'.format(table)))
+            if "normalized_name" not in existing:
+                with db:
+                    self._add_normalized_names(db, table)
+            self._normalized_tables.add(table)
+        sql = 'SELECT id FROM "{}" WHERE normalized_name = ?'.format(table)
+        return [x[0] for x in db.execute(sql, (normalize(name),))]
+
+    def _where(self, model, payload):
+        columns = set(self._get_columns(model)) | {"id", "name", "updated_at"}
+        clauses = []
+        params = []
+        for field, val in payload.items():
+            if isinstance(val, bool):
+                val = int(val)
+            if field in columns:
+                clauses.append('"{}" = ?'.format(field))
+                params.append(val)
+            elif field in model.FKEY_MAP:
+                # Array foreign key: the record must refer to all of the given IDs.
+                for ref_id in val if isinstance(val, list) else [val]:
+                    clauses.append('id IN (SELECT id FROM "{}" WHERE ref_id = ?)'.format(self.get_link_table(model, field)))
+                    params.append(ref_id)
+            elif val is None or val == "":
+                clauses.append("coalesce(json_extract(data, ?), '') = ''")
+                params.append("$." + field)
+            else:
+                clauses.append("json_extract(data, ?) = ?")
+                params.extend(["$." + field, val])
+        return " AND ".join(clauses) or "1", params
+
+    def _get_columns(self, model):
+        table = model.ES_INDEX_NAME
+        if table not in self._columns:
+            self._columns[table] = self.get_fkey_columns(model)
+        return self._columns[table]
+
+    def find_by(self, model, payload):
+        """
+        Mirrors ``pulsarpy.models.Model.find_by()``: returns the JSON serialization of the first
+        record, by ID, whose attributes match all of those given, or `None`.
+        """
+        where, params = self._where(model, payload)
+        sql = 'SELECT data FROM "{}" WHERE {} ORDER BY id LIMIT 1'.format(model.ES_INDEX_NAME, where)
+        row = self._get_db().execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_all(self, model, payload):
+        """
+        Like ``find_by()``, but returns the `list` of all matching records, ordered by ID.
+        """
+        where, params = self._where(model, payload)
+        sql = 'SELECT data FROM "{}" WHERE {} ORDER BY id'.format(model.ES_INDEX_NAME, where)
+        return [json.loads(x[0]) for x in self._get_db().execute(sql, params)]
+
+    def get_referencing_ids(self, model, field, ref_id):
+        """
+        Returns the `list` of the IDs of the model's records whose given foreign key field refers
+        to the given ID, i.e. the Biosamples whose donor_id is 5. This is the reverse of the
+        relationship that the field expresses.
+        """
+        if field.endswith("_ids"):
+            sql = 'SELECT id FROM "{}" WHERE ref_id = ? ORDER BY id'.format(self.get_link_table(model, field))
+        else:
+            sql = 'SELECT id FROM "{}" WHERE "{}" = ? ORDER BY id'.format(model.ES_INDEX_NAME, field)
+        return [x[0] for x in self._get_db().execute(sql, (int(ref_id),))]
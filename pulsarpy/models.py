@@ -14,7 +14,10 @@ A client that contains classes named after each model in Pulsar to handle RESTfu
 the Pulsar API.
 """
 
+import atexit
 import base64
+import copy
+import gzip
 from importlib import import_module
 import inflection
 import json
@@ -23,11 +26,22 @@ import mimetypes
 import os
 import re
 import requests
+import threading
+import time
+from urllib.parse import urlparse
 import urllib3
 import pdb
 
 import pulsarpy as p
 import pulsarpy.elasticsearch_utils
+from pulsarpy import cassette
+from pulsarpy import concurrency
+from pulsarpy import metrics
+from pulsarpy import rate_limit
+from pulsarpy.name_index import NameIndex
+from pulsarpy import response_cache
+from pulsarpy import tracing
+from pulsarpy.schema_cache import SchemaCache
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -35,7 +49,99 @@ THIS_MODULE = import_module(__name__)
 # Note that using the json param in a HTTP request via the requests module will cause the
 # header 'content-type': 'application/json' to be set. Nonetheless, I'll explicitly set it here in case
 # the data parameter is ever mistakingly used instead of the json one.
-HEADERS = {'accept': 'application/json', 'content-type': 'application/json', 'Authorization': 'Token token={}'.format(p.API_TOKEN)}
+HEADERS = {'accept': 'application/json', 'accept-encoding': 'gzip, deflate', 'content-type': 'application/json', 'Authorization': 'Token token={}'.format(p.API_TOKEN)}
+#: The on-disk cache of model attribute schemas used by ``get_model_attrs()``.
+SCHEMA_CACHE = SchemaCache()
+#: The local index of exact record names consulted by ``Model.replace_name_with_id()``.
+NAME_INDEX = NameIndex()
+#: The ``pulsarpy.mirror.Mirror`` that reads are served from, if any. Set with ``use_mirror()``.
+MIRROR = None
+
+
+#: The ``pulsarpy.response_cache.ResponseCache`` that GET responses are cached in, if any. Set with
+#: ``use_response_cache()``, or from the environment variable PULSARPY_HTTP_CACHE_TTL.
+RESPONSE_CACHE = None
+if os.environ.get("PULSARPY_HTTP_CACHE_TTL"):
+    _default_ttl, _ttls = response_cache.parse_ttls(os.environ["PULSARPY_HTTP_CACHE_TTL"])
+    RESPONSE_CACHE = response_cache.ResponseCache(default_ttl=_default_ttl, ttls=_ttls)
+
+
+def configure(url=None, token=None, es_url=None):
+    """
+    Points pulsarpy at another Pulsar server and/or Elasticsearch cluster than the ones given by
+    the environment, i.e. a staging server or a ``pulsarpy.fake_server.FakeServer``. Only the given
+    settings are changed.
+
+    Args:
+        url: `str`. The Pulsar API URL, as in the environment variable PULSAR_API_URL.
+        token: `str`. The API token, as in the environment variable PULSAR_TOKEN.
+        es_url: `str`. The Elasticsearch URL, as in the environment variable ES_URL.
+    """
+    global SCHEMA_CACHE, NAME_INDEX
+    if es_url:
+        Model.ES = pulsarpy.elasticsearch_utils.Connection(url=es_url)
+        if CASSETTE:
+            Model.ES.ES = CASSETTE.wrap_es(Model.ES.ES)
+    if url:
+        p.URL = url
+        p.HOST = urlparse(url).hostname
+        for model in [Model] + list(Meta._MODELS.values()):
+            model.URL = os.path.join(p.URL, inflection.pluralize(model.MODEL_NAME))
+        SCHEMA_CACHE = SchemaCache()
+        _BULK_CREATE_SUPPORT.clear()
+    if url or es_url:
+        NAME_INDEX = NameIndex()
+    if token:
+        p.API_TOKEN = token
+        HEADERS["Authorization"] = "Token token={}".format(token)
+
+
+def use_response_cache(cache):
+    """
+    Caches the responses of GET requests sent through ``send_request()`` in the given cache, which
+    persists across runs and is shared with other processes using the same cache.
+
+    Args:
+        cache: `pulsarpy.response_cache.ResponseCache`, or `None` to stop caching.
+    """
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = cache
+
+
+def use_mirror(mirror):
+    """
+    Serves reads of the models that were synced into the given mirror from the mirror instead of
+    the Pulsar server, namely the lookups done by ``Model(uid)``, ``Model.find_by()``,
+    ``Model.get_many()``, and ``Model.load_related()``. Lookups that the mirror can't answer fall
+    back to the server. Writes aren't affected. Note that the mirror serves the records as indexed
+    into Elasticsearch (see ``pulsarpy.mirror``).
+
+    Args:
+        mirror: `pulsarpy.mirror.Mirror`, or `None` to stop using a mirror.
+    """
+    global MIRROR
+    MIRROR = mirror
+
+
+def use_cassette(cas):
+    """
+    Records the requests sent to the Pulsar API and to Elasticsearch into the given cassette, or
+    answers them from it, depending on the cassette's mode. The cassette that was in use before, if
+    any, is closed, which finishes writing it when recording.
+
+    Args:
+        cas: `pulsarpy.cassette.Cassette`, or `None` to send requests to the servers again.
+    """
+    global CASSETTE, SESSION
+    if CASSETTE:
+        SESSION = SESSION.session
+        if isinstance(Model.ES.ES, cassette._CassetteESClient):
+            Model.ES.ES = Model.ES.ES.client
+        CASSETTE.close()
+    CASSETTE = cas
+    if cas:
+        SESSION = cas.wrap_session(SESSION)
+        Model.ES.ES = cas.wrap_es(Model.ES.ES)
 
 # Curl Examples
 #
@@ -89,6 +195,239 @@ class RecordNotUnique(Exception):
     """
 
 
+########################
+### JSON CODEC LAYER ###
+########################
+
+def _load_json_codec(name):
+    """
+    Returns a tuple of the form (codec_name, dumps, loads) for the requested JSON library, where
+    ``dumps`` serializes to UTF-8 encoded `bytes`. If no library is requested, the fastest one that
+    is installed is used (orjson, then ujson), falling back to the standard library's json module.
+    """
+    if name in ("", "orjson"):
+        try:
+            import orjson
+            return "orjson", orjson.dumps, orjson.loads
+        except ImportError:
+            pass
+    if name in ("", "ujson"):
+        try:
+            import ujson
+            return "ujson", lambda obj: ujson.dumps(obj).encode("utf-8"), ujson.loads
+        except ImportError:
+            pass
+    return "json", lambda obj: json.dumps(obj).encode("utf-8"), json.loads
+
+#: The JSON library used to encode request bodies and decode response bodies. Can be forced to one
+#: of 'orjson', 'ujson', or 'json' via the environment variable PULSARPY_JSON_CODEC.
+JSON_CODEC, json_dumps, json_loads = _load_json_codec(os.environ.get("PULSARPY_JSON_CODEC", ""))
+
+#: Request bodies of at least this many bytes are gzip compressed before being sent, which pays off
+#: for large payloads such as base64 encoded ``Document`` data. The server must be able to inflate
+#: gzip request bodies, so this is off (0) unless the environment variable PULSARPY_GZIP_MIN_BYTES
+#: is set.
+GZIP_MIN_BYTES = int(os.environ.get("PULSARPY_GZIP_MIN_BYTES", 0))
+
+#: A ``requests.Session`` shared by all API calls, such that connections to the server are reused.
+SESSION = requests.Session()
+#: The ``pulsarpy.cassette.Cassette`` that requests are recorded into or replayed from, if any. Set
+#: with ``use_cassette()``, or from the environment variable PULSARPY_CASSETTE.
+CASSETTE = None
+
+#: Counters describing how request and response bodies were encoded. See ``codec_stats()``.
+CODEC_STATS = {
+    "requests": 0,
+    "request_bytes": 0,
+    "request_bytes_sent": 0,
+    "gzipped_requests": 0,
+    "responses": 0,
+    "response_bytes": 0,
+    "compressed_responses": 0
+}
+_CODEC_STATS_LOCK = threading.Lock()
+
+def codec_stats():
+    """
+    Returns a snapshot of ``CODEC_STATS`` along with the name of the JSON codec in use.
+
+    Returns:
+        `dict`.
+    """
+    with _CODEC_STATS_LOCK:
+        stats = dict(CODEC_STATS)
+    stats["json_codec"] = JSON_CODEC
+    stats["gzip_min_bytes"] = GZIP_MIN_BYTES
+    return stats
+
+metrics.REGISTRY.collectors["codec_stats"] = codec_stats
+
+#: Response status codes signaling that the server didn't process the request, which can thus be
+#: retried regardless of the HTTP method.
+RETRY_STATUSES = (429, 503)
+#: Response status codes (and connection failures) that are only retried for HTTP methods that are
+#: safe to repeat.
+IDEMPOTENT_RETRY_STATUSES = (502, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PATCH", "DELETE")
+
+def _send_with_retries(method, url, data, headers, endpoint_class, labels=("", "")):
+    """
+    Sends the request while holding a slot of ``concurrency.LIMITER``, reporting the outcome back
+    to it, and retries with jittered exponential backoff up to ``concurrency.MAX_RETRIES`` times
+    when the server is overloaded or unreachable. Each attempt first takes a token from the rate
+    limit bucket of the given endpoint class.
+    """
+    idempotent = method in IDEMPOTENT_METHODS
+    # Latency is compared between requests of the same kind only.
+    kind = (endpoint_class, labels[1])
+    attempt = 0
+    while True:
+        rate_limit.acquire(endpoint_class)
+        concurrency.LIMITER.acquire()
+        start = time.monotonic()
+        try:
+            res = SESSION.request(method, url, data=data, headers=headers, verify=False)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            concurrency.LIMITER.release(time.monotonic() - start, overloaded=True, kind=kind)
+            if not idempotent or attempt >= concurrency.MAX_RETRIES:
+                raise
+            metrics.record_retry(*labels, status="error")
+            time.sleep(concurrency.retry_delay(attempt))
+            attempt += 1
+            continue
+        except Exception:
+            # Any other failure, i.e. a cassette miss, must still give the slot back.
+            concurrency.LIMITER.release(time.monotonic() - start, kind=kind)
+            raise
+        status = res.status_code
+        concurrency.LIMITER.release(time.monotonic() - start, overloaded=(status == 429 or status >= 500), kind=kind)
+        retry = status in RETRY_STATUSES or (idempotent and status in IDEMPOTENT_RETRY_STATUSES)
+        if not retry or attempt >= concurrency.MAX_RETRIES:
+            return res
+        Model.debug_logger.debug("{} {} returned {}; retrying.".format(method, url, status))
+        metrics.record_retry(*labels, status=status)
+        time.sleep(concurrency.retry_delay(attempt, retry_after=res.headers.get("Retry-After")))
+        attempt += 1
+
+def send_request(method, url, payload=None, headers=None, endpoint_class=None, use_cache=True):
+    """
+    Sends an HTTP request to the Pulsar API. All calls to the server go through here, such that
+    the payload is serialized with the configured JSON codec and optionally gzip compressed.
+    Compressed responses are negotiated via the ``accept-encoding`` header in ``HEADERS``.
+    Requests are subject to the adaptive concurrency limit in ``pulsarpy.concurrency`` and to the
+    rate limits configured in ``pulsarpy.rate_limit``. GET requests without extra headers are
+    served from ``RESPONSE_CACHE`` when it's set, and other requests, except for searches sent as
+    ``rate_limit.RAILS_READ`` POSTs, evict the cached responses of the URL they are sent to. Each
+    request is recorded in ``pulsarpy.metrics``.
+
+    Args:
+        method: `str`. The HTTP method, i.e. GET.
+        url: `str`. The URL to send the request to.
+        payload: `dict`. Optional data to JSON serialize as the request body.
+        headers: `dict`. Optional headers to send in addition to ``HEADERS``.
+        endpoint_class: `str`. The rate limit bucket to draw from. Defaults to
+            ``rate_limit.RAILS_READ`` for GET requests and ``rate_limit.RAILS_WRITE`` otherwise.
+        use_cache: `bool`. False to send a GET request to the server even when its response is
+            cached. The cached response is then replaced with the fresh one.
+
+    Returns:
+        `requests.models.Response` instance.
+    """
+    if not endpoint_class:
+        endpoint_class = rate_limit.RAILS_READ if method == "GET" else rate_limit.RAILS_WRITE
+    req_headers = dict(HEADERS)
+    if headers:
+        req_headers.update(headers)
+    data = None
+    raw_size = 0
+    if payload is not None:
+        data = json_dumps(payload)
+        raw_size = len(data)
+        if GZIP_MIN_BYTES and raw_size >= GZIP_MIN_BYTES:
+            data = gzip.compress(data)
+            req_headers["content-encoding"] = "gzip"
+    model = get_model_for_url(url)
+    model_name = model.__name__ if model else None
+    labels = (model_name, get_request_op(method, url))
+    start = time.monotonic()
+    cache = RESPONSE_CACHE
+    cache_key = None
+    if cache and method == "GET" and not headers:
+        cache_key = cache.get_key(url, data, req_headers.get("Authorization"))
+        res = cache.get(cache_key) if use_cache else None
+        if res is not None:
+            metrics.record_request(*labels, status="cached", latency=time.monotonic() - start, response_bytes=len(res.content))
+            return res
+    with tracing.span("HTTP " + method, url=url) as sp:
+        try:
+            res = _send_with_retries(method, url, data=data, headers=req_headers, endpoint_class=endpoint_class, labels=labels)
+        except Exception:
+            metrics.record_request(*labels, status="error", latency=time.monotonic() - start, request_bytes=len(data) if data else 0)
+            raise
+        if sp:
+            sp.set(status=res.status_code)
+    metrics.record_request(*labels, status=res.status_code, latency=time.monotonic() - start,
+                           request_bytes=len(data) if data else 0, response_bytes=len(res.content))
+    if cache_key:
+        cache.put(cache_key, url, model_name, res)
+    elif cache and method != "GET" and endpoint_class != rate_limit.RAILS_READ and res.ok:
+        # A POST to a model's URL creates a record, which doesn't affect the cached records.
+        cache.invalidate(url, prefix=(method != "POST"))
+    with _CODEC_STATS_LOCK:
+        CODEC_STATS["requests"] += 1
+        CODEC_STATS["request_bytes"] += raw_size
+        CODEC_STATS["request_bytes_sent"] += len(data) if data else 0
+        if "content-encoding" in req_headers:
+            CODEC_STATS["gzipped_requests"] += 1
+        CODEC_STATS["responses"] += 1
+        CODEC_STATS["response_bytes"] += len(res.content)
+        if res.headers.get("Content-Encoding") in ("gzip", "deflate"):
+            CODEC_STATS["compressed_responses"] += 1
+    return res
+
+def get_model_for_url(url):
+    """
+    Returns the model class whose API URL the given URL falls under, or `None`.
+    """
+    if not url.startswith(p.URL):
+        return None
+    segment = url[len(p.URL):].lstrip("/").split("/", 1)[0].split("?", 1)[0]
+    return Meta._MODELS_BY_URL_NAME.get(segment)
+
+def get_request_op(method, url):
+    """
+    Returns the name of the operation that a request performs, for use as a metrics label: the
+    custom action at the end of the URL if there is one (i.e. find_by or parent_ids), otherwise the
+    lower-cased HTTP method.
+    """
+    path = url.split("?", 1)[0].rstrip("/")
+    model = get_model_for_url(url)
+    if model:
+        path = path[len(model.URL):]
+    else:
+        # Not a model's endpoint, i.e. utils/model_attrs.
+        path = path[len(p.URL):]
+    action = path.strip("/").rsplit("/", 1)[-1]
+    if action and not action.isdigit():
+        return action
+    return method.lower()
+
+def decode_json(response):
+    """
+    Deserializes the body of the given response with the configured JSON codec.
+
+    Args:
+        response: `requests.models.Response` instance.
+    """
+    return json_loads(response.content)
+
+
+#: The number of records to send per request to a model's bulk create endpoint.
+BULK_CREATE_CHUNK_SIZE = 500
+#: Whether the server has a bulk create endpoint, keyed by model URL. Filled in on first use.
+_BULK_CREATE_SUPPORT = {}
+
+
 def remove_model_prefix(uid):
     """
     Removes the optional model prefix from the given primary ID. For example, given the biosample
@@ -99,16 +438,71 @@ def remove_model_prefix(uid):
 
     return str(uid).split("-")[-1]
 
-def get_model_attrs(model_name):
+def get_model_attrs(model_name, refresh=False):
+    """
+    Fetches the attribute names of the given model. Schemas are kept in ``SCHEMA_CACHE``, keyed by
+    host and model, and are used without a round trip while fresh. A stale entry is revalidated
+    with a conditional GET so that the schema is only downloaded again when the server changed it.
+
+    Args:
+        model_name: `str`. The name of the model, i.e. Biosample.
+        refresh: `bool`. True means to revalidate the cached schema even if it is still fresh.
+
+    Returns:
+        The JSON response of the server-side ``utils/model_attrs`` endpoint.
+
+    Raises:
+        `requests.exceptions.HTTPError`: The status code is not ok.
+    """
+    entry = SCHEMA_CACHE.read(model_name)
+    if entry and not refresh and SCHEMA_CACHE.is_fresh(entry):
+        return entry["attrs"]
     url = os.path.join(p.URL, "utils/model_attrs")
     payload = {"model_name": model_name}
-    response = requests.get(url=url,headers=HEADERS, verify=False, json=payload)
+    headers = {}
+    if entry:
+        headers = SCHEMA_CACHE.conditional_headers(entry)
+    response = send_request("GET", url, payload=payload, headers=headers)
+    if entry and response.status_code == requests.codes.NOT_MODIFIED:
+        SCHEMA_CACHE.touch(model_name, entry)
+        return entry["attrs"]
     response.raise_for_status()
-    return response.json()
+    attrs = decode_json(response)
+    SCHEMA_CACHE.write(model_name, attrs, etag=response.headers.get("ETag"),
+                       last_modified=response.headers.get("Last-Modified"))
+    return attrs
+
+def prefetch_model_attrs(model_names=None, refresh=False):
+    """
+    Populates ``SCHEMA_CACHE`` with the attribute schemas of all models (or just the ones specified)
+    in one pass, so that schema-aware code can later run without any round trips to the server.
+    Models that the server doesn't know about are logged and skipped.
+
+    Args:
+        model_names: `list`. The names of the models to fetch. Defaults to all models in this module.
+        refresh: `bool`. True means to revalidate schemas that are still fresh.
+
+    Returns:
+        `dict`. Each key is a model name and each value is its attribute schema.
+    """
+    if not model_names:
+        model_names = sorted(Meta._MODELS)
+    schemas = {}
+    results = concurrency.bulk_map(lambda name: get_model_attrs(name, refresh=refresh), model_names)
+    for res in results:
+        if res.error:
+            Model.log_error("Can't fetch the attributes of model {}: {}".format(res.item, res.error))
+            continue
+        schemas[res.item] = res.value
+    return schemas
 
 class Meta(type):
     #: A list where each item is set to each instance's MODEL_ABBR class variable. 
     _MODEL_ABBREVS = []
+    #: A `dict` of all model classes, keyed by class name.
+    _MODELS = {}
+    #: A `dict` of all model classes, keyed by the last component of their API URL (i.e. biosamples).
+    _MODELS_BY_URL_NAME = {}
 
     @staticmethod
     def get_logfile_name(tag):
@@ -161,6 +555,9 @@ class Meta(type):
         newcls.URL = os.path.join(p.URL, inflection.pluralize(newcls.MODEL_NAME))
         if getattr(newcls, "MODEL_ABBR"):
             Meta._MODEL_ABBREVS.append(newcls.MODEL_ABBR)
+        if supers:
+            Meta._MODELS[classname] = newcls
+            Meta._MODELS_BY_URL_NAME[os.path.basename(newcls.URL)] = newcls
 
 
 class Model(metaclass=Meta):
@@ -192,6 +589,10 @@ class Model(metaclass=Meta):
     #: Each key is a foreign key name and the value is the class name of the model it refers to.
     FKEY_MAP = {}
 
+    #: The foreign key paths, as accepted by ``load_related()``, of the records that
+    #: ``load_bundle()`` fetches along with a record. Empty for models without a bundle.
+    BUNDLE_INCLUDE = []
+
     #: A prefix that can be added in front of record IDs, names, model-record ID. This is useful
     #: when its necessary to add emphasis that these records exist or came from Pulsar ( i.e. when 
     #: submitting them to an upstream database.
@@ -237,7 +638,7 @@ class Model(metaclass=Meta):
     #: password, respectively.
     ES = pulsarpy.elasticsearch_utils.Connection()
 
-    def __init__(self, uid=None, upstream=None):
+    def __init__(self, uid=None, upstream=None, include=None):
         """
         Find the record of the given model specified by self.MODEL_NAME. The record can be looked up
         in a few ways, depending on which argument is specified (uid or upstream). If both are specified,
@@ -249,10 +650,10 @@ class Model(metaclass=Meta):
                 Could also be the record's name if it has a name attribute (not all models do)
                 and if so will be converted to the record ID.
             upstream: If set, then the record will be searched on its upstream_identifier attribute.
+            include: `list`. Foreign key fields whose records to fetch along with this one. See
+                ``load_related()``.
         """
-        # self.attrs will store the actual record's attributes. Initialize value now to empty dict
-        # since it is expected to be set already in self.__setattr__().
-        self.__dict__["attrs"] = {}
+        self._init_state()
 
         # rec_id could be the record's name. Check for that scenario, and convert to record ID if
         # necessary.
@@ -263,12 +664,184 @@ class Model(metaclass=Meta):
             rec_json = self._get(upstream=upstream)
         else:
             raise ValueError("Either the 'uid' or 'upstream' parameter must be set.")
+        self._set_attrs(rec_json)
+        if include:
+            self.__class__.load_related([self], include)
+
+    def _init_state(self):
+        # self.attrs will store the actual record's attributes. Initialize value now to empty dict
+        # since it is expected to be set already in self.__setattr__().
+        self.__dict__["attrs"] = {}
+        #: The ETag and Last-Modified response headers of the last GET of the record. Used by
+        #: ``reload()`` to make conditional requests.
+        self.__dict__["etag"] = None
+        self.__dict__["last_modified"] = None
+        #: A copy of the attributes as they were last loaded from the server, against which
+        #: ``changed_fields()`` detects modifications.
+        self.__dict__["original_attrs"] = {}
+        #: The related records loaded by ``load_related()``, keyed by foreign key field name.
+        self.__dict__["related"] = {}
+
+    @classmethod
+    def from_json(cls, rec_json):
+        """
+        Creates an instance from the JSON serialization of a record that was already fetched,
+        without making any request.
+
+        Args:
+            rec_json: `dict`. The record's JSON serialization.
+        """
+        rec = cls.__new__(cls)
+        rec._init_state()
+        rec._set_attrs(rec_json)
+        rec.record_url = cls.get_record_url(rec.rec_id)
+        return rec
+
+    @classmethod
+    @tracing.traced
+    def get_many(cls, uids, include=None):
+        """
+        Fetches many records concurrently, fetching each distinct record only once.
+
+        Args:
+            uids: `list` of record IDs and/or names, as accepted by the constructor.
+            include: `list`. Foreign key fields whose records to fetch along with these. See
+                ``load_related()``.
+
+        Returns:
+            `list` of instances in the same order as `uids`.
+
+        Raises:
+            `pulsarpy.models.RecordNotFound`: A record could not be found.
+        """
+        ids = cls.replace_names_with_ids(uids)
+        results = concurrency.bulk_map(cls._get_json, list(dict.fromkeys(str(x) for x in ids.values())))
+        records = {}
+        for res in results:
+            if res.error:
+                raise res.error
+            records[res.item] = cls.from_json(res.value)
+        if include:
+            cls.load_related(list(records.values()), include)
+        return [records[str(ids[uid])] for uid in uids]
+
+    @classmethod
+    def load_related(cls, records, include, _loaded=None):
+        """
+        Fetches the records that the given records refer to through the specified foreign key
+        fields, and attaches them to each record's ``related`` attribute, i.e.
+        ``biosample.related["donor_id"]`` is a `Donor` instance and
+        ``biosample.related["library_ids"]`` is a `list` of `Library` instances. The target model of
+        each field is looked up in ``FKEY_MAP``. Nested relations can be given as dotted paths, i.e.
+        "library_ids.sequencing_request_ids".
+
+        The records needed at each level are gathered across all of the given records and fields,
+        so that each distinct record is fetched only once, and are then fetched in bulk per model
+        (see ``get_json_many()``). Note that the related records are thus built from the documents
+        of the models' Elasticsearch indices, which may lag slightly behind the database.
+
+        Args:
+            records: `list` of instances of this model.
+            include: `list` of foreign key field names or dotted paths of them.
+
+        Raises:
+            `ValueError`: A field isn't a foreign key of this model.
+            `pulsarpy.models.RecordNotFound`: A related record could not be found.
+        """
+        # The records fetched so far, keyed by (model name, record ID).
+        loaded = {} if _loaded is None else _loaded
+        nested = {}
+        for path in include:
+            field, _, rest = path.partition(".")
+            if field not in cls.FKEY_MAP:
+                raise ValueError("'{}' isn't a foreign key of model {}.".format(field, cls.__name__))
+            nested.setdefault(field, [])
+            if rest:
+                nested[field].append(rest)
+        wanted = {}
+        for field in nested:
+            model = getattr(THIS_MODULE, cls.FKEY_MAP[field])
+            for rec in records:
+                for rec_id in rec.get_fkey_ids(field):
+                    key = (model.__name__, str(rec_id))
+                    if key not in loaded:
+                        wanted[key] = model
+        by_model = {}
+        for key, model in wanted.items():
+            by_model.setdefault(model, []).append(key[1])
+        for res in concurrency.bulk_map(lambda model: model.get_json_many(by_model[model]), list(by_model)):
+            if res.error:
+                raise res.error
+            model = res.item
+            for rec_id, rec_json in res.value.items():
+                loaded[(model.__name__, rec_id)] = model.from_json(rec_json)
+        # The records to load the next level of, grouped by model and nested paths such that
+        # fields leading to the same model with the same paths (i.e. replicate_ids and
+        # control_replicate_ids) continue as one level.
+        groups = {}
+        for field in nested:
+            model = getattr(THIS_MODULE, cls.FKEY_MAP[field])
+            children = {}
+            for rec in records:
+                related = [loaded[(model.__name__, str(x))] for x in rec.get_fkey_ids(field)]
+                for child in related:
+                    children[id(child)] = child
+                if field.endswith("_ids"):
+                    rec.related[field] = related
+                else:
+                    rec.related[field] = related[0] if related else None
+            if nested[field] and children:
+                groups.setdefault((model, tuple(sorted(set(nested[field])))), {}).update(children)
+        for (model, paths), children in groups.items():
+            model.load_related(list(children.values()), list(paths), _loaded=loaded)
+
+    def load_bundle(self):
+        """
+        Fetches the graph of records given by ``BUNDLE_INCLUDE`` level by level, fetching each
+        distinct record once and the records of each level concurrently (see ``load_related()``).
+
+        Returns:
+            `Bundle`.
+
+        Raises:
+            `TypeError`: The model has no ``BUNDLE_INCLUDE``.
+        """
+        if not self.BUNDLE_INCLUDE:
+            raise TypeError("Model {} doesn't define a bundle.".format(self.__class__.__name__))
+        loaded = {(self.__class__.__name__, str(self.id)): self}
+        self.__class__.load_related([self], self.BUNDLE_INCLUDE, _loaded=loaded)
+        return Bundle(self, loaded)
+
+    def get_fkey_ids(self, field):
+        """
+        Returns the IDs stored in the given foreign key field as a `list`, which is empty when the
+        field isn't set.
+        """
+        val = self.attrs.get(field)
+        if not val:
+            return []
+        if field.endswith("_ids"):
+            return val
+        return [val]
+
+    def _set_attrs(self, rec_json):
+        """
+        Stores the record's JSON serialization as the instance's attributes.
+        """
         # Convert None values to empty string
         for key in rec_json:
             if rec_json[key] == None:
                 rec_json[key] = ""
         self.rec_id = rec_json["id"]
         self.__dict__["attrs"] = rec_json #avoid call to self.__setitem__() for this attr.
+        self.__dict__["original_attrs"] = copy.deepcopy(rec_json)
+
+    def _set_validators(self, response):
+        """
+        Stores the cache validators of the given GET response for use in conditional requests.
+        """
+        self.__dict__["etag"] = response.headers.get("ETag")
+        self.__dict__["last_modified"] = response.headers.get("Last-Modified")
 
     def __getattr__(self, name):
         """
@@ -283,8 +856,7 @@ class Model(metaclass=Meta):
         """
         if name not in self.attrs:
             return object.__setattr__(self, name, value)
-        object.__setattr__(self, self.attrs[name], value)
-        #self.__dict__["attrs"][name] = value #this works too
+        self.__dict__["attrs"][name] = value
 
     def __getitem__(self, item):
         return self.attrs[item]
@@ -293,6 +865,16 @@ class Model(metaclass=Meta):
         self.attrs[item] = value
 
 
+    @classmethod
+    def get_mirror(cls):
+        """
+        Returns the mirror that reads of this model are served from, or `None` if there isn't one
+        or the model hasn't been synced into it.
+        """
+        if MIRROR and MIRROR.is_synced(cls):
+            return MIRROR
+        return None
+
     def _get(self, rec_id=None, upstream=None):
         """
         Fetches a record by the record's ID or upstream_identifier.
@@ -302,18 +884,55 @@ class Model(metaclass=Meta):
         """
         if rec_id:
             self.record_url = self.__class__.get_record_url(rec_id)
+            mirror = self.__class__.get_mirror()
+            if mirror:
+                rec_json = mirror.get(self.__class__, rec_id)
+                if rec_json:
+                    return rec_json
             self.debug_logger.debug("GET {} record with ID {}: {}".format(self.__class__.__name__, rec_id, self.record_url))
-            response = requests.get(url=self.record_url, headers=HEADERS, verify=False)
+            response = send_request("GET", self.record_url)
             if not response.ok and response.status_code == requests.codes.NOT_FOUND:
                 raise RecordNotFound("Search for {} record with ID '{}' returned no results.".format(self.__class__.__name__, rec_id))
             self.write_response_html_to_file(response,"get_bob.html")
             response.raise_for_status()
-            return response.json()
+            self._set_validators(response)
+            return decode_json(response)
         elif upstream:
             rec_json = self.__class__.find_by({"upstream_identifier": upstream}, require=True)
             self.record_url = self.__class__.get_record_url(rec_json["id"])
         return rec_json
 
+    def reload(self):
+        """
+        Refreshes the record's attributes from the server. The GET is conditional on the ETag and
+        Last-Modified validators of the previous fetch, so when the record hasn't changed the
+        server can answer with a ``304 Not Modified`` and no body, in which case the current
+        attributes are kept as is. Useful for polling loops that watch many records.
+
+        Returns:
+            `bool`. True if the record changed on the server and the attributes were updated,
+            False otherwise.
+
+        Raises:
+            `pulsarpy.models.RecordNotFound`: The record no longer exists.
+            `requests.exceptions.HTTPError`: The status code is not ok.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        self.debug_logger.debug("Reloading {} record with ID {}: {}".format(self.__class__.__name__, self.rec_id, self.record_url))
+        response = send_request("GET", self.record_url, headers=headers, use_cache=False)
+        if response.status_code == requests.codes.NOT_MODIFIED:
+            return False
+        if response.status_code == requests.codes.NOT_FOUND:
+            raise RecordNotFound("{} record with ID '{}' no longer exists.".format(self.__class__.__name__, self.rec_id))
+        response.raise_for_status()
+        self._set_validators(response)
+        self._set_attrs(decode_json(response))
+        return True
+
     @classmethod
     def get_record_url(self, rec_id):
         return os.path.join(self.URL, str(rec_id))
@@ -327,11 +946,15 @@ class Model(metaclass=Meta):
         cls.post_logger.info(msg)
 
     @classmethod
+    @tracing.traced(attrs=["name"])
     def replace_name_with_id(cls, name):
         """
         Used to replace a foreign key reference using a name with an ID. Works by searching the
         record in Pulsar and expects to find exactly one hit. First, will check if the foreign key
         reference is an integer value and if so, returns that as it is presumed to be the foreign key.
+        If the model is served from a mirror (see ``use_mirror()``) or its name index has been built
+        (see ``build_name_index()``), the name is looked up there first, such that Elasticsearch is
+        only searched for names that aren't found locally.
 
         Raises:
             `pulsarpy.elasticsearch_utils.MultipleHitsException`: Multiple hits were returned from the name search.
@@ -345,15 +968,62 @@ class Model(metaclass=Meta):
         #Not an int, so maybe a combination of MODEL_ABBR and Primary Key, i.e. B-8.
         if name.split("-")[0] in Meta._MODEL_ABBREVS:
             return int(name.split("-", 1)[1])
+        mirror = cls.get_mirror()
+        ids = mirror.lookup_name(cls, name) if mirror else []
+        if not ids:
+            ids = NAME_INDEX.lookup(cls.ES_INDEX_NAME, name)
+        if len(ids) == 1:
+            return ids[0]
+        elif len(ids) > 1:
+            msg = "Found multiple records named '{}' for index '{}' locally.".format(name, cls.ES_INDEX_NAME)
+            raise pulsarpy.elasticsearch_utils.MultipleHitsException(msg)
         try:
             result = cls.ES.get_record_by_name(cls.ES_INDEX_NAME, name)
             if result:
+                NAME_INDEX.add(cls.ES_INDEX_NAME, result["name"], result["id"])
                 return result["id"]
         except pulsarpy.elasticsearch_utils.MultipleHitsException as e:
             raise
         raise RecordNotFound("Name '{}' for model '{}' not found.".format(name, cls.__name__))
 
 
+    @classmethod
+    def build_name_index(cls):
+        """
+        Builds the local name index of this model from a scan of its Elasticsearch index, after
+        which ``replace_name_with_id()`` resolves names locally. The index is kept up to date
+        incrementally from then on.
+
+        Returns:
+            `int`. The number of names indexed.
+        """
+        return NAME_INDEX.build(cls.ES_INDEX_NAME)
+
+    @classmethod
+    def replace_names_with_ids(cls, names):
+        """
+        A bulk version of ``replace_name_with_id()`` that resolves each distinct name only once and
+        does the lookups concurrently.
+
+        Args:
+            names: An iterable of record names and/or IDs.
+
+        Returns:
+            `dict`. Each key is one of the given names and each value is the record ID.
+
+        Raises:
+            `pulsarpy.elasticsearch_utils.MultipleHitsException`: Multiple hits were returned from a name search.
+            `pulsarpy.models.RecordNotFound`: No results were produced from a name search.
+        """
+        names = list(dict.fromkeys(names))
+        results = concurrency.bulk_map(cls.replace_name_with_id, names)
+        ids = {}
+        for res in results:
+            if res.error:
+                raise res.error
+            ids[res.item] = res.value
+        return ids
+
     @classmethod
     def add_model_name_to_payload(cls, payload):
         """
@@ -413,14 +1083,15 @@ class Model(metaclass=Meta):
     def delete(self):
         """Deletes the record.
         """
-        res = requests.delete(url=self.record_url, headers=HEADERS, verify=False)
+        res = send_request("DELETE", self.record_url)
         #self.write_response_html_to_file(res,"bob_delete.html")
         if res.status_code == 204:
             #No content. Can't render json:
             return {}
-        return res.json()
+        return decode_json(res)
 
     @classmethod
+    @tracing.traced(attrs=["payload"])
     def find_by(cls, payload, require=False):
         """
         Searches the model in question by AND joining the query parameters.
@@ -444,13 +1115,20 @@ class Model(metaclass=Meta):
         """
         if not isinstance(payload, dict):
             raise ValueError("The 'payload' parameter must be provided a dictionary object.")
+        mirror = cls.get_mirror()
+        if mirror:
+            res_json = mirror.find_by(cls, payload)
+            if res_json:
+                return res_json
+            # The record may have been created since the last sync, so ask the server; otherwise
+            # callers that create the record when it's not found would create it again.
         url = os.path.join(cls.URL, "find_by")
         payload = {"find_by": payload}
         cls.debug_logger.debug("Searching Pulsar {} for {}".format(cls.__name__, json.dumps(payload, indent=4)))
-        res = requests.post(url=url, json=payload, headers=HEADERS, verify=False)
+        res = send_request("POST", url, payload=payload, endpoint_class=rate_limit.RAILS_READ)
         #cls.write_response_html_to_file(res,"bob.html")
         res.raise_for_status()
-        res_json = res.json()
+        res_json = decode_json(res)
         if res_json:
            try:
                res_json = res_json[cls.MODEL_NAME]
@@ -462,6 +1140,21 @@ class Model(metaclass=Meta):
                 raise RecordNotFound("Can't find any {} records with search criteria: '{}'.".format(cls.__name__, payload))
         return res_json
 
+    @classmethod
+    def find_by_many(cls, payloads, require=False):
+        """
+        Runs ``find_by()`` concurrently for each of the given search payloads.
+
+        Args:
+            payloads: `list` of `dict` search payloads.
+            require: `bool`. Passed on to ``find_by()``.
+
+        Returns:
+            `list` of ``pulsarpy.concurrency.Result`` instances in the same order as `payloads`. The
+            value of each is what ``find_by()`` returned, and the error is any exception it raised.
+        """
+        return concurrency.bulk_map(lambda payload: cls.find_by(payload, require=require), payloads)
+
     @classmethod
     def find_by_or(cls, payload):
         """
@@ -486,8 +1179,10 @@ class Model(metaclass=Meta):
         url = os.path.join(cls.URL, "find_by_or")
         payload = {"find_by_or": payload}
         cls.debug_logger.debug("Searching Pulsar {} for {}".format(cls.__name__, json.dumps(payload, indent=4)))
-        res = requests.post(url=url, json=payload, headers=HEADERS, verify=False)
+        res = send_request("POST", url, payload=payload, endpoint_class=rate_limit.RAILS_READ)
         cls.write_response_html_to_file(res,"bob.html")
+        res.raise_for_status()
+        res = decode_json(res)
         if res:
            try:
                res = res[cls.MODEL_NAME]
@@ -496,6 +1191,148 @@ class Model(metaclass=Meta):
                pass
         return res
 
+    @classmethod
+    def search(cls, query=None, fields=None, page_size=pulsarpy.elasticsearch_utils.SEARCH_PAGE_SIZE):
+        """
+        Lazily streams all records matching an Elasticsearch query from the model's index
+        (``ES_INDEX_NAME``). Pages are only fetched as the generator is consumed.
+
+        Args:
+            query: `dict`. An Elasticsearch query. Defaults to matching all records.
+            fields: `list`. Only fetch these fields of each record. Defaults to all fields.
+            page_size: `int`. The number of records to fetch per request.
+
+        Returns:
+            A generator of `dict` records as indexed into Elasticsearch.
+        """
+        return cls.ES.search_iter(cls.ES_INDEX_NAME, query or {"match_all": {}}, fields=fields, page_size=page_size)
+
+    @classmethod
+    def changed_since(cls, timestamp, fields=None, inclusive=False, page_size=pulsarpy.elasticsearch_utils.SEARCH_PAGE_SIZE, es=None):
+        """
+        Lazily streams the records that were updated after the given time, oldest change first,
+        using a range query on the updated_at field of the model's Elasticsearch index. Thus jobs
+        that keep something in sync with Pulsar only fetch what changed. See
+        ``pulsarpy.change_feed.ChangeCursor`` for keeping track of where a job left off.
+
+        Args:
+            timestamp: `datetime.datetime` or ISO 8601 `str`. `None` means to stream all records.
+            fields: `list`. Only fetch these fields of each record. Defaults to all fields. The
+                updated_at field is always fetched.
+            inclusive: `bool`. True means to also stream the records updated exactly at the given
+                time, which guards against missing records that were indexed late with the same
+                timestamp at the cost of streaming some records twice.
+            page_size: `int`. The number of records to fetch per request.
+            es: `pulsarpy.elasticsearch_utils.Connection`. The cluster to search. Defaults to
+                ``ES``.
+
+        Returns:
+            A generator of `dict` records as indexed into Elasticsearch.
+        """
+        if timestamp is None:
+            query = {"match_all": {}}
+        else:
+            if not isinstance(timestamp, str):
+                timestamp = timestamp.isoformat()
+            query = {"range": {"updated_at": {"gte" if inclusive else "gt": timestamp}}}
+        if fields is not None and "updated_at" not in fields:
+            fields = list(fields) + ["updated_at"]
+        sort = [{"updated_at": "asc"}, {"id": "asc"}]
+        return (es or cls.ES).search_iter(cls.ES_INDEX_NAME, query, fields=fields, sort=sort, page_size=page_size)
+
+    @classmethod
+    def where(cls, fields=None, **criteria):
+        """
+        Lazily streams all records whose attributes have the given values, i.e.
+        ``Biosample.where(donor_id=3, wild_type=True)``. Unlike ``find_by()``, all matching records
+        are returned and the search runs against Elasticsearch rather than the Pulsar server.
+
+        A list value matches any of its items. A string value is matched case-insensitively against
+        the whole attribute value.
+
+        Args:
+            fields: `list`. Only fetch these fields of each record. Defaults to all fields.
+            criteria: The attribute values to match.
+
+        Returns:
+            A generator of `dict` records as indexed into Elasticsearch.
+        """
+        query, str_criteria = cls.criteria_to_search(criteria)
+        search_fields = fields
+        if fields is not None:
+            # The string fields are needed to filter the records, but aren't returned unless asked.
+            search_fields = list(fields) + [x for x in str_criteria if x not in fields]
+        for rec in cls.search(query, fields=search_fields):
+            if not all(str(rec.get(k, "")).lower().strip() == v for k, v in str_criteria.items()):
+                continue
+            if search_fields != fields:
+                rec = {k: v for k, v in rec.items() if k in fields}
+            yield rec
+
+    @classmethod
+    def count(cls, query=None, **criteria):
+        """
+        Counts the records matching either an Elasticsearch query or the given attribute values.
+        The latter are matched exactly as in ``where()``: without string values, the count is
+        done by Elasticsearch without fetching any records; with string values, the IDs and string
+        fields of the records that the search matches are streamed and filtered like in
+        ``where()``.
+
+        Args:
+            query: `dict`. An Elasticsearch query.
+            criteria: The attribute values to match when no query is given.
+
+        Returns:
+            `int`.
+        """
+        if query:
+            return cls.ES.count(cls.ES_INDEX_NAME, query)
+        query, str_criteria = cls.criteria_to_search(criteria)
+        if not str_criteria:
+            return cls.ES.count(cls.ES_INDEX_NAME, query)
+        return sum(1 for _ in cls.where(fields=["id"], **criteria))
+
+    @classmethod
+    def criteria_to_search(cls, criteria):
+        """
+        Plans the search shared by ``where()`` and ``count()``. The match_phrase queries used for
+        string values also match records whose value merely contains the phrase, so those values
+        must be compared with the records that the search returns.
+
+        Args:
+            criteria: `dict`. The attribute values to match.
+
+        Returns:
+            `tuple` of the form (query, str_criteria), where `query` is as returned by
+            ``criteria_to_query()`` and `str_criteria` holds the normalized string values to
+            compare, by field.
+        """
+        str_criteria = {k: v.lower().strip() for k, v in criteria.items() if isinstance(v, str)}
+        return cls.criteria_to_query(criteria), str_criteria
+
+    @staticmethod
+    def criteria_to_query(criteria):
+        """
+        Converts attribute values into an Elasticsearch query that requires all of them.
+
+        Args:
+            criteria: `dict`. The attribute values to match.
+
+        Returns:
+            `dict`.
+        """
+        filters = []
+        for field, val in criteria.items():
+            if isinstance(val, (list, tuple, set)):
+                filters.append({"terms": {field: list(val)}})
+            elif isinstance(val, str):
+                filters.append({"match_phrase": {field: val}})
+            else:
+                filters.append({"term": {field: val}})
+        if not filters:
+            return {"match_all": {}}
+        return {"bool": {"filter": filters}}
+
     @classmethod
     def index(cls):
         """Fetches all records.
@@ -506,10 +1343,11 @@ class Model(metaclass=Meta):
         Raises:
             `requests.exceptions.HTTPError`: The status code is not ok.
         """
-        res = requests.get(cls.URL, headers=HEADERS, verify=False)
+        res = send_request("GET", cls.URL)
         res.raise_for_status()
-        return res.json()
+        return decode_json(res)
 
+    @tracing.traced
     def patch(self, payload, append_to_arrays=True):
         """
         Patches current record and udpates the current instance's 'attrs'
@@ -517,6 +1355,9 @@ class Model(metaclass=Meta):
 
         Args:
             payload - hash. This will be JSON-formatted prior to sending the request.
+            append_to_arrays - bool. True means that the arrays in the payload are appended to the
+                record's current arrays, which are fetched from the server first rather than taken
+                from 'attrs', since those may be stale (i.e. when the record came from a mirror).
 
         Returns:
             `dict`. The JSON formatted response.
@@ -527,25 +1368,282 @@ class Model(metaclass=Meta):
         if not isinstance(payload, dict):
             raise ValueError("The 'payload' parameter must be provided a dictionary object.")
         payload = self.__class__.set_id_in_fkeys(payload)
-        if append_to_arrays:
-            for key in payload:
-                val = payload[key]
-                if type(val) == list:
-                    val.extend(getattr(self, key))
-                    payload[key] = list(set(val))
-        payload = self.check_boolean_fields(payload)
-        payload = self.__class__.add_model_name_to_payload(payload)
-        self.debug_logger.debug("PATCHING payload {}".format(json.dumps(payload, indent=4)))
-        res = requests.patch(url=self.record_url, json=payload, headers=HEADERS, verify=False)
-        self.write_response_html_to_file(res,"bob.html")
+        array_fields = [k for k, v in payload.items() if type(v) == list]
+        if append_to_arrays and array_fields:
+            current = self.__class__.get_current_values([self.rec_id], array_fields, fresh=True)[str(self.rec_id)]
+            if isinstance(current, Exception):
+                raise current
+            payload = self.merge_arrays(payload, current)
+        json_res = self.__class__._patch_prepared(self.record_url, payload)
+        self._set_attrs(json_res)
+        # The validators of the last GET no longer describe the record.
+        self.__dict__["etag"] = None
+        self.__dict__["last_modified"] = None
+        return json_res
+
+    def changed_fields(self):
+        """
+        Returns the names of the attributes that were modified since the record was loaded (or last
+        saved), whether by assignment (i.e. ``record.name = "bob"``) or by changing an array in
+        place (i.e. ``record.library_ids.append(5)``). Assigning an attribute its current value
+        doesn't count as a change.
+
+        Returns:
+            `list`.
+        """
+        original = self.original_attrs
+        return [key for key in self.attrs if key not in original or self.attrs[key] != original[key]]
+
+    def is_dirty(self):
+        return bool(self.changed_fields())
+
+    def save(self):
+        """
+        PATCHes just the attributes that were modified since the record was loaded, and does
+        nothing if there aren't any. Arrays that were only added to are sent as the record's current
+        value on the server extended with the additions, such that items added by someone else in
+        the meantime aren't lost; this costs a GET request. Arrays that had items removed are sent
+        as they are.
+
+        Returns:
+            `dict`: The JSON formatted response.
+            `None`: There weren't any changes to save.
+
+        Raises:
+            `requests.exceptions.HTTPError`: The status code is not ok.
+        """
+        changed = self.changed_fields()
+        if not changed:
+            return None
+        payload = {}
+        additions = {}
+        for key in changed:
+            val = self.attrs[key]
+            original = self.original_attrs.get(key)
+            if type(val) == list and type(original) == list and all(x in val for x in original):
+                # Only additions were made.
+                additions[key] = [x for x in val if x not in original]
+            else:
+                payload[key] = val
+        if additions:
+            current = self.__class__._get_json(self.rec_id, fresh=True)
+            payload.update(self.merge_arrays(additions, current))
+        return self.patch(payload, append_to_arrays=False)
+
+    @classmethod
+    def save_many(cls, records):
+        """
+        Calls ``save()`` concurrently on the records that were modified; unmodified records are
+        skipped without any request.
+
+        Args:
+            records: `list` of instances of this model.
+
+        Returns:
+            `list` of ``pulsarpy.concurrency.Result`` instances, one for each modified record.
+        """
+        return concurrency.bulk_map(lambda rec: rec.save(), [x for x in records if x.is_dirty()])
+
+    @staticmethod
+    def merge_arrays(payload, current):
+        """
+        Prepends the record's current value of each array in the payload to it, such that PATCHing
+        the payload appends to the arrays rather than overwriting them. Items already in the current
+        value aren't repeated, and the order of the items is kept.
+
+        Args:
+            payload: `dict`. The payload to PATCH.
+            current: `dict`. The record's current attributes.
+
+        Returns:
+            `dict`. A copy of the payload with the merged arrays. The given payload isn't modified.
+        """
+        merged = dict(payload)
+        for key, val in payload.items():
+            if type(val) == list:
+                items = list(current.get(key) or [])
+                items.extend(x for x in val if x not in items)
+                merged[key] = items
+        return merged
+
+    @classmethod
+    def _patch_prepared(cls, record_url, payload):
+        """
+        PATCHes a payload whose foreign keys have already been set to record IDs.
+        """
+        payload = cls.check_boolean_fields(payload)
+        payload = cls.add_model_name_to_payload(payload)
+        cls.debug_logger.debug("PATCHING payload {}".format(json.dumps(payload, indent=4)))
+        res = send_request("PATCH", record_url, payload=payload)
+        cls.write_response_html_to_file(res,"bob.html")
         res.raise_for_status()
-        json_res = res.json()
-        self.debug_logger.debug("Success")
-        self.attrs = json_res
+        json_res = decode_json(res)
+        cls.debug_logger.debug("Success")
         return json_res
 
     @classmethod
-    def set_id_in_fkeys(cls, payload):
+    @tracing.traced
+    def patch_many(cls, payloads, append_to_arrays=True, upstream=False, fresh=False):
+        """
+        Patches many records without fetching each of them first. Record identifiers and the foreign
+        key names used across all payloads are resolved in bulk. When appending to arrays, the
+        current values of the array fields being patched are read for all records at once (see
+        ``get_current_values()``). The PATCH requests are then sent concurrently.
+
+        Args:
+            payloads: `dict`. Each key identifies a record to patch (by ID, name, or upstream
+                identifier) and each value is the payload to PATCH it with.
+            append_to_arrays: `bool`. Same as in ``patch()``.
+            upstream: `bool`. True means that the keys of `payloads` are upstream identifiers.
+            fresh: `bool`. Passed on to ``get_current_values()``.
+
+        Returns:
+            `list` of ``pulsarpy.concurrency.Result`` instances in the same order as `payloads`.
+            The item of each is the record identifier, the value is the JSON serialization of the
+            patched record, and the error is any exception raised for that record.
+        """
+        uids = list(payloads)
+        for uid in uids:
+            if not isinstance(payloads[uid], dict):
+                raise ValueError("Each payload must be a dictionary object.")
+        if upstream:
+            lookups = concurrency.bulk_map(lambda uid: cls.find_by({cls.UPSTREAM_ATTR: uid}, require=True)["id"], uids)
+        else:
+            lookups = concurrency.bulk_map(cls.replace_name_with_id, uids)
+        # Holds the record ID and payload of each item, or the exception raised for it.
+        targets = [res.error or (res.value, dict(payloads[res.item])) for res in lookups]
+        resolved = cls.resolve_fkey_names([x[1] for x in targets if not isinstance(x, Exception)])
+        for i, target in enumerate(targets):
+            if isinstance(target, Exception):
+                continue
+            try:
+                targets[i] = (target[0], cls.set_id_in_fkeys(target[1], resolved=resolved))
+            except Exception as e:
+                targets[i] = e
+        if append_to_arrays:
+            array_fields = set()
+            rec_ids = []
+            for target in targets:
+                if isinstance(target, Exception):
+                    continue
+                fields = [k for k, v in target[1].items() if type(v) == list]
+                if fields:
+                    array_fields.update(fields)
+                    rec_ids.append(target[0])
+            current = cls.get_current_values(rec_ids, sorted(array_fields), fresh=fresh) if rec_ids else {}
+            for i, target in enumerate(targets):
+                if isinstance(target, Exception) or str(target[0]) not in current:
+                    continue
+                values = current[str(target[0])]
+                if isinstance(values, Exception):
+                    targets[i] = values
+                else:
+                    targets[i] = (target[0], cls.merge_arrays(target[1], values))
+
+        def patch_target(target):
+            if isinstance(target, Exception):
+                raise target
+            return cls._patch_prepared(cls.get_record_url(target[0]), target[1])
+
+        results = concurrency.bulk_map(patch_target, targets)
+        return [concurrency.Result(item=uid, value=res.value, error=res.error) for uid, res in zip(uids, results)]
+
+    @classmethod
+    def get_current_values(cls, rec_ids, fields, fresh=False):
+        """
+        Reads the current values of the given fields of many records with Elasticsearch multi-gets,
+        which are real-time, such that a PATCH appending to arrays needs a single bulk read rather
+        than one GET per record. As a guard against documents that aren't up to date, the records
+        missing from the index, or whose document lacks any of the fields, are fetched from the API
+        concurrently instead. What remains is the short time it takes the server to index a
+        change; callers that can't afford it pass `fresh`.
+
+        Args:
+            rec_ids: `list` of record IDs.
+            fields: `list` of field names.
+            fresh: `bool`. True to fetch all records from the API concurrently, bypassing the index,
+                the mirror, and the response cache, at the cost of one GET request per record.
+
+        Returns:
+            `dict`. Each key is a record ID (as a `str`) and each value is a `dict` of the fields,
+            or the exception raised when fetching the record.
+        """
+        rec_ids = [str(x) for x in dict.fromkeys(rec_ids)]
+        current = {}
+        if not fresh:
+            for rec_id, doc in cls.ES.mget(cls.ES_INDEX_NAME, rec_ids, fields=fields).items():
+                if all(k in doc for k in fields):
+                    current[rec_id] = {k: doc[k] for k in fields}
+        missing = [x for x in rec_ids if x not in current]
+        for res in concurrency.bulk_map(lambda rec_id: cls._get_json(rec_id, fresh=True), missing):
+            current[res.item] = res.error or {k: res.value.get(k) for k in fields}
+        return current
+
+    @classmethod
+    def get_json_many(cls, rec_ids):
+        """
+        Reads many records at once: from the mirror if the model has been synced into it, and
+        otherwise with Elasticsearch multi-gets. Records that aren't found there, i.e. the ones
+        created after the last sync or not indexed yet, are fetched from the API concurrently.
+
+        The documents of the Elasticsearch index and of the mirror are the records as indexed
+        (see ``changed_since()``), which have the record's attributes like the API's JSON
+        serialization, though they may lag slightly behind the database.
+
+        Args:
+            rec_ids: `list` of record IDs.
+
+        Returns:
+            `dict`. Each key is a record ID (as a `str`) and each value is the record's `dict`.
+
+        Raises:
+            `pulsarpy.models.RecordNotFound`: A record doesn't exist.
+        """
+        rec_ids = [str(x) for x in dict.fromkeys(rec_ids)]
+        mirror = cls.get_mirror()
+        if mirror:
+            found = {}
+            for rec_id in rec_ids:
+                rec_json = mirror.get(cls, rec_id)
+                if rec_json:
+                    found[rec_id] = rec_json
+        else:
+            found = cls.ES.mget(cls.ES_INDEX_NAME, rec_ids)
+        missing = [x for x in rec_ids if x not in found]
+        for res in concurrency.bulk_map(lambda rec_id: cls._get_json(rec_id, fresh=True), missing):
+            if res.error:
+                raise res.error
+            found[res.item] = res.value
+        return found
+
+    @classmethod
+    def _get_json(cls, rec_id, fresh=False):
+        """
+        Fetches the JSON serialization of the record with the given ID.
+
+        Args:
+            rec_id: The record ID.
+            fresh: `bool`. True to always ask the server, bypassing the mirror and the response
+                cache.
+
+        Raises:
+            `pulsarpy.models.RecordNotFound`: The record doesn't exist.
+            `requests.exceptions.HTTPError`: The status code is not ok.
+        """
+        mirror = None if fresh else cls.get_mirror()
+        if mirror:
+            rec_json = mirror.get(cls, rec_id)
+            if rec_json:
+                return rec_json
+        response = send_request("GET", cls.get_record_url(rec_id), use_cache=not fresh)
+        if response.status_code == requests.codes.NOT_FOUND:
+            raise RecordNotFound("Search for {} record with ID '{}' returned no results.".format(cls.__name__, rec_id))
+        response.raise_for_status()
+        return decode_json(response)
+
+    @classmethod
+    @tracing.traced
+    def set_id_in_fkeys(cls, payload, resolved=None):
         """
         Looks for any keys in the payload that end with either _id or _ids, signaling a foreign
         key field. For each foreign key field, checks whether the value is using the name of the
@@ -555,10 +1653,33 @@ class Model(metaclass=Meta):
 
         Args:
             payload: `dict`. The payload to POST or PATCH.
+            resolved: `dict`. Optional names that were already resolved, i.e. in bulk. Each key is
+                a tuple of the form (model_name, name) and each value is the record ID, or the
+                exception that was raised when trying to resolve it.
 
         Returns:
             `dict`. The payload.
         """
+        for key, model in cls.get_fkey_models(payload):
+            val = payload[key]
+            if key.endswith("_ids"):
+                payload[key] = [model._lookup_id(v, resolved) for v in val]
+            else:
+                payload[key] = model._lookup_id(val, resolved)
+        return payload
+
+    @classmethod
+    def get_fkey_models(cls, payload):
+        """
+        Finds the foreign key fields that are set in the given payload.
+
+        Args:
+            payload: `dict`. The payload to POST or PATCH.
+
+        Returns:
+            `list` of tuples of the form (field_name, model_class).
+        """
+        fkeys = []
         for key in payload:
             val = payload[key]
             if not val:
@@ -566,23 +1687,59 @@ class Model(metaclass=Meta):
             if key.endswith("_id"):
                 if key == "addgene_id":
                     continue
-                model = getattr(THIS_MODULE, cls.FKEY_MAP[key])
-                rec_id = model.replace_name_with_id(name=val)
-                payload[key] = rec_id
-            elif key.endswith("_ids"):
-                model = getattr(THIS_MODULE, cls.FKEY_MAP[key])
-                rec_ids = []
-                for v in val:
-                   rec_id = model.replace_name_with_id(name=v)
-                   rec_ids.append(rec_id)
-                payload[key] = rec_ids
-        return payload
+            elif not key.endswith("_ids"):
+                continue
+            fkeys.append((key, getattr(THIS_MODULE, cls.FKEY_MAP[key])))
+        return fkeys
+
+    @classmethod
+    def _lookup_id(cls, name, resolved=None):
+        key = (cls.__name__, name)
+        if resolved and key in resolved:
+            rec_id = resolved[key]
+            if isinstance(rec_id, Exception):
+                raise rec_id
+            return rec_id
+        return cls.replace_name_with_id(name=name)
+
+    @classmethod
+    def resolve_fkey_names(cls, payloads, known_ids=None):
+        """
+        Resolves the foreign key names used across all of the given payloads at once, looking up
+        each distinct name only once and doing the lookups concurrently.
+
+        Args:
+            payloads: `list` of `dict` payloads.
+            known_ids: `dict`. Optional names whose IDs are already known, i.e. from records that
+                were just created. Each key is a model name and each value is a `dict` mapping
+                record names to IDs.
+
+        Returns:
+            `dict` of the form accepted by the `resolved` parameter of ``set_id_in_fkeys()``.
+        """
+        known_ids = known_ids or {}
+        resolved = {}
+        pending = {}
+        for payload in payloads:
+            for key, model in cls.get_fkey_models(payload):
+                vals = payload[key] if key.endswith("_ids") else [payload[key]]
+                for val in vals:
+                    known = known_ids.get(model.__name__, {})
+                    if val in known:
+                        resolved[(model.__name__, val)] = known[val]
+                    else:
+                        pending[(model.__name__, val)] = model
+        results = concurrency.bulk_map(lambda key: pending[key].replace_name_with_id(name=key[1]), pending)
+        for res in results:
+            resolved[res.item] = res.error if res.error else res.value
+        return resolved
 
     @classmethod
     def prepost_hooks(cls, payload):
         return payload
 
     @classmethod
+    @tracing.traced
     def pre_post(cls, payload):
         """
         This class method should be implemented in subclasses only when there is sub-class specific
@@ -593,6 +1750,7 @@ class Model(metaclass=Meta):
 
 
     @classmethod
+    @tracing.traced
     def post(cls, payload):
         """Posts the data to the specified record.
 
@@ -610,26 +1768,148 @@ class Model(metaclass=Meta):
             raise ValueError("The 'payload' parameter must be provided a dictionary object.")
         payload = cls.pre_post(payload)
         payload = cls.set_id_in_fkeys(payload)
+        return cls._post_prepared(cls._finalize_post_payload(payload))
+
+    @classmethod
+    def _finalize_post_payload(cls, payload):
         payload = cls.check_boolean_fields(payload)
         payload = cls.add_model_name_to_payload(payload)
         # Run any pre-post hooks:
         payload = cls.prepost_hooks(payload)
+        return payload
+
+    @classmethod
+    def _post_prepared(cls, payload):
+        """
+        POSTs a payload that has already been run through ``pre_post()``, ``set_id_in_fkeys()``
+        and ``_finalize_post_payload()``.
+        """
         cls.debug_logger.debug("POSTING payload {}".format(json.dumps(payload, indent=4)))
-        res = requests.post(url=cls.URL, json=(payload), headers=HEADERS, verify=False)
+        res = send_request("POST", cls.URL, payload=payload)
         cls.write_response_html_to_file(res,"bob.html")
         if not res.ok:
             cls.log_error(res.text)
-            res_json = res.json()
+            res_json = decode_json(res)
             if "exception" in res_json:
                 exc_type = res_json["exception"]
                 if exc_type == "ActiveRecord::RecordNotUnique":
                     raise RecordNotUnique()
         res.raise_for_status()
-        res = res.json()
+        res = decode_json(res)
         cls.log_post(res)
         cls.debug_logger.debug("Success")
         return res
 
+    @classmethod
+    @tracing.traced
+    def post_many(cls, payloads, known_ids=None):
+        """
+        Creates many records. Each payload goes through the same preparation as in ``post()``,
+        except that the foreign key names used across all payloads are resolved together (see
+        ``resolve_fkey_names()``). The records are then created through the server's bulk create
+        endpoint if it has one, or otherwise by POSTing them concurrently.
+
+        ``pre_post()`` is run on one payload at a time, since it may look up and then create
+        dependent records (i.e. the PairedBarcode of a Library), which would otherwise be created
+        more than once when several payloads refer to the same one.
+
+        Args:
+            payloads: `list` of `dict` payloads, as would be passed to ``post()``.
+            known_ids: `dict`. Passed on to ``resolve_fkey_names()``.
+
+        Returns:
+            `list` of ``pulsarpy.concurrency.Result`` instances in the same order as `payloads`. The
+            item of each is the input payload, the value is the JSON serialization of the new record,
+            and the error is any exception raised for that payload, i.e. `RecordNotUnique` or
+            `requests.exceptions.HTTPError`.
+        """
+        for payload in payloads:
+            if not isinstance(payload, dict):
+                raise ValueError("Each payload must be a dictionary object.")
+        # Holds the prepared payload of each item, or the exception raised while preparing it.
+        prepared = []
+        for payload in payloads:
+            try:
+                prepared.append(cls.pre_post(dict(payload)))
+            except Exception as e:
+                prepared.append(e)
+        resolved = cls.resolve_fkey_names([x for x in prepared if not isinstance(x, Exception)], known_ids=known_ids)
+        for i, payload in enumerate(prepared):
+            if isinstance(payload, Exception):
+                continue
+            try:
+                prepared[i] = cls._finalize_post_payload(cls.set_id_in_fkeys(payload, resolved=resolved))
+            except Exception as e:
+                prepared[i] = e
+        positions = [i for i, x in enumerate(prepared) if not isinstance(x, Exception)]
+        outcomes = cls._bulk_create([prepared[i] for i in positions])
+        if outcomes is None:
+            outcomes = [res.error or res.value for res in concurrency.bulk_map(cls._post_prepared, [prepared[i] for i in positions])]
+        for i, outcome in zip(positions, outcomes):
+            prepared[i] = outcome
+        results = []
+        for payload, outcome in zip(payloads, prepared):
+            if isinstance(outcome, Exception):
+                results.append(concurrency.Result(item=payload, value=None, error=outcome))
+            else:
+                results.append(concurrency.Result(item=payload, value=outcome, error=None))
+        return results
+
+    @classmethod
+    def _bulk_create(cls, payloads):
+        """
+        Creates the records via the server-side bulk create endpoint, in chunks of
+        ``BULK_CREATE_CHUNK_SIZE``. Whether the server has this endpoint is found out on first use
+        and remembered for the rest of the process.
+
+        The endpoint is sent ``{"<pluralized model name>": [payload, ...]}``, where each payload is
+        what ``post()`` would send, and is expected to respond with a list in the same order, where
+        each item is either the new record or an error of the form
+        ``{"exception": "...", "message": "..."}``.
+
+        A chunk that fails as a whole, i.e. with a 5xx status or a connection error, gives that
+        exception as the outcome of each of its payloads, and the remaining chunks are still sent,
+        such that the caller knows exactly which records were created.
+
+        Args:
+            payloads: `list` of prepared payloads.
+
+        Returns:
+            `list` with the new record, or an exception, for each payload. `None` if the server
+            doesn't have a bulk create endpoint for this model.
+        """
+        if not payloads or _BULK_CREATE_SUPPORT.get(cls.URL) is False:
+            return None
+        url = os.path.join(cls.URL, "bulk_create")
+        outcomes = []
+        for start in range(0, len(payloads), BULK_CREATE_CHUNK_SIZE):
+            chunk = payloads[start:start + BULK_CREATE_CHUNK_SIZE]
+            try:
+                res = send_request("POST", url, payload={cls.ES_INDEX_NAME: chunk})
+                if res.status_code in (404, 405, 501) and not outcomes:
+                    _BULK_CREATE_SUPPORT[cls.URL] = False
+                    return None
+                # A 404 past the first chunk means that the endpoint went away midway, i.e. during
+                # a server deploy, and fails the chunk like any other error status.
+                res.raise_for_status()
+                items = decode_json(res)
+            except requests.exceptions.RequestException as e:
+                cls.log_error("Bulk create of {} records failed: {}".format(len(chunk), e))
+                outcomes.extend([e] * len(chunk))
+                continue
+            _BULK_CREATE_SUPPORT[cls.URL] = True
+            for item in items:
+                if "exception" in item:
+                    cls.log_error(str(item))
+                    if item["exception"] == "ActiveRecord::RecordNotUnique":
+                        outcomes.append(RecordNotUnique())
+                    else:
+                        outcomes.append(Exception(item.get("message", item["exception"])))
+                else:
+                    cls.log_post(item)
+                    outcomes.append(item)
+        return outcomes
+
     @classmethod
     def log_error(cls, msg):
         """
@@ -659,6 +1939,49 @@ class Model(metaclass=Meta):
         fout.write(response.text)
         fout.close()
 
+class Bundle():
+    """
+    An in-memory graph of records fetched together by ``Model.load_bundle()``. The records refer to
+    each other through their ``related`` attributes (i.e. ``bundle.root.related["replicate_ids"]``),
+    so the graph can be traversed without further requests.
+    """
+
+    def __init__(self, root, records):
+        """
+        Args:
+            root: The `Model` instance that the bundle was loaded for.
+            records: `dict`. The records of the bundle, including the root, keyed by
+                (model name, record ID as a `str`).
+        """
+        self.root = root
+        self.records = records
+        #: The paired input control map of a ChipseqExperiment bundle.
+        self.paired_input_control_map = None
+
+    def get(self, model_name, rec_id):
+        """
+        Returns the record of the given model and ID, or `None` if it isn't in the bundle.
+        """
+        return self.records.get((model_name, str(rec_id)))
+
+    def get_all(self, model_name):
+        """
+        Returns the records of the given model, i.e. 'Library', sorted by ID.
+        """
+        recs = [rec for (name, _), rec in self.records.items() if name == model_name]
+        return sorted(recs, key=lambda x: x.id)
+
+    def get_sequencing_results(self, library):
+        """
+        Returns the SequencingResults of the given Library, from the runs of its SequencingRequests.
+
+        Args:
+            library: A `Library` in the bundle, or its ID.
+        """
+        lib_id = getattr(library, "id", library)
+        return [x for x in self.get_all("SequencingResult") if str(x.library_id) == str(lib_id)]
+
+
 class Address(Model):
     MODEL_ABBR = "AD"
 
@@ -677,6 +2000,11 @@ class Atacseq(Model):
     FKEY_MAP["document_ids"] = "Document"
     FKEY_MAP["replicate_ids"] = "Library"
 
+    BUNDLE_INCLUDE = [
+        "biosample_id",
+        "replicate_ids.sequencing_request_ids.sequencing_run_ids.sequencing_result_ids"
+    ]
+
 
 class Barcode(Model):
     MODEL_ABBR = "BC"
@@ -694,7 +2022,7 @@ class Biosample(Model):
     FKEY_MAP["chipseq_experiment_id"] = "ChipseqExperiment"
     FKEY_MAP["crispr_modification_id"] = "CrisprModification"
     FKEY_MAP["donor_id"] = "Donor"
-    FKEY_MAP["immunoblot_ids"] = "Donor"
+    FKEY_MAP["immunoblot_ids"] = "Immunoblot"
     FKEY_MAP["library_ids"] = "Library"
     FKEY_MAP["owner_id"] = "Owner"
     FKEY_MAP["part_of_id"] = "Biosample"
@@ -714,9 +2042,9 @@ class Biosample(Model):
         Otherwise, the result will be an empty array.
         """
         action = os.path.join(self.record_url, "parent_ids")
-        res = requests.get(url=action, headers=HEADERS, verify=False)
+        res = send_request("GET", action)
         res.raise_for_status()
-        return res.json()["biosamples"]
+        return decode_json(res)["biosamples"]
         
     def find_first_wt_parent(self, with_ip=False):
         """
@@ -785,7 +2113,7 @@ class Batch(Model):
     FKEY_MAP = {}
     FKEY_MAP["user_id"] = "User"
     FKEY_MAP["analyst_id"] = "User"
-    FKEY_MAP["batch_item_ids"] = "Batch"
+    FKEY_MAP["batch_item_ids"] = "BatchItem"
     FKEY_MAP["library_prototype_id"] = "Library"
 
 class BatchItem(Model):
@@ -810,6 +2138,27 @@ class ChipseqExperiment(Model):
     FKEY_MAP["user_id"] = "User"
     FKEY_MAP["wild_type_control_id"] = "Biosample"
 
+    BUNDLE_INCLUDE = [
+        "replicate_ids.library_ids.sequencing_request_ids.sequencing_run_ids.sequencing_result_ids",
+        "control_replicate_ids.library_ids.sequencing_request_ids.sequencing_run_ids.sequencing_result_ids",
+        "wild_type_control_id.library_ids.sequencing_request_ids.sequencing_run_ids.sequencing_result_ids",
+        "target_id"
+    ]
+
+    def load_bundle(self):
+        """
+        Like ``Model.load_bundle()``, but also fetches the experiment's paired input control map
+        (see ``paired_input_control_map()``) while the graph loads, and stores it in the bundle's
+        ``paired_input_control_map`` attribute.
+        """
+        results = concurrency.bulk_map(lambda func: func(), [super().load_bundle, self.paired_input_control_map])
+        for res in results:
+            if res.error:
+                raise res.error
+        bundle = results[0].value
+        bundle.paired_input_control_map = results[1].value
+        return bundle
+
     def paired_input_control_map(self):
         """
         Creates a dict. where each key is the ID of a non-control Biosample record on the 
@@ -819,9 +2168,9 @@ class ChipseqExperiment(Model):
             `dict`. 
         """
         action = os.path.join(self.record_url, "paired_input_control_map")
-        res = requests.get(url=action, headers=HEADERS, verify=False)
+        res = send_request("GET", action)
         res.raise_for_status()
-        return res.json()
+        return decode_json(res)
 
 
 class DataStorage(Model):
@@ -842,9 +2191,9 @@ class Document(Model):
     def download(self):
         # The sever is Base64 encoding the payload, so we'll need to base64 decode it.
         url = self.record_url + "/download"
-        res = requests.get(url=url, headers=HEADERS, verify=False)
+        res = send_request("GET", url)
         res.raise_for_status()
-        data = base64.b64decode(res.json()["data"])
+        data = base64.b64decode(decode_json(res)["data"])
         return data
 
     @classmethod
@@ -904,11 +2253,11 @@ class CrisprModification(Model):
        url = self.record_url +  "/clone"
        self.debug_logger.debug("Cloning with URL {}".format(url))
        payload = {"biosample_id": biosample_id}
-       res = requests.post(url=url, json=payload, headers=HEADERS, verify=False)
+       res = send_request("POST", url, payload=payload)
        res.raise_for_status()
        self.write_response_html_to_file(res,"bob.html")
        self.debug_logger.debug("Cloned GeneticModification {}".format(self.rec_id))
-       return res.json()
+       return decode_json(res)
 
 
 class Donor(Model):
@@ -931,7 +2280,7 @@ class Gel(Model):
     FKEY_MAP["immunoblot_id"] = "Immunoblot"
     FKEY_MAP["pcr_id"] = "Pcr"
     FKEY_MAP["gel_image_ids"] = "GelImage"
-    FKEY_MAP["gel_image_ids"] = "GelLane"
+    FKEY_MAP["gel_lane_ids"] = "GelLane"
     
 
 class GelImage(Model):
@@ -980,6 +2329,7 @@ class Library(Model):
     FKEY_MAP["document_ids"] = "Document"
 
     @classmethod
+    @tracing.traced
     def pre_post(cls, payload):
         """
         A wrapper over Model.post() that handles the case where a Library has a PairedBarcode
@@ -1060,6 +2410,7 @@ class SequencingRequest(Model):
     FKEY_MAP["library_ids"] = "Library"
     FKEY_MAP["sequencing_platform_id"] = "SequencingPlatform"
     FKEY_MAP["sequencing_center_id"] = "SequencingCenter"
+    FKEY_MAP["sequencing_run_ids"] = "SequencingRun"
     FKEY_MAP["submitted_by_id"] = "User"
 
     def get_library_barcode_sequence_hash(self, inverse=False):
@@ -1075,9 +2426,9 @@ class SequencingRequest(Model):
         Returns: `dict`.
         """
         action = os.path.join(self.record_url, "get_library_barcode_sequence_hash")
-        res = requests.get(url=action, headers=HEADERS, verify=False)
+        res = send_request("GET", action)
         res.raise_for_status()
-        res_json = res.json()
+        res_json = decode_json(res)
         # Convert library ID from string to int
         new_res = {}
         for lib_id in res_json:
@@ -1101,6 +2452,7 @@ class SequencingRun(Model):
     FKEY_MAP = {}
     FKEY_MAP["data_storage_id"] = "DataStorage"
     FKEY_MAP["sequencing_request_id"] = "SequencingRequest"
+    FKEY_MAP["sequencing_result_ids"] = "SequencingResult"
     FKEY_MAP["submitted_by_id"] = "User"
 
     def library_sequencing_result(self, library_id):
@@ -1108,9 +2460,9 @@ class SequencingRun(Model):
         Fetches a SequencingResult record for a given Library ID.
         """
         action = os.path.join(self.record_url, "library_sequencing_result")
-        res = requests.get(url=action, json={"library_id": library_id}, headers=HEADERS, verify=False)
+        res = send_request("GET", action, payload={"library_id": library_id})
         res.raise_for_status()
-        return res.json()
+        return decode_json(res)
 
 
     def library_sequencing_results(self):
@@ -1190,7 +2542,7 @@ class User(Model):
             `NoneType`: None.
         """
         url = self.record_url + "/archive"
-        res = requests.patch(url=url, json={"user_id": user_id}, headers=HEADERS, verify=False)
+        res = send_request("PATCH", url, payload={"user_id": user_id})
         self.write_response_html_to_file(res,"bob.html")
         res.raise_for_status()
 
@@ -1204,7 +2556,7 @@ class User(Model):
             `NoneType`: None.
         """
         url = self.record_url + "/unarchive"
-        res = requests.patch(url=url, json={"user_id": user_id}, headers=HEADERS, verify=False)
+        res = send_request("PATCH", url, payload={"user_id": user_id})
         self.write_response_html_to_file(res,"bob.html")
         res.raise_for_status()
 
@@ -1216,10 +2568,10 @@ class User(Model):
             `str`: The new API key.
         """
         url = self.record_url + "/generate_api_key"
-        res = requests.patch(url=url, headers=HEADERS, verify=False)
+        res = send_request("PATCH", url)
         self.write_response_html_to_file(res,"bob.html")
         res.raise_for_status()
-        return res.json()["token"]
+        return decode_json(res)["token"]
 
     def remove_api_key(self):
         """
@@ -1230,7 +2582,7 @@ class User(Model):
             `NoneType`: None.
         """
         url = self.record_url + "/remove_api_key"
-        res = requests.patch(url=url, headers=HEADERS, verify=False)
+        res = send_request("PATCH", url)
         res.raise_for_status()
         self.api_key = ""
 
@@ -1242,6 +2594,10 @@ class Vendor(Model):
 class Well(Model):
     MODEL_ABBR = "WELL"
 
+if os.environ.get("PULSARPY_CASSETTE"):
+    use_cassette(cassette.from_env())
+    atexit.register(use_cassette, None)
+
 #if __name__ == "__main__":
     # pdb.set_trace()
     #b = Biosample()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+A persistent, local index of exact record names, used by
+``pulsarpy.models.Model.replace_name_with_id()`` to resolve names without a round trip to
+Elasticsearch.
+
+The index is a sqlite database at $CACHE_DIR/name_index/$HOST.sqlite that maps the normalized name
+(stripped and lower-cased) of each record to its ID, per Elasticsearch index. An index is built for
+a model with ``NameIndex.build()``, which scans the model's entire Elasticsearch index. From then
+on, it's brought up to date incrementally by ``NameIndex.update()``, which only fetches the
+records whose updated_at timestamp is at or after the latest one seen so far. Names of models
+whose index was never built are always looked up in Elasticsearch.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import pulsarpy as p
+
+#: The number of seconds after which a process brings a built index up to date before using it.
+#: Can be overridden with the environment variable PULSARPY_NAME_INDEX_REFRESH.
+DEFAULT_REFRESH_INTERVAL = int(os.environ.get("PULSARPY_NAME_INDEX_REFRESH", 300))
+
+
+def normalize(name):
+    return name.strip().lower()
+
+
+class NameIndex():
+    """
+    A sqlite backed mapping of normalized record names to record IDs. The database may be shared by
+    several threads and processes.
+    """
+
+    def __init__(self, path=None, es=None, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        """
+        Args:
+            path: `str`. The path to the sqlite database. Defaults to
+                $CACHE_DIR/name_index/$HOST.sqlite.
+            es: `pulsarpy.elasticsearch_utils.Connection`. Used to scan the Elasticsearch indices.
+                Defaults to ``pulsarpy.models.Model.ES`` as it is at the time of use, such that
+                ``pulsarpy.models.configure()``, cassettes, and dry runs apply.
+            refresh_interval: `int`. The number of seconds after which ``lookup()`` calls
+                ``update()`` first.
+        """
+        if not path:
+            path = os.path.join(p.CACHE_DIR, "name_index", (p.HOST or "localhost") + ".sqlite")
+        self.path = path
+        self.es = es
+        self.refresh_interval = refresh_interval
+        self._local = threading.local()
+        # When each index was last brought up to date by this process.
+        self._refreshed = {}
+        self._refresh_lock = threading.Lock()
+        # Held while checking whether an index is due for an update and updating it, keyed by
+        # Elasticsearch index, such that concurrent lookups start a single update.
+        self._update_locks = {}
+        # The indices known to have been built, which stay built unless cleared.
+        self._built = set()
+
+    def _get_db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS names (es_index TEXT, name TEXT, id INTEGER, PRIMARY KEY (es_index, name, id))")
+            db.execute("CREATE INDEX IF NOT EXISTS names_id ON names (es_index, id)")
+            db.execute("CREATE TABLE IF NOT EXISTS state (es_index TEXT PRIMARY KEY, updated_at TEXT)")
+            db.commit()
+            self._local.db = db
+        return db
+
+    def _get_es(self):
+        if self.es is not None:
+            return self.es
+        # Imported here since pulsarpy.models imports this module.
+        import pulsarpy.models as models
+        return models.Model.ES
+
+    def is_built(self, index):
+        """
+        Returns `True` if the given Elasticsearch index has been scanned by ``build()``. Once true,
+        the answer is remembered by this instance until ``clear()`` is called on it.
+        """
+        if index in self._built:
+            return True
+        row = self._get_db().execute("SELECT 1 FROM state WHERE es_index = ?", (index,)).fetchone()
+        if row is None:
+            return False
+        with self._refresh_lock:
+            self._built.add(index)
+        return True
+
+    def build(self, index):
+        """
+        (Re)builds the name index of the given Elasticsearch index from a scan of all of its
+        documents.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+
+        Returns:
+            `int`. The number of names indexed.
+        """
+        db = self._get_db()
+        docs = self._get_es().scroll(index, fields=["id", "name", "updated_at"])
+        with db:
+            db.execute("DELETE FROM names WHERE es_index = ?", (index,))
+            count = self._store(db, index, docs, last_updated="")
+        with self._refresh_lock:
+            self._refreshed[index] = time.monotonic()
+            self._built.add(index)
+        return count
+
+    def update(self, index):
+        """
+        Adds and renames the records of the given Elasticsearch index that were updated since the
+        last build or update. Records deleted in Pulsar aren't detected, which is harmless since
+        looking up their names fails on the server side later on anyway.
+
+        Returns:
+            `int`. The number of records fetched.
+        """
+        db = self._get_db()
+        row = db.execute("SELECT updated_at FROM state WHERE es_index = ?", (index,)).fetchone()
+        if row is None:
+            # Cleared, possibly by another process.
+            with self._refresh_lock:
+                self._built.discard(index)
+            return 0
+        last_updated = row[0]
+        query = {"range": {"updated_at": {"gte": last_updated}}} if last_updated else None
+        docs = self._get_es().scroll(index, query=query, fields=["id", "name", "updated_at"])
+        with db:
+            count = self._store(db, index, docs, last_updated=last_updated, replace=True)
+        with self._refresh_lock:
+            self._refreshed[index] = time.monotonic()
+        return count
+
+    def _store(self, db, index, docs, last_updated, replace=False):
+        # `last_updated` is the high-water mark of the updated_at timestamps seen. Comparing the
+        # ISO 8601 strings works because they are all in the same time zone.
+        count = 0
+        for doc in docs:
+            count += 1
+            if replace:
+                db.execute("DELETE FROM names WHERE es_index = ? AND id = ?", (index, doc["id"]))
+            name = doc.get("name")
+            if name:
+                db.execute("INSERT OR IGNORE INTO names VALUES (?, ?, ?)", (index, normalize(name), doc["id"]))
+            last_updated = max(last_updated, doc.get("updated_at") or "")
+        db.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (index, last_updated))
+        return count
+
+    def add(self, index, name, rec_id):
+        """
+        Records a name that was resolved by other means, i.e. by a search in Elasticsearch. Does
+        nothing if the index of the given Elasticsearch index was never built.
+        """
+        if not self.is_built(index):
+            return
+        db = self._get_db()
+        with db:
+            db.execute("INSERT OR IGNORE INTO names VALUES (?, ?, ?)", (index, normalize(name), rec_id))
+
+    def lookup(self, index, name):
+        """
+        Looks up a record ID by name, first bringing the index up to date if it's older than the
+        refresh interval.
+
+        Args:
+            index: `str`. The name of an Elasticsearch index (i.e. biosamples).
+            name: `str`. The name of the record. Compared case-insensitively.
+
+        Returns:
+            `list` of the IDs of the records having the name. Empty if there are none or if the
+            index of the given Elasticsearch index was never built.
+        """
+        if not self.is_built(index):
+            return []
+        with self._refresh_lock:
+            update_lock = self._update_locks.setdefault(index, threading.Lock())
+        with update_lock:
+            refreshed = self._refreshed.get(index)
+            if refreshed is None or time.monotonic() - refreshed > self.refresh_interval:
+                self.update(index)
+        rows = self._get_db().execute("SELECT id FROM names WHERE es_index = ? AND name = ?", (index, normalize(name))).fetchall()
+        return [x[0] for x in rows]
+
+    def clear(self, index=None):
+        """
+        Drops the index of the given Elasticsearch index, or of all indices.
+        """
+        db = self._get_db()
+        with db:
+            if index:
+                db.execute("DELETE FROM names WHERE es_index = ?", (index,))
+                db.execute("DELETE FROM state WHERE es_index = ?", (index,))
+            else:
+                db.execute("DELETE FROM names")
+                db.execute("DELETE FROM state")
+        with self._refresh_lock:
+            if index:
+                self._refreshed.pop(index, None)
+                self._built.discard(index)
+            else:
+                self._refreshed.clear()
+                self._built.clear()
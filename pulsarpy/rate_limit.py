@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Client-side token-bucket rate limiting, such that all pulsarpy jobs running on the same machine
+(i.e. cron jobs doing imports and monitoring) together stay within the request budget of the
+Pulsar server and the Elasticsearch cluster.
+
+There is one bucket per endpoint class: Rails reads, Rails writes, and Elasticsearch searches. The
+state of each bucket lives in a small file in $CACHE_DIR/ratelimit that is locked while tokens are
+taken, so buckets are shared between all threads and processes that use the same cache
+directory. A bucket is configured by setting an environment variable to the sustained number of
+requests per second, optionally followed by a colon and the burst size, i.e. '20' or '20:50':
+
+    1) PULSARPY_RATE_RAILS_READ
+    2) PULSARPY_RATE_RAILS_WRITE
+    3) PULSARPY_RATE_ES_SEARCH
+
+Endpoint classes that aren't configured aren't limited.
+"""
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where buckets are then only shared between threads.
+    fcntl = None
+
+import pulsarpy as p
+
+RAILS_READ = "rails_read"
+RAILS_WRITE = "rails_write"
+ES_SEARCH = "es_search"
+ENDPOINT_CLASSES = [RAILS_READ, RAILS_WRITE, ES_SEARCH]
+
+
+def parse_rate(spec):
+    """
+    Parses a rate specification of the form 'RATE[:BURST]'.
+
+    Returns:
+        `tuple` of the form (rate, burst), both `float`.
+
+    Raises:
+        `ValueError`: The rate isn't positive or the burst is below 1, in which case the bucket
+        could never hold the token that a request takes.
+    """
+    rate, _, burst = spec.partition(":")
+    rate = float(rate)
+    if rate <= 0:
+        raise ValueError("The rate in '{}' must be positive.".format(spec))
+    burst = float(burst) if burst else max(1.0, rate)
+    if burst < 1:
+        raise ValueError("The burst in '{}' must be at least 1.".format(spec))
+    return rate, burst
+
+
+class TokenBucket():
+    """
+    A token bucket whose state is stored in a file, such that it can be shared across processes.
+    """
+
+    def __init__(self, name, rate, burst, state_dir=None):
+        """
+        Args:
+            name: `str`. The name of the bucket, which is part of its state file name.
+            rate: `float`. The number of tokens added per second.
+            burst: `float`. The capacity of the bucket. Must be at least 1.
+            state_dir: `str`. The directory of the state file. Defaults to $CACHE_DIR/ratelimit.
+        """
+        if rate <= 0:
+            raise ValueError("The rate of bucket '{}' must be positive.".format(name))
+        if burst < 1:
+            raise ValueError("The burst of bucket '{}' must be at least 1.".format(name))
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        state_dir = state_dir or os.path.join(p.CACHE_DIR, "ratelimit")
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, "{}_{}.bucket".format(p.HOST or "localhost", name))
+        self._lock = threading.Lock()
+        self._fh = None
+        self._pid = None
+        # Used in place of the state file when there's no way to lock it.
+        self._state = (burst, time.time())
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until the given number of tokens could be taken from the bucket.
+
+        Raises:
+            `ValueError`: More tokens are requested than the bucket can hold, so that they'd never
+            become available.
+        """
+        if tokens > self.burst:
+            raise ValueError("Can't take {} tokens from bucket '{}' of burst {}.".format(
+                tokens, self.name, self.burst))
+        while True:
+            with self._lock:
+                wait = self._take(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _take(self, tokens):
+        """
+        Takes the tokens if available.
+
+        Returns:
+            `float`. 0 if the tokens were taken, otherwise the number of seconds until enough
+            tokens will have accumulated.
+        """
+        if not fcntl:
+            available, wait = self._refill(*self._state, tokens=tokens)
+            self._state = (available, time.time())
+            return wait
+        fh = self._get_file()
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            fh.seek(0)
+            try:
+                stored, stamp = [float(x) for x in fh.read().split()]
+            except ValueError:
+                # New or corrupt state file.
+                stored, stamp = self.burst, time.time()
+            available, wait = self._refill(stored, stamp, tokens=tokens)
+            fh.seek(0)
+            fh.truncate()
+            fh.write("{} {}".format(available, time.time()))
+            fh.flush()
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+        return wait
+
+    def _refill(self, stored, stamp, tokens):
+        available = min(self.burst, stored + (time.time() - stamp) * self.rate)
+        if available >= tokens:
+            return available - tokens, 0
+        return available, (tokens - available) / self.rate
+
+    def _get_file(self):
+        # A forked child shares the parent's open file description, and thereby its flock, so each
+        # process opens the state file for itself.
+        if self._fh is None or self._pid != os.getpid():
+            self._fh = open(self.path, "a+")
+            self._pid = os.getpid()
+        return self._fh
+
+
+def _load_buckets():
+    buckets = {}
+    for endpoint_class in ENDPOINT_CLASSES:
+        spec = os.environ.get("PULSARPY_RATE_" + endpoint_class.upper())
+        if spec:
+            buckets[endpoint_class] = TokenBucket(endpoint_class, *parse_rate(spec))
+    return buckets
+
+#: The configured buckets, keyed by endpoint class.
+BUCKETS = _load_buckets()
+
+
+def set_rate(endpoint_class, rate, burst=None):
+    """
+    Configures the rate limit of the given endpoint class, replacing any existing one.
+
+    Args:
+        endpoint_class: `str`. One of ``ENDPOINT_CLASSES``.
+        rate: `float`. The sustained number of requests per second. `None` removes the limit.
+        burst: `float`. The number of requests that may be sent at once. Defaults to `rate`.
+    """
+    if endpoint_class not in ENDPOINT_CLASSES:
+        raise ValueError("Unknown endpoint class '{}'.".format(endpoint_class))
+    if rate is None:
+        BUCKETS.pop(endpoint_class, None)
+        return
+    BUCKETS[endpoint_class] = TokenBucket(endpoint_class, rate, burst or max(1.0, rate))
+
+
+def acquire(endpoint_class):
+    """
+    Blocks until a request of the given endpoint class may be sent.
+    """
+    bucket = BUCKETS.get(endpoint_class)
+    if bucket:
+        bucket.acquire()
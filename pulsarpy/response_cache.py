@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+An optional, persistent cache of the responses to GET requests made to the Pulsar API, such that
+short-lived scripts (i.e. cron jobs) don't download the same reference records (i.e. vendors,
+sequencing platforms, and barcodes) again on every run.
+
+Responses are stored in a sqlite database at $CACHE_DIR/http_cache/$HOST.sqlite, keyed by the
+request URL and body and by a hash of the API token, so users never see responses fetched with
+someone else's permissions. Each entry expires after the TTL of the model that the URL belongs
+to. The total size of the stored bodies is capped, and the least recently used entries are evicted
+when the cap is exceeded. The database may be shared by several threads and processes.
+
+The cache is used by ``pulsarpy.models.send_request()`` once it is set with
+``pulsarpy.models.use_response_cache()``, or from the start when the environment variable
+PULSARPY_HTTP_CACHE_TTL is set. Its value is the default TTL in seconds, optionally followed by
+per-model TTLs, i.e. '300,Vendor=86400,Biosample=60'. Writes to a record evict the cached
+responses under the record's URL.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+import pulsarpy as p
+
+#: The largest total size, in bytes, of the cached response bodies. Can be overridden with the
+#: environment variable PULSARPY_HTTP_CACHE_MAX_BYTES.
+DEFAULT_MAX_BYTES = int(os.environ.get("PULSARPY_HTTP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+#: The number of seconds a response is cached for if its model has no TTL of its own.
+DEFAULT_TTL = 300
+
+
+def parse_ttls(spec):
+    """
+    Parses a TTL specification of the form 'DEFAULT[,MODEL=TTL...]', where each TTL is in seconds.
+
+    Returns:
+        `tuple` of the form (default_ttl, ttls), where `ttls` is a `dict` of TTLs by model name.
+    """
+    default_ttl = DEFAULT_TTL
+    ttls = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model_name, sep, ttl = item.rpartition("=")
+        if sep:
+            ttls[model_name.strip()] = float(ttl)
+        else:
+            default_ttl = float(ttl)
+    return default_ttl, ttls
+
+
+class ResponseCache():
+    """
+    A size-bounded sqlite store of GET responses with per-model expiration.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, default_ttl=DEFAULT_TTL, ttls=None):
+        """
+        Args:
+            path: `str`. The path to the sqlite database. Defaults to
+                $CACHE_DIR/http_cache/$HOST.sqlite.
+            max_bytes: `int`. The largest total size of the cached response bodies.
+            default_ttl: `float`. The number of seconds responses are cached for by default.
+            ttls: `dict`. The number of seconds responses are cached for, by model name. A TTL of 0
+                disables caching for the model.
+        """
+        if not path:
+            path = os.path.join(p.CACHE_DIR, "http_cache", (p.HOST or "localhost") + ".sqlite")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self._local = threading.local()
+
+    def _get_db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, body BLOB,
+                size INTEGER, expires_at REAL, last_access REAL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_url ON responses (url)")
+            db.commit()
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def get_key(url, data, auth):
+        """
+        Computes the cache key of a request.
+
+        Args:
+            url: `str`. The request URL.
+            data: `bytes`. The request body, if any.
+            auth: `str`. The value of the request's Authorization header.
+        """
+        digest = hashlib.sha256()
+        for part in (url.encode("utf-8"), data or b"", (auth or "").encode("utf-8")):
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def get_ttl(self, model_name):
+        return self.ttls.get(model_name, self.default_ttl)
+
+    def get(self, key):
+        """
+        Returns the cached response for the given key as a `requests.models.Response`, or `None`
+        if there isn't one or it has expired.
+        """
+        db = self._get_db()
+        row = db.execute("SELECT url, status, headers, body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        url, status, headers, body, expires_at = row
+        now = time.time()
+        with db:
+            if expires_at <= now:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        response = requests.models.Response()
+        response.status_code = status
+        response.url = url
+        response.headers = requests.structures.CaseInsensitiveDict(json.loads(headers))
+        response._content = body
+        return response
+
+    def put(self, key, url, model_name, response):
+        """
+        Stores a successful response, evicting the least recently used entries if the size cap is
+        exceeded. Does nothing for models whose TTL is 0 or for responses that could never fit.
+
+        Args:
+            key: `str`. The cache key as returned by ``get_key()``.
+            url: `str`. The request URL.
+            model_name: `str`. The name of the model the URL belongs to, if any.
+            response: `requests.models.Response`.
+        """
+        ttl = self.get_ttl(model_name)
+        body = response.content
+        if ttl <= 0 or response.status_code != requests.codes.OK or len(body) > self.max_bytes:
+            return
+        # The body is stored decoded, so the headers describing its transfer encoding no longer apply.
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        now = time.time()
+        db = self._get_db()
+        with db:
+            db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (key, url, response.status_code, json.dumps(headers), body, len(body), now + ttl, now))
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        total = db.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+        excess = total - self.max_bytes
+        rows = db.execute("SELECT key, size FROM responses ORDER BY last_access")
+        doomed = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def invalidate(self, url, prefix=True):
+        """
+        Evicts the cached responses of the given URL.
+
+        Args:
+            url: `str`. The URL.
+            prefix: `bool`. True means to also evict the responses of all URLs under the given
+                one, i.e. a record's custom action endpoints.
+        """
+        url = url.rstrip("/")
+        db = self._get_db()
+        with db:
+            if prefix:
+                db.execute("DELETE FROM responses WHERE url = ? OR substr(url, 1, ?) = ?", (url, len(url) + 1, url + "/"))
+            else:
+                db.execute("DELETE FROM responses WHERE url = ?", (url,))
+
+    def clear(self):
+        """
+        Evicts all entries.
+        """
+        db = self._get_db()
+        with db:
+            db.execute("DELETE FROM responses")
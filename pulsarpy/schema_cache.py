@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+A persistent, on-disk cache of the model attribute schemas returned by the server-side
+``utils/model_attrs`` endpoint. Schemas only change when the Pulsar server is deployed, so they
+are stored locally per server and model and revalidated with the server's ``ETag`` and
+``Last-Modified`` validators once they are older than the configured maximum age.
+"""
+
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlparse
+
+import pulsarpy as p
+
+#: The default number of seconds that a cached schema is used without asking the server whether
+#: it has changed. Can be overridden with the environment variable PULSARPY_SCHEMA_MAX_AGE.
+DEFAULT_MAX_AGE = int(os.environ.get("PULSARPY_SCHEMA_MAX_AGE", 24 * 60 * 60))
+
+
+class SchemaCache():
+    """
+    Stores one JSON file per model in the directory $CACHE_DIR/schemas/$SERVER, where $CACHE_DIR is
+    given by ``pulsarpy.CACHE_DIR`` and $SERVER is the host and port of the Pulsar API URL (i.e.
+    localhost_3000), such that servers sharing a host don't share schemas. Each file holds the
+    model's attributes along with the validators that the server sent with them.
+    """
+
+    def __init__(self, cache_dir=None, host=None, max_age=DEFAULT_MAX_AGE):
+        """
+        Args:
+            cache_dir: `str`. The root cache directory. Defaults to ``pulsarpy.CACHE_DIR``.
+            host: `str`. The Pulsar server the schemas belong to, as host[:port]. Defaults to the
+                host and port of ``pulsarpy.URL``.
+            max_age: `int`. The number of seconds a cached schema is considered fresh, meaning
+                that it is used without any round trip to the server.
+        """
+        cache_dir = cache_dir or p.CACHE_DIR
+        host = host or urlparse(p.URL).netloc or "localhost"
+        # Colons aren't allowed in Windows file names.
+        self.schema_dir = os.path.join(cache_dir, "schemas", host.replace(":", "_"))
+        self.max_age = max_age
+
+    def get_path(self, model_name):
+        return os.path.join(self.schema_dir, model_name + ".json")
+
+    def read(self, model_name):
+        """
+        Returns the cache entry for the given model, or `None` if there isn't a usable one.
+
+        Returns:
+            `dict` with the keys 'attrs', 'etag', 'last_modified', and 'fetched_at'.
+        """
+        try:
+            with open(self.get_path(model_name)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, model_name, attrs, etag=None, last_modified=None):
+        """
+        Atomically stores the attributes of the given model along with the validators the server
+        returned for them, such that concurrent readers never see a partially written file.
+        """
+        entry = {
+            "attrs": attrs,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time()
+        }
+        os.makedirs(self.schema_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.schema_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as fout:
+            json.dump(entry, fout)
+        os.replace(tmp_path, self.get_path(model_name))
+        return entry
+
+    def touch(self, model_name, entry):
+        """
+        Marks the given entry as freshly validated, i.e. after the server responded with a
+        ``304 Not Modified``.
+        """
+        return self.write(model_name, entry["attrs"], etag=entry["etag"], last_modified=entry["last_modified"])
+
+    def is_fresh(self, entry):
+        return (time.time() - entry["fetched_at"]) < self.max_age
+
+    def conditional_headers(self, entry):
+        """
+        Returns the ``If-None-Match`` and ``If-Modified-Since`` request headers for the given entry.
+        """
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def clear(self, model_name=None):
+        """
+        Removes the cached schema of the given model, or all cached schemas for the host when
+        `model_name` isn't specified.
+        """
+        if model_name:
+            names = [model_name + ".json"]
+        elif os.path.isdir(self.schema_dir):
+            names = os.listdir(self.schema_dir)
+        else:
+            names = []
+        for name in names:
+            try:
+                os.remove(os.path.join(self.schema_dir, name))
+            except FileNotFoundError:
+                pass
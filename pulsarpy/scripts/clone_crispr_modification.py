@@ -13,6 +13,7 @@ Clones the specified CrisprModification onto the desired biosamples.
 import argparse
 
 import pdb
+from pulsarpy.dry_run import DryRun
 import pulsarpy.models as models
 import pulsarpy.utils
 
@@ -20,12 +21,20 @@ import pulsarpy.utils
 def get_parser():
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("-i", "--infile", required=True, help="Tab-delimited input file where column 1 is the id or name of the CrisprModification to clone, and the second column is one or more comma-delimited biosample IDs or biosample names.")
+    parser.add_argument("--dry-run", action="store_true", help="Don't clone anything, but report the number of calls the cloning would make to Pulsar and Elasticsearch by endpoint, the estimated wall time, and the names that would need to be resolved to IDs.")
     return parser
 
 def main():
     parser = get_parser()
     args = parser.parse_args()
-    infile = args.infile
+    if not args.dry_run:
+        clone(args.infile)
+        return
+    with DryRun() as plan:
+        clone(args.infile)
+    print(plan.format_summary())
+
+def clone(infile):
     fh= open(infile)
     for line in fh:
         if line.startswith("#"):
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###Author
+#Nathaniel Watson
+#2019-08-12
+#nathankw@stanford.edu
+###
+
+"""
+Exports all records of a model, as indexed in Elasticsearch, to gzip compressed NDJSON files in
+the given directory. The index is read in parallel slices, one worker process per slice, and each
+slice is written to its own file (i.e. biosamples-000.ndjson.gz). Progress is reported in
+documents per second on stderr.
+"""
+
+import argparse
+
+import pulsarpy.models as models
+import pulsarpy.exporter as exporter
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-m", "--model", required=True, help="""
+      The name of the model to export, i.e. Biosample.""")
+    parser.add_argument("-o", "--outdir", required=True, help="""
+      The directory to write the NDJSON files to.""")
+    parser.add_argument("-s", "--slices", type=int, help="""
+      The number of parallel slices, and thus worker processes and output files. Defaults to the
+      number of CPUs.""")
+    parser.add_argument("-f", "--fields", nargs="+", help="""
+      Only export these fields of each record.""")
+    parser.add_argument("-e", "--es-url", help="""
+      The URL of the Elasticsearch cluster. Defaults to the value of the environment variable
+      ES_URL.""")
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    model = getattr(models, args.model)
+    stats = exporter.export_index(model.ES_INDEX_NAME, args.outdir, slices=args.slices, fields=args.fields, es_url=args.es_url)
+    for path in stats["files"]:
+        print(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###Author
+#Nathaniel Watson
+#2019-08-12
+#nathankw@stanford.edu
+###
+
+"""
+Imports the records of several models at once from a workbook, in the order that is implied by
+the foreign keys between the models. The workbook is either a directory containing one
+tab-delimited sheet per model, named after the model (i.e. Donor.tsv, Biosample.tsv, Library.tsv),
+or an Excel workbook whose worksheets are named after the models. Each sheet has the same format
+as the input file of tab_import.py.
+"""
+
+import argparse
+
+import pulsarpy.models as models
+import pulsarpy.importer as importer
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-i", "--input", required=True, help="""
+      A directory of tab-delimited sheets or an Excel workbook.""")
+    parser.add_argument("--skip-dups", action="store_true", help="""
+      If an attempt to POST a duplicate record is made, the server will respond with a ActiveRecord::RecordNotUnique
+      exception. Including this flag indicates to not count these rows as failures.""")
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    workbook = importer.read_workbook(args.input)
+    levels = importer.get_import_levels(workbook)
+    for num, level in enumerate(levels, 1):
+        print("Level {}: {}".format(num, ", ".join(x.__name__ for x in level)))
+    importer.import_workbook(workbook, skip_dups=args.skip_dups)
+    failures = 0
+    for level in levels:
+        for model in level:
+            for row in workbook[model]:
+                res = row.result
+                prefix = "{} line {}:".format(model.__name__, row.line_num)
+                if not res.error:
+                    print("{} Success: ID {}".format(prefix, res.value["id"]))
+                elif args.skip_dups and isinstance(res.error, models.RecordNotUnique):
+                    print("{} Skipping duplicate record".format(prefix))
+                else:
+                    failures += 1
+                    print("{} Failed: {}".format(prefix, repr(res.error)))
+    if failures:
+        raise Exception("{} rows could not be imported.".format(failures))
+
+if __name__ == "__main__":
+    main()
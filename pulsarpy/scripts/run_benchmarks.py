@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###Author
+#Nathaniel Watson
+#2019-08-12
+#nathankw@stanford.edu
+###
+
+"""
+Runs the pulsarpy benchmark suite (see pulsarpy.benchmark) against an in-process fake Pulsar
+server and Elasticsearch cluster, and writes the results as JSON. The results include the current
+git commit, such that runs from different commits can be compared with the --compare option.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import pulsarpy.benchmark as benchmark
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-o", "--outfile", help="""
+      The JSON file to write the results to.""")
+    parser.add_argument("-l", "--latency", type=float, default=0.0, help="""
+      The number of seconds the fake server delays each request by. Defaults to 0.""")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="""
+      Multiplies the size of each benchmark, i.e. 0.1 for a quick run. Defaults to 1.""")
+    parser.add_argument("--only", nargs="+", choices=[x[0] for x in benchmark.BENCHMARKS], help="""
+      The names of the benchmarks to run. Defaults to all of them.""")
+    parser.add_argument("-c", "--compare", help="""
+      The JSON file of a previous run to compare the throughput of this run against.""")
+    return parser
+
+def get_git_commit():
+    """
+    Returns the git commit that pulsarpy is running from, or None if it isn't running from a
+    git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(benchmark.__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    run = benchmark.run_all(latency=args.latency, scale=args.scale, only=args.only)
+    run["meta"]["commit"] = get_git_commit()
+    if args.outfile:
+        with open(args.outfile, "w") as fh:
+            json.dump(run, fh, indent=2)
+    if args.compare:
+        with open(args.compare) as fh:
+            previous = json.load(fh)
+        print("Compared to commit {}:".format(previous["meta"].get("commit")))
+        print(benchmark.format_comparison(benchmark.compare(previous, run)))
+
+if __name__ == "__main__":
+    main()
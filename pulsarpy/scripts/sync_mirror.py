@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###Author
+#Nathaniel Watson
+#2019-08-12
+#nathankw@stanford.edu
+###
+
+"""
+Syncs the records of the given models into a local sqlite mirror of Pulsar (see
+pulsarpy.mirror), fetching only the records that changed since the previous sync. Meant to be run
+periodically, i.e. from cron, ahead of read-heavy jobs that use the mirror.
+"""
+
+import argparse
+
+import pulsarpy.models as models
+from pulsarpy.mirror import Mirror
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("-m", "--models", nargs="+", required=True, help="""
+      The names of the models to sync, i.e. Biosample Library.""")
+    parser.add_argument("-p", "--path", help="""
+      The path to the sqlite database. Defaults to $PULSARPY_CACHE_DIR/mirror/$HOST.sqlite.""")
+    parser.add_argument("--full", action="store_true", help="""
+      Replace the mirrored records with all current ones, which also drops the records that were
+      deleted in Pulsar.""")
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    mirror = Mirror(path=args.path)
+    for model_name in args.models:
+        model = getattr(models, model_name)
+        count = mirror.sync(model, full=args.full)
+        print("{}: synced {} records".format(model_name, count))
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,8 @@ fields are only assumed when the field name has an 'ids' suffix.
 """
 import argparse
 
+from pulsarpy import concurrency
+from pulsarpy.dry_run import DryRun
 import pulsarpy.models as models
 import pulsarpy.utils
 
@@ -43,13 +45,35 @@ def get_parser():
     parser.add_argument("-u", "--upstream-ids", action="store_true", help="""
       If patching records and you are providing the record identidifers using the value of a records
       upstream_identifier attribute, set this to True.""")
+    parser.add_argument("-c", "--concurrent", action="store_true", help="""
+      Submit all rows together rather than one at a time, resolving the names used in foreign key
+      fields in bulk and sending the requests concurrently. When patching, the records aren't fetched
+      one by one first. Don't use this option when rows refer to records that are created by earlier
+      rows in the same file.""")
+    parser.add_argument("--dry-run", action="store_true", help="""
+      Don't change anything in Pulsar, but report the number of calls the import would make to
+      Pulsar and Elasticsearch by endpoint, the estimated wall time, and the names that would need
+      to be resolved to IDs. Lookups are still done. Rows that refer to records created by earlier
+      rows in the same file will fail.""")
  
     return parser
 
 
-def main():
+def main(argv=None):
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if not args.dry_run:
+        import_rows(args)
+        return
+    with DryRun() as plan:
+        import_rows(args)
+    print(plan.format_summary(concurrency=concurrency.MAX_CONCURRENCY if args.concurrent else 1))
+
+
+def import_rows(args):
+    """
+    Imports the rows of the input file as specified by the parsed command-line arguments.
+    """
     skip_dups = args.skip_dups
     infile = args.infile
     upstream_ids = args.upstream_ids
@@ -77,6 +101,11 @@ def main():
             if attr_name not in model_attrs:
                 raise Exception("Unknown field name '{}'.".format(attr_name))
     line_cnt = 1 # Already read header line
+    # Payloads of the rows to POST when the --concurrent option is used, keyed by line number.
+    post_payloads = {}
+    # Payloads of the rows to PATCH when the --concurrent option is used, keyed by record identifier.
+    patch_payloads = {}
+    patch_lines = {}
     for line in fh:
         line_cnt += 1
         if line.startswith("#"):
@@ -97,11 +126,20 @@ def main():
         if patch:
             rec_id = payload[RECORD_ID_FIELD]
             payload.pop(RECORD_ID_FIELD)
+            if args.concurrent:
+                if rec_id in patch_payloads:
+                    raise Exception("Record '{}' is given on both line {} and line {}.".format(rec_id, patch_lines[rec_id], line_cnt))
+                patch_payloads[rec_id] = payload
+                patch_lines[rec_id] = line_cnt
+                continue
             if upstream_ids:
                 rec = model(upstream=rec_id)
             else:
                 rec = model(rec_id)
             res = rec.patch(payload=payload, append_to_arrays=append_to_arrays)
+        elif args.concurrent:
+            post_payloads[line_cnt] = payload
+            continue
         else:
             try:
                 res = model.post(payload)
@@ -111,6 +149,37 @@ def main():
                 else:
                     raise
         print("Success: ID {}".format(res["id"]))
+    if post_payloads:
+        line_nums = list(post_payloads)
+        results = model.post_many([post_payloads[n] for n in line_nums])
+        report(line_nums, results, skip_dups=skip_dups)
+    if patch_payloads:
+        results = model.patch_many(patch_payloads, append_to_arrays=append_to_arrays, upstream=upstream_ids)
+        report([patch_lines[rec_id] for rec_id in patch_payloads], results, skip_dups=False)
+
+def report(line_nums, results, skip_dups):
+    """
+    Prints the outcome of each line that was submitted concurrently.
+
+    Args:
+        line_nums: `list` of line numbers.
+        results: `list` of `pulsarpy.concurrency.Result` instances, one per line number.
+        skip_dups: `bool`. True means that a `pulsarpy.models.RecordNotUnique` error isn't a failure.
+
+    Raises:
+        `Exception`: One or more lines could not be submitted.
+    """
+    failures = 0
+    for line_num, res in zip(line_nums, results):
+        if not res.error:
+            print("Line {}: Success: ID {}".format(line_num, res.value["id"]))
+        elif isinstance(res.error, models.RecordNotUnique) and skip_dups:
+            print("Line {}: Skipping duplicate record".format(line_num))
+        else:
+            failures += 1
+            print("Line {}: Failed: {}".format(line_num, repr(res.error)))
+    if failures:
+        raise Exception("{} of {} lines could not be submitted.".format(failures, len(line_nums)))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Lightweight span-based tracing of nested model operations. A single ``Library.post()`` fans out
+into ``pre_post()`` lookups of barcodes and kits, foreign key name resolution, and finally the
+POST itself; tracing records this call tree along with the duration of each step, such that it's
+clear which nested lookup dominates a slow row.
+
+A span is opened with the ``span()`` context manager or the ``traced`` decorator. Spans opened
+while another one is open become its children, including across the worker threads of
+``pulsarpy.concurrency.bulk_map()``. Finished spans are handed to the registered exporters:
+
+    * ``JsonLinesExporter``: Appends one JSON object per span to a file.
+    * ``ChromeTraceExporter``: Writes a file in the Chrome trace event format, which can be opened
+      in chrome://tracing or https://ui.perfetto.dev.
+    * ``MemoryExporter``: Keeps the spans in a list for inspection in-process.
+
+Tracing costs next to nothing while no exporter is registered. Setting the environment variable
+PULSARPY_TRACE_FILE registers an exporter from the start: a ``ChromeTraceExporter`` if the file
+name ends in .json, and a ``JsonLinesExporter`` otherwise.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+
+#: The span that is currently open in this context, if any.
+_CURRENT_SPAN = contextvars.ContextVar("pulsarpy_current_span", default=None)
+_ids = itertools.count(1)
+
+#: The registered exporters.
+EXPORTERS = []
+
+
+class Span():
+    """
+    A timed operation within a trace.
+    """
+
+    def __init__(self, name, parent=None, attrs=None):
+        """
+        Args:
+            name: `str`. The name of the operation, i.e. Library.post.
+            parent: `Span`. The enclosing span, if any.
+            attrs: `dict`. Attributes describing the operation, i.e. the name being looked up.
+        """
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attrs = attrs or {}
+        self.pid = os.getpid()
+        self.thread_id = threading.get_ident()
+        #: The time the span started, in seconds since the epoch.
+        self.start = time.time()
+        self._start = time.perf_counter()
+        #: The number of seconds the span took, set when it ends.
+        self.duration = None
+        #: The `repr` of the exception that ended the span, if any.
+        self.error = None
+
+    def set(self, **attrs):
+        """
+        Adds attributes to the span.
+        """
+        self.attrs.update(attrs)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "pid": self.pid,
+            "thread_id": self.thread_id,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attrs": self.attrs
+        }
+
+
+def current_span():
+    """
+    Returns the `Span` that is currently open, or `None`.
+    """
+    return _CURRENT_SPAN.get()
+
+
+@contextlib.contextmanager
+def span(span_name, **attrs):
+    """
+    Records the enclosed block as a span. Yields the `Span`, or `None` if tracing is off.
+
+    Args:
+        span_name: `str`. The name of the operation.
+        attrs: Attributes of the span.
+    """
+    if not EXPORTERS:
+        yield None
+        return
+    sp = Span(span_name, parent=_CURRENT_SPAN.get(), attrs=attrs)
+    token = _CURRENT_SPAN.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = repr(e)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        sp.finish()
+        for exporter in list(EXPORTERS):
+            exporter.export(sp)
+
+
+def traced(func=None, attrs=()):
+    """
+    Decorates a method such that each call is recorded as a span named after the class and the
+    method, i.e. Library.pre_post. Goes beneath ``@classmethod`` when decorating class methods.
+    Can be used bare (``@traced``) or with arguments (``@traced(attrs=["name"])``).
+
+    Args:
+        attrs: The names of the method's parameters whose values to record as span attributes.
+    """
+    if func is None:
+        return functools.partial(traced, attrs=attrs)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not EXPORTERS:
+            return func(*args, **kwargs)
+        owner = args[0] if args else None
+        owner_name = owner.__name__ if isinstance(owner, type) else type(owner).__name__
+        span_attrs = {}
+        if attrs:
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            span_attrs = {x: bound[x] for x in attrs if x in bound}
+        with span("{}.{}".format(owner_name, func.__name__), **span_attrs):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def add_exporter(exporter):
+    """
+    Registers an exporter, which turns tracing on.
+    """
+    EXPORTERS.append(exporter)
+
+
+def remove_exporter(exporter):
+    """
+    Unregisters and closes an exporter. Tracing is off once no exporters remain.
+    """
+    EXPORTERS.remove(exporter)
+    exporter.close()
+
+
+class MemoryExporter():
+    """
+    Keeps the finished spans in ``spans``.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, sp):
+        with self._lock:
+            self.spans.append(sp)
+
+    def close(self):
+        pass
+
+
+class JsonLinesExporter():
+    """
+    Appends each finished span to a file as a line of JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "a")
+        self._lock = threading.Lock()
+
+    def export(self, sp):
+        line = json.dumps(sp.to_dict(), default=str)
+        with self._lock:
+            self._fh.write(line + "\n")
+            self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
+
+
+class ChromeTraceExporter():
+    """
+    Collects the finished spans and writes them as complete ("X") events in the Chrome trace event
+    format upon ``close()``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._events = []
+        self._lock = threading.Lock()
+
+    def export(self, sp):
+        event = {
+            "name": sp.name,
+            "ph": "X",
+            "ts": sp.start * 1e6,
+            "dur": sp.duration * 1e6,
+            "pid": sp.pid,
+            "tid": sp.thread_id,
+            "args": dict(sp.attrs, span_id=sp.span_id, parent_id=sp.parent_id, error=sp.error)
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def close(self):
+        with self._lock:
+            with open(self.path, "w") as fh:
+                json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, fh, default=str)
+
+
+def shutdown():
+    """
+    Unregisters and closes all exporters.
+    """
+    while EXPORTERS:
+        remove_exporter(EXPORTERS[-1])
+
+atexit.register(shutdown)
+
+if os.environ.get("PULSARPY_TRACE_FILE"):
+    _path = os.environ["PULSARPY_TRACE_FILE"]
+    add_exporter(ChromeTraceExporter(_path) if _path.endswith(".json") else JsonLinesExporter(_path))
@@ -6,19 +6,29 @@
 #nathankw@stanford.edu
 ###
 
+import atexit
+import logging
+import threading
+import time
+
 import requests
 
 import pulsarpy
+from pulsarpy import concurrency
+import pulsarpy.models as models
 
 SREQ_STATUSES = ["not started", "started", "trouble-shooting", "failed", "finished"]
 
-def send_mail(form, from_name):
+def send_mail(form, from_name, url=None):
     """
     Sends a mail using the configured mail server for Pulsar.  See mailgun documentation at
     https://documentation.mailgun.com/en/latest/user_manual.html#sending-via-api for specifics.
  
     Args:
         form: `dict`. The mail form fields, i.e. 'to', 'from', ...
+        from_name: `str`. The sender name to put in the 'from' field.
+        url: `str`. The URL to POST the form to instead of the configured mail server, i.e. a
+            local stand-in such as ``pulsarpy.fake_server.FakeServer.mail_url``.
 
     Returns: 
         `requests.models.Response` instance.
@@ -38,16 +48,179 @@ def send_mail(form, from_name):
         send_mail(payload)
 
     """
-    form["from"] = "{} <mailgun@{}>".format(from_name, pulsarpy.MAIL_DOMAIN),
-    if not pulsarpy.MAIL_SERVER_URL:
-        raise Exception("MAILGUN_DOMAIN environment variable not set.")
-    if not pulsarpy.MAIL_AUTH[1]:
-        raise Exception("MAILGUN_API_KEY environment varible not set.")
-    res = requests.post(pulsarpy.MAIL_SERVER_URL, data=form, auth=pulsarpy.MAIL_AUTH)
+    form["from"] = "{} <mailgun@{}>".format(from_name, pulsarpy.MAIL_DOMAIN)
+    if not url:
+        if not pulsarpy.MAIL_SERVER_URL:
+            raise Exception("MAILGUN_DOMAIN environment variable not set.")
+        if not pulsarpy.MAIL_AUTH[1]:
+            raise Exception("MAILGUN_API_KEY environment varible not set.")
+    res = requests.post(url or pulsarpy.MAIL_SERVER_URL, data=form, auth=pulsarpy.MAIL_AUTH)
     res.raise_for_status()
     return res
 
 
+class MailDispatcher():
+    """
+    Sends mail from a background thread, such that a job sending many notifications (i.e. one per
+    finished SequencingRequest) never waits on the mail server. Messages to the same recipients
+    that are queued within `window` seconds of the first one are coalesced into a single digest,
+    sparing the recipients a flood of mail. Failed sends are retried with jittered exponential
+    backoff, and the queue is flushed when the process exits::
+
+        dispatcher = MailDispatcher(from_name="Pulsar", window=300)
+        for sreq in finished_sreqs:
+            dispatcher.send(to="lab@stanford.edu", subject="{} finished".format(sreq.name), text="...")
+    """
+
+    def __init__(self, from_name, window=60, url=None, max_retries=5):
+        """
+        Args:
+            from_name: `str`. The sender name, see ``send_mail()``.
+            window: `float`. The number of seconds to collect messages to the same recipients for
+                before sending them. 0 means to send each message on its own right away.
+            url: `str`. The URL to POST the mail forms to. Defaults to the configured mail server.
+            max_retries: `int`. The number of times to retry a failed send before giving up on it.
+        """
+        self.from_name = from_name
+        self.window = window
+        self.url = url
+        self.max_retries = max_retries
+        #: The number of mails sent, the number of mails given up on, and the number of messages
+        #: that went into digests.
+        self.stats = {"sent": 0, "failed": 0, "coalesced": 0}
+        self.error_logger = logging.getLogger(pulsarpy.ERROR_LOGGER_NAME)
+        # The queued messages of each group of recipients, along with the time each group is due.
+        self._pending = {}
+        self._due = {}
+        self._sending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="MailDispatcher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def send(self, to, subject, text):
+        """
+        Queues a message and returns right away.
+
+        Args:
+            to: `str` or `list`. The recipient address(es).
+            subject: `str`. The subject.
+            text: `str`. The body.
+        """
+        if isinstance(to, str):
+            to = to.split(",")
+        recipients = tuple(sorted(set(x.strip() for x in to if x.strip())))
+        with self._cond:
+            if self._closed:
+                raise Exception("The mail dispatcher is closed.")
+            if recipients not in self._pending:
+                self._pending[recipients] = []
+                self._due[recipients] = time.monotonic() + self.window
+            self._pending[recipients].append((subject, text))
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """
+        Sends all queued messages now, without waiting for their windows to end, and waits until
+        they are sent or given up on.
+
+        Args:
+            timeout: `float`. The largest number of seconds to wait.
+
+        Returns:
+            `bool`. False if the timeout expired first.
+        """
+        with self._cond:
+            now = time.monotonic()
+            for recipients in self._due:
+                self._due[recipients] = now
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._sending, timeout=timeout)
+
+    def close(self, timeout=None):
+        """
+        Flushes the queue and stops the background thread. Called automatically at exit.
+        """
+        self.flush(timeout=timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    now = time.monotonic()
+                    due = [x for x, t in self._due.items() if t <= now]
+                    if due:
+                        break
+                    self._cond.wait(min(self._due.values()) - now if self._due else None)
+                batches = [(x, self._pending.pop(x)) for x in due]
+                for recipients in due:
+                    del self._due[recipients]
+                self._sending += len(batches)
+            for recipients, messages in batches:
+                try:
+                    self._deliver(recipients, messages)
+                finally:
+                    with self._cond:
+                        self._sending -= 1
+                        self._cond.notify_all()
+
+    @staticmethod
+    def make_digest(messages):
+        """
+        Combines messages into a single one.
+
+        Args:
+            messages: `list` of (subject, text) tuples.
+
+        Returns:
+            `tuple` of the form (subject, text).
+        """
+        if len(messages) == 1:
+            return messages[0]
+        subject = "{} notifications: {}".format(len(messages), messages[0][0])
+        parts = []
+        for msg_subject, msg_text in messages:
+            parts.append("{}\n{}\n\n{}".format(msg_subject, "-" * len(msg_subject), msg_text))
+        return subject, "\n\n".join(parts)
+
+    def _deliver(self, recipients, messages):
+        subject, text = self.make_digest(messages)
+        if len(messages) > 1:
+            self.stats["coalesced"] += len(messages)
+        attempt = 0
+        while True:
+            retry_after = None
+            form = {"to": list(recipients), "subject": subject, "text": text}
+            try:
+                send_mail(form, from_name=self.from_name, url=self.url)
+                self.stats["sent"] += 1
+                return
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code
+                retry = status == 429 or status >= 500
+                retry_after = e.response.headers.get("Retry-After")
+                error = e
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                retry = True
+                error = e
+            except Exception as e:
+                retry = False
+                error = e
+            if not retry or attempt >= self.max_retries:
+                self.stats["failed"] += 1
+                self.error_logger.error("Could not send mail '{}' to {}: {}".format(subject, ", ".join(recipients), error))
+                return
+            time.sleep(concurrency.retry_delay(attempt, retry_after=retry_after))
+            attempt += 1
+
+
 def fahrenheit_to_celsius(temp):
     return (temp - 32) * (5.0/9)
 
@@ -83,10 +256,96 @@ def get_exp_of_biosample(biosample_rec):
         return {"type": "single_cell_sorting", "record": models.SingleCellSorting(ssc_id)}
     raise Exception("Biosample {} is not on an experiment.".format(biosample_rec["id"]))
 
-def sreqs_by_status(status):
+def get_exps_of_biosamples(biosamples):
+    """
+    A batched version of ``get_exp_of_biosample()`` for many biosamples that share a handful of
+    experiments. The biosamples given by reference are fetched concurrently, and each distinct
+    experiment is then fetched only once, concurrently with the others.
+
+    Args:
+        biosamples: An iterable of Biosamples, each given as a `models.Biosample` instance, a
+            Biosample record `dict`, or a reference to fetch it by (an ID or name).
+
+    Returns:
+        `dict`. Keyed by Biosample ID. Each value is a `dict` of the same form as returned by
+        ``get_exp_of_biosample()``, or `None` if the biosample isn't on an experiment.
+    """
+    recs = []
+    refs = []
+    for b in biosamples:
+        if isinstance(b, models.Model):
+            recs.append(b.attrs)
+        elif isinstance(b, dict):
+            recs.append(b)
+        else:
+            refs.append(b)
+    if refs:
+        recs.extend(x.attrs for x in models.Biosample.get_many(refs))
+    chip_ids = {x["chipseq_experiment_id"] for x in recs if x.get("chipseq_experiment_id")}
+    ssc_ids = {x["sorting_biosample_single_cell_sorting_id"] for x in recs if x.get("sorting_biosample_single_cell_sorting_id")}
+    chip_exps = dict(zip(chip_ids, models.ChipseqExperiment.get_many(list(chip_ids))))
+    ssc_exps = dict(zip(ssc_ids, models.SingleCellSorting.get_many(list(ssc_ids))))
+    exps = {}
+    for rec in recs:
+        chip_exp_id = rec.get("chipseq_experiment_id")
+        ssc_id = rec.get("sorting_biosample_single_cell_sorting_id")
+        if chip_exp_id:
+            exps[rec["id"]] = {"type": "chipseq_experiment", "record": chip_exps[chip_exp_id]}
+        elif ssc_id:
+            exps[rec["id"]] = {"type": "single_cell_sorting", "record": ssc_exps[ssc_id]}
+        else:
+            exps[rec["id"]] = None
+    return exps
+
+def get_sreq_status_query(status):
+    """
+    Builds an Elasticsearch query matching the SequencingRequests in the given status. The status
+    is matched as a phrase, excluding the other statuses that contain it (i.e. 'started' excludes
+    'not started').
+
+    Args:
+        status: `str`. One of ``SREQ_STATUSES``.
+
+    Returns:
+        `dict`.
+
+    Raises:
+        `ValueError`: The status isn't one of ``SREQ_STATUSES``.
+    """
+    if status not in SREQ_STATUSES:
+        raise ValueError("Status '{}' is not one of {}.".format(status, SREQ_STATUSES))
+    query = {"bool": {"filter": [{"match_phrase": {"status": status}}]}}
+    others = [x for x in SREQ_STATUSES if x != status and status in x]
+    if others:
+        query["bool"]["must_not"] = [{"match_phrase": {"status": x}} for x in others]
+    return query
+
+def sreqs_by_status(status, fields=None):
+    """
+    Lazily streams the SequencingRequests whose status attribute is set to the specified state,
+    using a filtered Elasticsearch query rather than fetching every SequencingRequest.
+
+    Args:
+        status: `str`. One of ``SREQ_STATUSES``.
+        fields: `list`. Only fetch these fields of each record. Defaults to all fields.
+
+    Returns:
+        A generator of `dict` records as indexed into Elasticsearch.
+
+    Raises:
+        `ValueError`: The status isn't one of ``SREQ_STATUSES``.
+    """
+    return models.SequencingRequest.search(get_sreq_status_query(status), fields=fields)
+
+def sreq_status_summary():
+    """
+    Counts the SequencingRequests in each status with a single aggregation request, which is cheap
+    enough for a dashboard to call every few seconds.
+
+    Returns:
+        `dict`. The number of SequencingRequests keyed by each status in ``SREQ_STATUSES``.
     """
-    Returns an array of all SequencingRequest objects whose status attribute is set to the specified
-    state. Status must be one of {}.
-    """.format(SREQ_STATUSES)
-    pass
+    filters = {x: get_sreq_status_query(x) for x in SREQ_STATUSES}
+    model = models.SequencingRequest
+    return model.ES.count_by_filters(model.ES_INDEX_NAME, filters)
     
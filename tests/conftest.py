@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+"""
+Fixtures that run pulsarpy against a ``pulsarpy.fake_server.FakeServer``. The persistent caches
+and the log files are kept in a temporary directory, which is set up before pulsarpy.models is
+imported since the latter creates them on import.
+"""
+
+import logging
+import os
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="pulsarpy_tests_")
+os.environ["PULSARPY_CACHE_DIR"] = os.path.join(_TMP_DIR, "cache")
+
+import pytest
+
+import pulsarpy as p
+p.LOG_DIR = os.path.join(_TMP_DIR, "logs")
+
+import pulsarpy.models as models
+from pulsarpy import concurrency
+from pulsarpy.fake_server import FakeServer
+
+models.Model.debug_logger.setLevel(logging.WARNING)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """
+    A running fake server that pulsarpy is configured to use, with fresh caches.
+    """
+    # Model.write_response_html_to_file() writes to the current directory.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(p, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(models, "RESPONSE_CACHE", None)
+    monkeypatch.setattr(models, "MIRROR", None)
+    monkeypatch.setattr(concurrency, "MAX_RETRIES", 0)
+    srv = FakeServer(seed=1)
+    srv.start()
+    models.configure(url=srv.api_url, token="test", es_url=srv.es_url)
+    yield srv
+    srv.stop()
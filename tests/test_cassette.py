@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import json
+
+import pytest
+
+import pulsarpy.models as models
+from pulsarpy.cassette import Cassette, CassetteMiss
+
+
+def run_job():
+    created = models.Vendor.post_many([{"name": "v{}".format(i), "description": "x" * 100} for i in range(3)])
+    vendor = models.Vendor(created[1].value["id"])
+    vendor.patch({"description": "patched"})
+    return [x.value["id"] for x in created], models.Vendor.find_by({"name": "v2"})["id"], vendor.description
+
+
+def test_replay_with_gzip_and_another_codec(server, tmp_path, monkeypatch):
+    path = str(tmp_path / "job.ndjson.gz")
+    monkeypatch.setattr(models, "GZIP_MIN_BYTES", 1)
+    with monkeypatch.context() as patched:
+        # Another JSON codec, whose output differs byte for byte.
+        patched.setattr(models, "json_dumps", lambda obj: json.dumps(obj, indent=1).encode("utf-8"))
+        models.use_cassette(Cassette(path, mode="record"))
+        try:
+            recorded = run_job()
+        finally:
+            models.use_cassette(None)
+    server.request_counts.clear()
+    models.use_cassette(Cassette(path, mode="replay", latency_scale=0))
+    try:
+        assert run_job() == recorded
+    finally:
+        models.use_cassette(None)
+    assert not server.request_counts
+
+
+def test_replay_misses_unrecorded_request(server, tmp_path):
+    path = str(tmp_path / "job.ndjson.gz")
+    models.use_cassette(Cassette(path, mode="record"))
+    try:
+        rec_id = models.Vendor.post({"name": "v1"})["id"]
+    finally:
+        models.use_cassette(None)
+    models.use_cassette(Cassette(path, mode="replay", latency_scale=0))
+    try:
+        with pytest.raises(CassetteMiss):
+            models.Vendor.post({"name": "v2"})
+        assert models.Vendor.post({"name": "v1"})["id"] == rec_id
+    finally:
+        models.use_cassette(None)
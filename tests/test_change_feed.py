@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pulsarpy.models as models
+from pulsarpy.change_feed import ChangeCursor
+
+
+def _add(server, name, updated_at):
+    return server.add_record("Vendor", {"name": name, "updated_at": updated_at})
+
+
+def test_changed_since_streams_later_changes_in_order(server):
+    _add(server, "a", "2018-01-01T00:00:00Z")
+    _add(server, "c", "2018-01-03T00:00:00Z")
+    _add(server, "b", "2018-01-02T00:00:00Z")
+    assert [x["name"] for x in models.Vendor.changed_since(None)] == ["a", "b", "c"]
+    assert [x["name"] for x in models.Vendor.changed_since("2018-01-02T00:00:00Z")] == ["c"]
+    assert [x["name"] for x in models.Vendor.changed_since("2018-01-02T00:00:00Z", inclusive=True)] == ["b", "c"]
+    recs = list(models.Vendor.changed_since(None, fields=["name"], page_size=1))
+    assert sorted(recs[0]) == ["name", "updated_at"]
+
+
+def test_cursor_resumes_from_the_committed_mark(server, tmp_path):
+    _add(server, "a", "2018-01-01T00:00:00Z")
+    _add(server, "b", "2018-01-02T00:00:00Z")
+    cursor = ChangeCursor("job", models.Vendor, cursor_dir=str(tmp_path))
+    assert [x["name"] for x in cursor.changes()] == ["a", "b"]
+    cursor.commit()
+    assert cursor.read() == "2018-01-02T00:00:00Z"
+    _add(server, "c", "2018-01-03T00:00:00Z")
+    # A new cursor of the same name picks up where the previous one left off. Delivery is at least
+    # once, so the record at the mark comes again.
+    cursor = ChangeCursor("job", models.Vendor, cursor_dir=str(tmp_path))
+    assert [x["name"] for x in cursor.changes()] == ["b", "c"]
+
+
+def test_uncommitted_changes_are_delivered_again(server, tmp_path):
+    _add(server, "a", "2018-01-01T00:00:00Z")
+    cursor = ChangeCursor("job", models.Vendor, cursor_dir=str(tmp_path))
+    list(cursor.changes())
+    assert cursor.read() is None
+    assert [x["name"] for x in cursor.changes()] == ["a"]
+    # Committing without changes keeps the mark.
+    cursor.pending = None
+    cursor.commit()
+    assert cursor.read() is None
+
+
+def test_cursor_reset(server, tmp_path):
+    _add(server, "a", "2018-01-01T00:00:00Z")
+    cursor = ChangeCursor("job", models.Vendor, cursor_dir=str(tmp_path))
+    list(cursor.changes())
+    cursor.commit()
+    cursor.reset()
+    assert cursor.read() is None
+    cursor.reset()
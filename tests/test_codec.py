@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+import pulsarpy.models as models
+
+
+@pytest.mark.parametrize("name", ["", "json", "ujson", "orjson"])
+def test_json_codecs_round_trip(name):
+    codec, dumps, loads = models._load_json_codec(name)
+    # Codecs that aren't installed fall back to another one.
+    assert codec in ("json", "ujson", "orjson")
+    data = dumps({"name": "é", "ids": [1, 2]})
+    assert isinstance(data, bytes)
+    assert loads(data) == {"name": "é", "ids": [1, 2]}
+
+
+def test_large_payloads_are_gzipped(server, monkeypatch):
+    monkeypatch.setattr(models, "GZIP_MIN_BYTES", 100)
+    before = models.codec_stats()
+    small = models.Vendor.post({"name": "small"})
+    large = models.Vendor.post({"name": "large", "description": "x" * 1000})
+    stats = models.codec_stats()
+    assert stats["requests"] - before["requests"] == 2
+    assert stats["gzipped_requests"] - before["gzipped_requests"] == 1
+    # The large payload compresses well.
+    assert stats["request_bytes_sent"] - before["request_bytes_sent"] < 500
+    assert server.tables["vendors"][small["id"]]["name"] == "small"
+    assert server.tables["vendors"][large["id"]]["description"] == "x" * 1000
+
+
+def test_payloads_are_not_gzipped_when_off(server, monkeypatch):
+    monkeypatch.setattr(models, "GZIP_MIN_BYTES", 0)
+    before = models.codec_stats()
+    models.Vendor.post({"name": "v", "description": "x" * 1000})
+    stats = models.codec_stats()
+    assert stats["gzipped_requests"] == before["gzipped_requests"]
+    assert stats["json_codec"] == models.JSON_CODEC
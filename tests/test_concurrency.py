@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+from elasticsearch import exceptions as es_exceptions
+
+import pulsarpy.models as models
+from pulsarpy import concurrency
+from pulsarpy.concurrency import AdaptiveLimiter
+
+
+def test_latency_baseline_is_kept_per_kind():
+    limiter = AdaptiveLimiter(initial=8)
+    for _ in range(200):
+        limiter.acquire()
+        limiter.release(0.005, kind=("rails_read", "find_by"))
+        limiter.acquire()
+        limiter.release(0.5, kind=("rails_write", "bulk_create"))
+    assert limiter.limit > 8
+
+
+def test_overload_shrinks_window():
+    limiter = AdaptiveLimiter(initial=8)
+    limiter.acquire()
+    limiter.release(0.01, overloaded=True)
+    assert limiter.limit < 8
+
+
+class FlakyClient():
+    """
+    Stands in for an Elasticsearch client, failing the first calls with the given error.
+    """
+
+    def __init__(self, client, errors):
+        self.client = client
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __getattr__(self, api):
+        def call(**kwargs):
+            self.calls += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return getattr(self.client, api)(**kwargs)
+        return call
+
+
+def test_es_requests_back_off_and_retry(server, monkeypatch):
+    monkeypatch.setattr(concurrency, "MAX_RETRIES", 2)
+    monkeypatch.setattr(concurrency, "retry_delay", lambda attempt, retry_after=None: 0)
+    limiter = AdaptiveLimiter(initial=8)
+    monkeypatch.setattr(concurrency, "LIMITER", limiter)
+    server.add_record("Vendor", {"name": "v1"})
+    flaky = FlakyClient(models.Model.ES.ES, [es_exceptions.TransportError(503, "unavailable", {})])
+    monkeypatch.setattr(models.Model.ES, "ES", flaky)
+    assert models.Vendor.replace_name_with_id("v1") == 1
+    assert flaky.calls == 2
+    assert limiter.limit < 8
+    assert limiter.in_flight == 0
+
+
+def test_es_client_errors_are_not_retried(server, monkeypatch):
+    monkeypatch.setattr(concurrency, "MAX_RETRIES", 2)
+    flaky = FlakyClient(models.Model.ES.ES, [es_exceptions.NotFoundError(404, "index_not_found_exception", {})])
+    monkeypatch.setattr(models.Model.ES, "ES", flaky)
+    with pytest.raises(es_exceptions.NotFoundError):
+        models.Vendor.ES.mget("vendors", [1])
+    assert flaky.calls == 1
+    assert concurrency.LIMITER.in_flight == 0
+
+
+def test_unexpected_errors_release_the_slot(server, monkeypatch):
+    def failing_request(*args, **kwargs):
+        raise RuntimeError("Unexpected")
+
+    monkeypatch.setattr(models.SESSION, "request", failing_request)
+    with pytest.raises(RuntimeError):
+        models.Vendor.find_by({"name": "v1"})
+    assert concurrency.LIMITER.in_flight == 0
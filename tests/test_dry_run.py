@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pulsarpy.models as models
+from pulsarpy.dry_run import DryRun, SYNTHETIC_ID_START
+
+
+def _counts(plan):
+    return {(x["model"], x["op"]): x["count"] for x in plan.summary()["calls"] if x["service"] == "rails"}
+
+
+def test_dry_run_intercepts_writes(server):
+    with DryRun() as plan:
+        results = models.Vendor.post_many([{"name": "v{}".format(i)} for i in range(3)])
+    assert all(x.value["id"] >= SYNTHETIC_ID_START for x in results)
+    assert server.tables.get("vendors", {}) == {}
+    assert _counts(plan)[("Vendor", "bulk_create")] == 1
+    assert plan.summary()["writes"] == 1
+    # The made-up bulk create support doesn't stick.
+    assert models.Vendor.URL not in models._BULK_CREATE_SUPPORT
+
+
+def test_dry_run_counts_per_record_posts_without_bulk_create(server):
+    server.bulk_create = False
+    with DryRun() as plan:
+        results = models.Vendor.post_many([{"name": "v{}".format(i)} for i in range(3)])
+    assert all(x.error is None for x in results)
+    assert server.tables.get("vendors", {}) == {}
+    counts = _counts(plan)
+    # The job would try the bulk create once, then fall back to one POST per record.
+    assert counts[("Vendor", "bulk_create")] == 1
+    assert counts[("Vendor", "post")] == 3
+    assert plan.summary()["writes"] == 4
+
+
+def test_dry_run_serves_synthetic_records_and_reads_real_ones(server):
+    vendor = server.add_record("Vendor", {"name": "acme"})
+    with DryRun() as plan:
+        rec = models.Vendor.post({"name": "new"})
+        assert models.Vendor(rec["id"]).attrs["name"] == "new"
+        assert models.Vendor(vendor["id"]).attrs["name"] == "acme"
+        models.Vendor(vendor["id"]).patch({"description": "x"})
+    assert "description" not in server.tables["vendors"][vendor["id"]]
+    summary = plan.summary()
+    assert summary["writes"] == 2
+    assert "Dry run: {} calls".format(summary["total"]) in plan.format_summary()
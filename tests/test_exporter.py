@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import gzip
+import json
+
+from pulsarpy import exporter
+
+
+def _read_shards(files):
+    docs = []
+    for path in files:
+        with gzip.open(path, "rt") as fh:
+            docs.extend(json.loads(line) for line in fh)
+    return docs
+
+
+def test_export_index_writes_every_document_once(server, tmp_path):
+    recs = [server.add_record("Vendor", {"name": "v{}".format(i), "description": "x"}) for i in range(25)]
+    stats = exporter.export_index("vendors", str(tmp_path / "out"), slices=3, page_size=4, stream=None)
+    assert len(stats["files"]) == 3
+    assert stats["docs"] == 25
+    docs = _read_shards(stats["files"])
+    assert sorted(x["id"] for x in docs) == sorted(x["id"] for x in recs)
+
+
+def test_export_index_with_query_and_fields(server, tmp_path):
+    for i in range(10):
+        server.add_record("Vendor", {"name": "v{}".format(i), "description": "even" if i % 2 == 0 else "odd"})
+    stats = exporter.export_index("vendors", str(tmp_path / "out"), slices=2, query={"term": {"description": "even"}},
+                                  fields=["name"], stream=None)
+    docs = _read_shards(stats["files"])
+    assert sorted(x["name"] for x in docs) == ["v0", "v2", "v4", "v6", "v8"]
+    assert all(list(x) == ["name"] for x in docs)
+
+
+def test_export_slice(server, tmp_path):
+    for i in range(7):
+        server.add_record("Vendor", {"name": "v{}".format(i)})
+    path, count = exporter.export_slice(server.es_url, "vendors", str(tmp_path), 0, 1, page_size=3)
+    assert count == 7
+    assert path.endswith("vendors-000.ndjson.gz")
+    assert len(_read_shards([path])) == 7
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+import pulsarpy.models as models
+from pulsarpy import importer
+
+
+def _write_workbook(path, sheets):
+    for model_name, lines in sheets.items():
+        (path / (model_name + ".tsv")).write_text("\n".join("\t".join(x) for x in lines) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def schemas(server):
+    server.schemas["Vendor"] = ["id", "name"]
+    server.schemas["Donor"] = ["id", "name"]
+    server.schemas["Biosample"] = ["id", "name", "donor_id", "vendor_id", "part_of_id", "notes"]
+
+
+def test_parse_rows_skips_comments_and_splits_ids():
+    rows = importer.parse_rows([
+        ["name", "#notes", "library_ids"],
+        ["#b0", "", ""],
+        ["b1", "skipped", "L1, L2"],
+        [],
+        ["b2", "", ""]
+    ])
+    assert [(x.line_num, x.payload) for x in rows] == [
+        (3, {"name": "b1", "library_ids": ["L1", "L2"]}),
+        (5, {"name": "b2"})
+    ]
+
+
+def test_import_levels_follow_the_foreign_keys(tmp_path, schemas):
+    workbook = importer.read_workbook(_write_workbook(tmp_path, {
+        "Biosample": [["name", "donor_id", "vendor_id"], ["b1", "d1", "v1"]],
+        "Donor": [["name"], ["d1"]],
+        "Vendor": [["name"], ["v1"]]
+    }))
+    levels = importer.get_import_levels(workbook)
+    assert [[x.__name__ for x in level] for level in levels] == [["Donor", "Vendor"], ["Biosample"]]
+
+
+def test_import_levels_reject_cycles(monkeypatch):
+    monkeypatch.setattr(models.Donor, "FKEY_MAP", {"biosample_id": "Biosample"})
+    workbook = {models.Biosample: [importer.ImportRow(2, {"name": "b", "donor_id": "d"})],
+                models.Donor: [importer.ImportRow(2, {"name": "d", "biosample_id": "b"})]}
+    with pytest.raises(Exception, match="cycle"):
+        importer.get_import_levels(workbook)
+
+
+def test_read_workbook_rejects_unknown_fields(tmp_path, schemas):
+    with pytest.raises(Exception, match="Unknown field name"):
+        importer.read_workbook(_write_workbook(tmp_path, {"Donor": [["name", "color"], ["d1", "red"]]}))
+
+
+def test_import_workbook_resolves_names_of_new_records(tmp_path, schemas, server):
+    workbook = importer.read_workbook(_write_workbook(tmp_path, {
+        "Biosample": [["name", "donor_id", "part_of_id"], ["child", "d1", "parent"], ["parent", "d1", ""]],
+        "Donor": [["name"], ["d1"]]
+    }))
+    importer.import_workbook(workbook)
+    assert all(row.result.error is None for rows in workbook.values() for row in rows)
+    donor_id = workbook[models.Donor][0].result.value["id"]
+    biosamples = {x["name"]: x for x in server.tables["biosamples"].values()}
+    assert biosamples["parent"]["donor_id"] == donor_id
+    assert biosamples["child"]["part_of_id"] == biosamples["parent"]["id"]
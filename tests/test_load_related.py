@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+import pulsarpy.models as models
+
+
+def _add_graph(server):
+    donor = server.add_record("Donor", {"name": "d1"})
+    sreqs = [server.add_record("SequencingRequest", {"name": "sr{}".format(i)}) for i in range(2)]
+    libs = [server.add_record("Library", {"name": "L{}".format(i), "sequencing_request_ids": [x["id"] for x in sreqs]}) for i in range(3)]
+    biosamples = [server.add_record("Biosample", {"name": "b{}".format(i), "donor_id": donor["id"], "library_ids": [libs[i]["id"], libs[2]["id"]]}) for i in range(2)]
+    return donor, sreqs, libs, biosamples
+
+
+def test_load_related_attaches_records(server):
+    donor, sreqs, libs, biosamples = _add_graph(server)
+    recs = models.Biosample.get_many([x["id"] for x in biosamples], include=["donor_id", "library_ids.sequencing_request_ids"])
+    assert [x.related["donor_id"].id for x in recs] == [donor["id"]] * 2
+    assert [x.id for x in recs[1].related["library_ids"]] == [libs[1]["id"], libs[2]["id"]]
+    lib = recs[0].related["library_ids"][0]
+    assert [x.attrs["name"] for x in lib.related["sequencing_request_ids"]] == ["sr0", "sr1"]
+    # A record shared by several records is fetched once.
+    assert recs[0].related["donor_id"] is recs[1].related["donor_id"]
+    assert recs[0].related["library_ids"][1] is recs[1].related["library_ids"][1]
+
+
+def test_load_related_fetches_in_bulk(server):
+    donor, sreqs, libs, biosamples = _add_graph(server)
+    recs = models.Biosample.get_many([x["id"] for x in biosamples])
+    server.request_counts.clear()
+    models.Biosample.load_related(recs, ["donor_id", "library_ids.sequencing_request_ids"])
+    server.request_counts.pop(("GET", "/"), None)
+    # One multi-get per model and level, and no API calls.
+    assert server.request_counts == {
+        ("POST", "/donors/_mget"): 1,
+        ("POST", "/libraries/_mget"): 1,
+        ("POST", "/sequencing_requests/_mget"): 1
+    }
+
+
+def test_load_related_leaves_unset_fields_empty(server):
+    rec = server.add_record("Biosample", {"name": "b"})
+    biosample = models.Biosample(rec["id"])
+    models.Biosample.load_related([biosample], ["donor_id", "library_ids"])
+    assert biosample.related == {"donor_id": None, "library_ids": []}
+
+
+def test_load_related_rejects_unknown_fields(server):
+    rec = server.add_record("Biosample", {"name": "b"})
+    with pytest.raises(ValueError):
+        models.Biosample.load_related([models.Biosample(rec["id"])], ["color_id"])
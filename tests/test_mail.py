@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+import requests
+
+from pulsarpy import concurrency, utils
+
+
+@pytest.fixture
+def dispatchers():
+    created = []
+    yield created
+    for dispatcher in created:
+        dispatcher.close(timeout=5)
+
+
+def test_send_mail(server):
+    res = utils.send_mail({"to": "lab@example.org", "subject": "hi", "text": "howdy"}, from_name="Pulsar", url=server.mail_url)
+    assert res.json()["id"] == "<1@fake>"
+    assert server.mails[0]["subject"] == ["hi"]
+    assert server.mails[0]["from"][0].startswith("Pulsar <mailgun@")
+
+
+def test_send_mail_raises_on_error_status(server):
+    server.error_rate = 1.0
+    with pytest.raises(requests.exceptions.HTTPError):
+        utils.send_mail({"to": "lab@example.org", "subject": "hi", "text": ""}, from_name="Pulsar", url=server.mail_url)
+
+
+def test_dispatcher_coalesces_messages_to_the_same_recipients(server, dispatchers):
+    dispatcher = utils.MailDispatcher("Pulsar", window=60, url=server.mail_url)
+    dispatchers.append(dispatcher)
+    dispatcher.send("b@example.org, a@example.org", "sr1 finished", "one")
+    dispatcher.send(["a@example.org", "b@example.org"], "sr2 finished", "two")
+    dispatcher.send("c@example.org", "sr3 finished", "three")
+    # Nothing is sent before the window ends.
+    assert server.mails == []
+    assert dispatcher.flush(timeout=5)
+    mails = sorted(server.mails, key=lambda x: x["to"])
+    assert [x["to"] for x in mails] == [["a@example.org", "b@example.org"], ["c@example.org"]]
+    assert mails[0]["subject"] == ["2 notifications: sr1 finished"]
+    assert "one" in mails[0]["text"][0] and "two" in mails[0]["text"][0]
+    assert mails[1]["subject"] == ["sr3 finished"]
+    assert dispatcher.stats == {"sent": 2, "failed": 0, "coalesced": 2}
+
+
+def test_dispatcher_gives_up_after_retries(server, dispatchers, monkeypatch):
+    monkeypatch.setattr(concurrency, "retry_delay", lambda attempt, retry_after=None: 0)
+    server.error_rate = 1.0
+    dispatcher = utils.MailDispatcher("Pulsar", window=0, url=server.mail_url, max_retries=2)
+    dispatchers.append(dispatcher)
+    dispatcher.send("a@example.org", "subject", "text")
+    assert dispatcher.flush(timeout=5)
+    assert dispatcher.stats["failed"] == 1
+    assert server.request_counts[("POST", "/mail/messages")] == 3
+
+
+def test_closed_dispatcher_rejects_messages(server):
+    dispatcher = utils.MailDispatcher("Pulsar", window=60, url=server.mail_url)
+    dispatcher.send("a@example.org", "subject", "text")
+    dispatcher.close(timeout=5)
+    assert len(server.mails) == 1
+    with pytest.raises(Exception, match="closed"):
+        dispatcher.send("a@example.org", "subject", "text")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import json
+
+import pytest
+
+import pulsarpy.models as models
+from pulsarpy import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+def _requests(registry):
+    return {(x["model"], x["op"], x["status"]): x["value"] for x in registry.snapshot()["counters"].get(metrics.REQUESTS, [])}
+
+
+def test_histogram_buckets(registry):
+    labels = ("Biosample", "get", "200")
+    for latency in (0.001, 0.005, 0.3, 100):
+        registry.observe(metrics.LATENCY, labels, latency)
+    hist = registry.snapshot()["histograms"][metrics.LATENCY][0]
+    assert hist["count"] == 4
+    assert hist["buckets"][0] == 2
+    assert hist["buckets"][metrics.LATENCY_BUCKETS.index(0.5)] == 1
+    assert hist["buckets"][-1] == 1
+
+
+def test_prometheus_format(registry):
+    metrics.record_request("Biosample", "get", 200, 0.02, response_bytes=10)
+    metrics.record_request("Biosample", "get", 200, 0.02)
+    text = metrics.to_prometheus()
+    assert '# TYPE pulsarpy_requests_total counter' in text
+    assert 'pulsarpy_requests_total{model="Biosample",op="get",status="200"} 2' in text
+    assert 'pulsarpy_response_bytes_total{model="Biosample",op="get",status="200"} 10' in text
+    assert 'pulsarpy_request_duration_seconds_bucket{model="Biosample",op="get",status="200",le="0.025"} 2' in text
+    assert 'pulsarpy_request_duration_seconds_bucket{model="Biosample",op="get",status="200",le="+Inf"} 2' in text
+
+
+def test_requests_are_recorded_by_model_op_and_status(server, registry):
+    rec = models.Vendor.post({"name": "v"})
+    models.Vendor(rec["id"])
+    with pytest.raises(models.RecordNotFound):
+        models.Vendor(10 ** 6)
+    list(models.Vendor.where(name="v"))
+    counts = _requests(registry)
+    assert counts[("Vendor", "post", "201")] == 1
+    assert counts[("Vendor", "get", "200")] == 1
+    assert counts[("Vendor", "get", "404")] == 1
+    # Searches of a point in time are recorded under their index too.
+    assert counts[("vendors", "es_search", "ok")] == 1
+    assert counts[("vendors", "es_close_point_in_time", "ok")] == 1
+
+
+def test_write(registry, tmp_path):
+    metrics.record_request("Vendor", "post", 201, 0.1)
+    metrics.write(str(tmp_path / "metrics.prom"))
+    assert "pulsarpy_requests_total" in (tmp_path / "metrics.prom").read_text()
+    metrics.write(str(tmp_path / "metrics.json"))
+    snapshot = json.loads((tmp_path / "metrics.json").read_text())
+    assert snapshot["counters"][metrics.REQUESTS] == [{"model": "Vendor", "op": "post", "status": "201", "value": 1}]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+import pulsarpy.models as models
+from pulsarpy.elasticsearch_utils import Connection
+from pulsarpy.fake_server import FakeServer
+from pulsarpy.mirror import Mirror
+
+
+@pytest.fixture
+def mirror(server, tmp_path):
+    for i in range(5):
+        server.add_record("Vendor", {"name": "v{}".format(i)})
+    mirror = Mirror(path=str(tmp_path / "mirror.sqlite"))
+    mirror.sync(models.Vendor)
+    models.use_mirror(mirror)
+    yield mirror
+    models.use_mirror(None)
+
+
+def test_reads_are_served_from_mirror(server, mirror):
+    server.request_counts.clear()
+    assert models.Vendor.find_by({"name": "v3"})["name"] == "v3"
+    assert models.Vendor.get_many([1, 2])[1].name == "v1"
+    assert not server.request_counts
+
+
+def test_find_by_falls_back_to_server_on_miss(server, mirror):
+    server.add_record("Vendor", {"name": "late"})
+    assert models.Vendor.find_by({"name": "late"})["name"] == "late"
+    assert models.Vendor.find_by({"name": "missing"}) is None
+
+
+def test_failed_full_sync_leaves_model_unsynced(server, mirror, monkeypatch):
+    def failing_scroll(index, **kwargs):
+        yield {"id": 1, "name": "v0", "updated_at": ""}
+        raise RuntimeError("Scroll failed")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(models.Model.ES, "scroll", failing_scroll)
+        with pytest.raises(RuntimeError):
+            mirror.sync(models.Vendor, full=True)
+    assert not mirror.is_synced(models.Vendor)
+    # Reads go to the server in the meantime.
+    server.request_counts.clear()
+    assert models.Vendor.find_by({"name": "v4"})["name"] == "v4"
+    assert server.request_counts
+    assert mirror.sync(models.Vendor) == 5
+    assert mirror.is_synced(models.Vendor)
+
+
+def test_lookup_name_compares_normalized_names(server, mirror):
+    rec = server.add_record("Vendor", {"name": "  Acme Corp "})
+    mirror.sync(models.Vendor)
+    assert mirror.lookup_name(models.Vendor, "acme corp") == [rec["id"]]
+    assert models.Vendor.replace_name_with_id("ACME CORP") == rec["id"]
+
+
+def test_sync_uses_given_connection(server, tmp_path):
+    other = FakeServer(seed=2)
+    other.start()
+    try:
+        other.add_record("Vendor", {"name": "other1"})
+        mirror = Mirror(path=str(tmp_path / "other.sqlite"), es=Connection(url=other.es_url))
+        assert mirror.sync(models.Vendor) == 1
+        rec = other.add_record("Vendor", {"name": "other2"})
+        # Incremental this time.
+        assert mirror.sync(models.Vendor) == 2
+        assert mirror.lookup_name(models.Vendor, "other2") == [rec["id"]]
+        assert not server.tables.get("vendors")
+        assert ("POST", "/vendors/_search") not in server.request_counts
+    finally:
+        other.stop()
+
+
+def test_patch_appends_to_server_arrays_of_mirrored_record(server, mirror):
+    rec = server.add_record("Biosample", {"name": "b1", "library_ids": [1]})
+    mirror.sync(models.Biosample)
+    biosample = models.Biosample(rec["id"])
+    # Added on the server after the sync.
+    server.tables["biosamples"][rec["id"]]["library_ids"] = [1, 2]
+    biosample.patch({"library_ids": [3]})
+    assert server.tables["biosamples"][rec["id"]]["library_ids"] == [1, 2, 3]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+import requests
+
+import pulsarpy.models as models
+
+
+def test_merge_arrays_keeps_order_and_leaves_payload_alone():
+    payload = {"library_ids": [3, 1], "tags": [{"a": 1}], "name": "x"}
+    merged = models.Model.merge_arrays(payload, {"library_ids": [1, 2], "tags": [{"a": 1}, {"b": 2}]})
+    assert merged == {"library_ids": [1, 2, 3], "tags": [{"a": 1}, {"b": 2}], "name": "x"}
+    assert payload == {"library_ids": [3, 1], "tags": [{"a": 1}], "name": "x"}
+
+
+def test_patch_many_appends_to_the_server_arrays(server):
+    rec = server.add_record("Biosample", {"name": "b1", "library_ids": [1, 2]})
+    # Items added by someone else since the record was indexed.
+    server.tables["biosamples"][rec["id"]]["library_ids"] = [1, 2, 5]
+    payload = {"library_ids": [3, 1]}
+    results = models.Biosample.patch_many({rec["id"]: payload})
+    assert results[0].error is None
+    assert server.tables["biosamples"][rec["id"]]["library_ids"] == [1, 2, 5, 3]
+    assert payload == {"library_ids": [3, 1]}
+
+
+def test_patch_many_reads_arrays_in_bulk(server):
+    recs = [server.add_record("Biosample", {"name": "b{}".format(i), "library_ids": [i]}) for i in range(5)]
+    # A record whose document lacks the field is fetched from the API.
+    recs.append(server.add_record("Biosample", {"name": "b5"}))
+    server.request_counts.clear()
+    results = models.Biosample.patch_many({x["id"]: {"library_ids": [10]} for x in recs})
+    assert all(x.error is None for x in results)
+    assert server.tables["biosamples"][recs[2]["id"]]["library_ids"] == [2, 10]
+    assert server.tables["biosamples"][recs[5]["id"]]["library_ids"] == [10]
+    # Leaves out the Elasticsearch client's product check.
+    server.request_counts.pop(("GET", "/"), None)
+    assert server.request_counts == {
+        ("POST", "/biosamples/_mget"): 1,
+        ("GET", "/api/biosamples/:id"): 1,
+        ("PATCH", "/api/biosamples/:id"): 6
+    }
+
+
+def test_patch_many_fresh_reads_arrays_from_api(server):
+    recs = [server.add_record("Biosample", {"name": "b{}".format(i), "library_ids": [i]}) for i in range(3)]
+    server.request_counts.clear()
+    models.Biosample.patch_many({x["id"]: {"library_ids": [10]} for x in recs}, fresh=True)
+    assert server.request_counts[("GET", "/api/biosamples/:id")] == 3
+    assert ("POST", "/biosamples/_mget") not in server.request_counts
+
+
+def test_save_appends_to_the_server_arrays(server):
+    rec = server.add_record("Biosample", {"name": "b1", "library_ids": [1, 2]})
+    biosample = models.Biosample(rec["id"])
+    server.tables["biosamples"][rec["id"]]["library_ids"] = [1, 2, 9]
+    biosample.library_ids.append(5)
+    biosample.save()
+    assert server.tables["biosamples"][rec["id"]]["library_ids"] == [1, 2, 9, 5]
+
+
+def test_bulk_create_keeps_outcomes_of_earlier_chunks(server, monkeypatch):
+    monkeypatch.setattr(models, "BULK_CREATE_CHUNK_SIZE", 3)
+    send_request = models.send_request
+    chunks = []
+
+    def failing_second_chunk(method, url, *args, **kwargs):
+        if url.endswith("bulk_create"):
+            chunks.append(url)
+            if len(chunks) == 2:
+                raise requests.exceptions.ConnectionError("Connection reset")
+        return send_request(method, url, *args, **kwargs)
+
+    monkeypatch.setattr(models, "send_request", failing_second_chunk)
+    results = models.Vendor.post_many([{"name": "v{}".format(i)} for i in range(8)])
+    assert [type(x.error).__name__ if x.error else x.value["name"] for x in results] == [
+        "v0", "v1", "v2", "ConnectionError", "ConnectionError", "ConnectionError", "v6", "v7"]
+    assert sorted(x["name"] for x in server.tables["vendors"].values()) == ["v0", "v1", "v2", "v6", "v7"]
+
+
+def test_bulk_create_fails_chunk_on_error_status(server, monkeypatch):
+    monkeypatch.setattr(models, "BULK_CREATE_CHUNK_SIZE", 2)
+    models.Vendor.post_many([{"name": "v0"}])
+    server.error_rate = 1.0
+    results = models.Vendor.post_many([{"name": "v1"}, {"name": "v2"}])
+    assert all(isinstance(x.error, requests.exceptions.HTTPError) for x in results)
+
+
+def test_post_many_creates_shared_paired_barcode_once(server):
+    kit = server.add_record("SequencingLibraryPrepKit", {"name": "kit"})
+    for index_number, sequence in ((1, "ACGT"), (2, "GGCC")):
+        server.add_record("Barcode", {"name": sequence, "sequence": sequence, "index_number": index_number,
+                                      "sequencing_library_prep_kit_id": kit["id"]})
+    payloads = [{"name": "L{}".format(i), "sequencing_library_prep_kit_id": "kit", "paired_barcode_id": "ACGT-GGCC"} for i in range(6)]
+    results = models.Library.post_many(payloads)
+    assert all(x.error is None for x in results)
+    assert len(server.tables["paired_barcodes"]) == 1
+
+
+def test_load_bundle_requires_bundle_include(server):
+    rec = server.add_record("Biosample", {"name": "b1"})
+    with pytest.raises(TypeError):
+        models.Biosample(rec["id"]).load_bundle()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pulsarpy.models as models
+from pulsarpy import concurrency
+
+
+def test_lookup_after_build(server):
+    server.add_record("Vendor", {"name": "Acme"})
+    assert models.NAME_INDEX.lookup("vendors", "acme") == []
+    assert models.Vendor.build_name_index() == 1
+    assert models.NAME_INDEX.is_built("vendors")
+    assert models.NAME_INDEX.lookup("vendors", " ACME ") == [1]
+    models.NAME_INDEX.clear("vendors")
+    assert not models.NAME_INDEX.is_built("vendors")
+
+
+def test_concurrent_lookups_start_a_single_update(server):
+    server.latency = 0.01
+    for i in range(20):
+        server.add_record("Vendor", {"name": "v{}".format(i)})
+    models.Vendor.build_name_index()
+    # Make the index due for an update.
+    models.NAME_INDEX._refreshed.clear()
+    server.request_counts.clear()
+    results = concurrency.bulk_map(lambda i: models.NAME_INDEX.lookup("vendors", "v{}".format(i % 20)), list(range(64)))
+    assert all(x.value for x in results)
+    assert server.request_counts[("POST", "/vendors/_search")] == 1
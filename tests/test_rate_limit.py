@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import time
+
+import pytest
+
+from pulsarpy import rate_limit
+
+
+def test_parse_rate():
+    assert rate_limit.parse_rate("20") == (20.0, 20.0)
+    assert rate_limit.parse_rate("20:50") == (20.0, 50.0)
+    # The burst holds at least one request.
+    assert rate_limit.parse_rate("0.5") == (0.5, 1.0)
+
+
+@pytest.mark.parametrize("spec", ["0", "-1:5", "0.5:0.5", "10:0"])
+def test_parse_rate_rejects_unusable_specs(spec):
+    with pytest.raises(ValueError):
+        rate_limit.parse_rate(spec)
+
+
+def test_bucket_rejects_burst_below_one(tmp_path):
+    with pytest.raises(ValueError):
+        rate_limit.TokenBucket("test", 0.5, 0.5, state_dir=str(tmp_path))
+
+
+def test_acquire_rejects_more_tokens_than_the_burst(tmp_path):
+    bucket = rate_limit.TokenBucket("test", 10, 2, state_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        bucket.acquire(3)
+
+
+def test_acquire_waits_for_tokens(tmp_path):
+    bucket = rate_limit.TokenBucket("test", 20, 2, state_dir=str(tmp_path))
+    start = time.time()
+    for _ in range(4):
+        bucket.acquire()
+    # The burst covers two requests, the other two wait 1/20 s each.
+    assert time.time() - start >= 0.09
+
+
+def test_buckets_share_state_through_the_file(tmp_path):
+    first = rate_limit.TokenBucket("test", 1, 1, state_dir=str(tmp_path))
+    second = rate_limit.TokenBucket("test", 1, 1, state_dir=str(tmp_path))
+    first.acquire()
+    assert second._take(1) > 0
+
+
+def test_set_rate(monkeypatch):
+    monkeypatch.setattr(rate_limit, "BUCKETS", {})
+    rate_limit.set_rate(rate_limit.RAILS_READ, 5)
+    assert rate_limit.BUCKETS[rate_limit.RAILS_READ].burst == 5
+    rate_limit.set_rate(rate_limit.RAILS_READ, None)
+    assert rate_limit.BUCKETS == {}
+    with pytest.raises(ValueError):
+        rate_limit.set_rate("other", 5)
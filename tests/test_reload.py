@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+import pulsarpy.models as models
+
+
+def test_reload_keeps_unchanged_record(server):
+    rec = server.add_record("Vendor", {"name": "acme"})
+    vendor = models.Vendor(rec["id"])
+    assert vendor.etag
+    assert vendor.reload() is False
+    assert vendor.attrs["name"] == "acme"
+
+
+def test_reload_picks_up_changes(server):
+    rec = server.add_record("Vendor", {"name": "acme"})
+    vendor = models.Vendor(rec["id"])
+    etag = vendor.etag
+    server.tables["vendors"][rec["id"]]["description"] = "changed"
+    assert vendor.reload() is True
+    assert vendor.attrs["description"] == "changed"
+    assert vendor.etag != etag
+    assert vendor.reload() is False
+
+
+def test_reload_of_deleted_record(server):
+    rec = server.add_record("Vendor", {"name": "acme"})
+    vendor = models.Vendor(rec["id"])
+    del server.tables["vendors"][rec["id"]]
+    with pytest.raises(models.RecordNotFound):
+        vendor.reload()
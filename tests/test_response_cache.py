@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+import pulsarpy.models as models
+from pulsarpy.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(server, tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "http_cache.sqlite"), default_ttl=600)
+    models.use_response_cache(cache)
+    yield cache
+    models.use_response_cache(None)
+
+
+def test_get_is_served_from_cache(server, cache):
+    rec = server.add_record("Vendor", {"name": "v1", "description": "a"})
+    models.Vendor(rec["id"])
+    server.tables["vendors"][rec["id"]]["description"] = "b"
+    assert models.Vendor(rec["id"]).description == "a"
+
+
+def test_reload_without_validators_bypasses_cache(server, cache):
+    rec = server.add_record("Vendor", {"name": "v1", "description": "a"})
+    vendor = models.Vendor(rec["id"])
+    vendor.__dict__["etag"] = None
+    vendor.__dict__["last_modified"] = None
+    server.tables["vendors"][rec["id"]]["description"] = "b"
+    assert vendor.reload()
+    assert vendor.description == "b"
+    # The fresh response replaced the cached one.
+    assert models.Vendor(rec["id"]).description == "b"
+
+
+def test_patch_invalidates_cached_record(server, cache):
+    rec = server.add_record("Vendor", {"name": "v1", "description": "a"})
+    vendor = models.Vendor(rec["id"])
+    vendor.patch({"description": "b"})
+    assert models.Vendor(rec["id"]).description == "b"
+
+
+def test_find_by_keeps_cached_records(server, cache):
+    rec = server.add_record("Vendor", {"name": "v1", "description": "a"})
+    models.Vendor(rec["id"])
+    server.tables["vendors"][rec["id"]]["description"] = "b"
+    models.Vendor.find_by({"name": "v1"})
+    assert models.Vendor(rec["id"]).description == "a"
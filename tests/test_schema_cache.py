@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pulsarpy.models as models
+
+ROUTE = ("GET", "/api/utils/model_attrs")
+
+
+def test_fresh_schema_is_used_without_a_request(server):
+    server.schemas["Biosample"] = ["id", "name"]
+    assert models.get_model_attrs("Biosample") == ["id", "name"]
+    assert models.get_model_attrs("Biosample") == ["id", "name"]
+    assert server.request_counts[ROUTE] == 1
+    assert models.SCHEMA_CACHE.read("Biosample")["etag"]
+
+
+def test_unchanged_schema_is_revalidated_with_a_304(server, monkeypatch):
+    server.schemas["Biosample"] = ["id", "name"]
+    models.get_model_attrs("Biosample")
+    statuses = []
+    send_request = models.send_request
+
+    def recording_send_request(*args, **kwargs):
+        res = send_request(*args, **kwargs)
+        statuses.append(res.status_code)
+        return res
+
+    monkeypatch.setattr(models, "send_request", recording_send_request)
+    fetched_at = models.SCHEMA_CACHE.read("Biosample")["fetched_at"]
+    assert models.get_model_attrs("Biosample", refresh=True) == ["id", "name"]
+    assert statuses == [304]
+    # The 304 marks the entry as freshly validated.
+    assert models.SCHEMA_CACHE.read("Biosample")["fetched_at"] >= fetched_at
+
+
+def test_stale_schema_is_downloaded_again_when_changed(server, monkeypatch):
+    server.schemas["Biosample"] = ["id", "name"]
+    models.get_model_attrs("Biosample")
+    monkeypatch.setattr(models.SCHEMA_CACHE, "max_age", 0)
+    server.schemas["Biosample"] = ["id", "name", "notes"]
+    assert models.get_model_attrs("Biosample") == ["id", "name", "notes"]
+    assert models.SCHEMA_CACHE.read("Biosample")["attrs"] == ["id", "name", "notes"]
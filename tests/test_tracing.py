@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import json
+
+import pytest
+
+import pulsarpy.models as models
+from pulsarpy import concurrency, tracing
+
+
+@pytest.fixture
+def exporter():
+    exporter = tracing.MemoryExporter()
+    tracing.add_exporter(exporter)
+    yield exporter
+    tracing.remove_exporter(exporter)
+
+
+class Thing():
+
+    @tracing.traced(attrs=["name"])
+    def lookup(self, name, other=None):
+        return name.upper()
+
+
+def test_spans_are_off_without_exporters(monkeypatch):
+    monkeypatch.setattr(tracing, "EXPORTERS", [])
+    with tracing.span("op") as sp:
+        assert sp is None
+    assert Thing().lookup("a") == "A"
+
+
+def test_nested_spans_and_errors(exporter):
+    with pytest.raises(ValueError):
+        with tracing.span("outer", a=1):
+            with tracing.span("inner"):
+                pass
+            raise ValueError("boom")
+    inner, outer = exporter.spans
+    assert inner.parent_id == outer.span_id
+    assert inner.trace_id == outer.trace_id == outer.span_id
+    assert outer.attrs == {"a": 1}
+    assert outer.error == "ValueError('boom')"
+    assert inner.error is None
+    assert outer.duration >= inner.duration
+    assert tracing.current_span() is None
+
+
+def test_traced_names_spans_after_the_class(exporter):
+    assert Thing().lookup("a", other=2) == "A"
+    assert [(x.name, x.attrs) for x in exporter.spans] == [("Thing.lookup", {"name": "a"})]
+
+
+def test_spans_of_worker_threads_have_the_caller_as_parent(exporter):
+    with tracing.span("batch") as batch:
+        concurrency.bulk_map(lambda x: Thing().lookup(x), ["a", "b", "c"])
+    lookups = [x for x in exporter.spans if x.name == "Thing.lookup"]
+    assert len(lookups) == 3
+    assert all(x.parent_id == batch.span_id for x in lookups)
+
+
+def test_model_calls_are_traced(server, exporter):
+    models.Vendor.post({"name": "v"})
+    names = [x.name for x in exporter.spans]
+    assert "HTTP POST" in names
+    http = next(x for x in exporter.spans if x.name == "HTTP POST")
+    assert http.attrs["status"] == 201
+
+
+def test_file_exporters(tmp_path):
+    jsonl = tracing.JsonLinesExporter(str(tmp_path / "trace.jsonl"))
+    chrome = tracing.ChromeTraceExporter(str(tmp_path / "trace.json"))
+    tracing.add_exporter(jsonl)
+    tracing.add_exporter(chrome)
+    try:
+        with tracing.span("outer"):
+            with tracing.span("inner", name="x"):
+                pass
+    finally:
+        tracing.remove_exporter(jsonl)
+        tracing.remove_exporter(chrome)
+    lines = [json.loads(x) for x in (tmp_path / "trace.jsonl").read_text().splitlines()]
+    assert [x["name"] for x in lines] == ["inner", "outer"]
+    assert lines[0]["parent_id"] == lines[1]["span_id"]
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert [(x["name"], x["ph"]) for x in events] == [("inner", "X"), ("outer", "X")]
+    assert events[0]["args"]["name"] == "x"
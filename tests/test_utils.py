@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pytest
+
+from pulsarpy import utils
+
+
+def _add_sreqs(server):
+    statuses = ["not started", "started", "started", "finished", "trouble-shooting", "finished", "finished"]
+    return [server.add_record("SequencingRequest", {"name": "sr{}".format(i), "status": x}) for i, x in enumerate(statuses)]
+
+
+def test_sreqs_by_status_excludes_statuses_containing_it(server):
+    sreqs = _add_sreqs(server)
+    found = sorted(x["id"] for x in utils.sreqs_by_status("started"))
+    assert found == [sreqs[1]["id"], sreqs[2]["id"]]
+    assert [x["name"] for x in utils.sreqs_by_status("not started", fields=["name"])] == ["sr0"]
+    with pytest.raises(ValueError):
+        list(utils.sreqs_by_status("paused"))
+
+
+def test_sreq_status_summary_makes_one_request(server):
+    _add_sreqs(server)
+    server.request_counts.clear()
+    summary = utils.sreq_status_summary()
+    assert summary == {"not started": 1, "started": 2, "trouble-shooting": 1, "failed": 0, "finished": 3}
+    server.request_counts.pop(("GET", "/"), None)
+    assert server.request_counts == {("POST", "/sequencing_requests/_search"): 1}
+
+
+def test_get_exps_of_biosamples_fetches_each_experiment_once(server):
+    chip = server.add_record("ChipseqExperiment", {"name": "chip"})
+    ssc = server.add_record("SingleCellSorting", {"name": "ssc"})
+    recs = [server.add_record("Biosample", {"name": "b{}".format(i), "chipseq_experiment_id": chip["id"]}) for i in range(3)]
+    recs.append(server.add_record("Biosample", {"name": "sorted", "sorting_biosample_single_cell_sorting_id": ssc["id"]}))
+    recs.append(server.add_record("Biosample", {"name": "loose"}))
+    server.request_counts.clear()
+    # Biosamples can be given as records or by reference.
+    exps = utils.get_exps_of_biosamples([recs[0], recs[1]["id"], "b2", recs[3]["id"], recs[4]["id"]])
+    assert {k: v and (v["type"], v["record"].id) for k, v in exps.items()} == {
+        recs[0]["id"]: ("chipseq_experiment", chip["id"]),
+        recs[1]["id"]: ("chipseq_experiment", chip["id"]),
+        recs[2]["id"]: ("chipseq_experiment", chip["id"]),
+        recs[3]["id"]: ("single_cell_sorting", ssc["id"]),
+        recs[4]["id"]: None
+    }
+    assert server.request_counts[("GET", "/api/chipseq_experiments/:id")] == 1
+    assert server.request_counts[("GET", "/api/single_cell_sortings/:id")] == 1
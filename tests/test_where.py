@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+###
+# © 2018 The Board of Trustees of the Leland Stanford Junior University
+# Nathaniel Watson
+# nathankw@stanford.edu
+###
+
+import pulsarpy.models as models
+
+
+def _add_biosamples(server):
+    names = ["acme", "ACME ", "acme two", "other"]
+    return [server.add_record("Biosample", {"name": x, "passage_number": 1}) for x in names]
+
+
+def test_where_matches_strings_exactly(server):
+    recs = _add_biosamples(server)
+    found = sorted(x["id"] for x in models.Biosample.where(name="acme"))
+    assert found == sorted([recs[0]["id"], recs[1]["id"]])
+
+
+def test_count_agrees_with_where(server):
+    _add_biosamples(server)
+    criteria = [{"name": "acme"}, {"name": "acme", "passage_number": 1}, {"passage_number": 1}]
+    for crit in criteria:
+        assert models.Biosample.count(**crit) == len(list(models.Biosample.where(**crit)))
+    assert models.Biosample.count(name="acme") == 2
+
+
+def test_where_returns_only_the_requested_fields(server):
+    _add_biosamples(server)
+    recs = list(models.Biosample.where(fields=["id"], name="acme"))
+    assert len(recs) == 2
+    assert all(list(x) == ["id"] for x in recs)